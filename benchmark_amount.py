@@ -0,0 +1,95 @@
+"""
+Module: benchmark_amount.py
+
+Description:
+Compare the two ways of extracting the amounts of a line:
+- extract_amount() from main_handler_amount.py (the reference, with regular expressions);
+- lex_amount() from main_handler_amount_lexer.py (one pass over the tokens of the text, used by process_line()).
+For each line of the given texts, the script checks that both give exactly the same record (amounts, sub-parts, currencies, uncertainties) and measures the number of lines processed per second by each of them.
+
+Run it after each change of the rules of amounts:
+    >>> python benchmark_amount.py test/data/raw/_all/
+    >>> python benchmark_amount.py ASV_intr.ex.194.txt --repeat 10
+
+"""
+
+# Import libraries
+# ------------------------------------------
+import argparse # to read the arguments of the command line
+import os # to list the files of a directory
+import time # to measure the processing time
+
+# Import custom functions
+# ------------------------------------------
+from main_handler_amount import extract_amount
+from main_handler_amount_lexer import lex_amount
+
+
+# Read all lines of the texts (files or directories of .txt files)
+# ------------------------------------------
+def read_texts(paths):
+    lines = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            files = [os.path.join(path, file) for file in sorted(os.listdir(path)) if file.endswith('.txt')]
+        else:
+            files = [path]
+
+        for file in files:
+            with open(file, 'r', encoding='utf-8') as text_file:
+                lines.extend(line.strip() for line in text_file if line.strip())
+
+    return lines
+
+
+# Measure the lines per second of one function
+# ------------------------------------------
+def measure(extract, lines, repeat):
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        for line in lines:
+            extract(line)
+    elapsed_seconds = time.perf_counter() - start_time
+    return len(lines) * repeat / elapsed_seconds if elapsed_seconds else float('inf')
+
+
+# Compare the records and the speed
+# ------------------------------------------
+def run_benchmark(lines, repeat=3):
+
+    # 1. Same records
+    differences = []
+    for line in lines:
+        if extract_amount(line) != lex_amount(line):
+            differences.append(line)
+
+    print(f"Lines: {len(lines)}, lines with amounts: {sum(1 for line in lines if extract_amount(line))}")
+    if differences:
+        print(f"DIFFERENT records for {len(differences)} lines, for example:")
+        for line in differences[:10]:
+            print(f"    {line}")
+    else:
+        print("Same records for all lines")
+
+    # 2. Speed
+    lines_per_second_regex = measure(extract_amount, lines, repeat)
+    lines_per_second_lexer = measure(lex_amount, lines, repeat)
+    print(f"extract_amount() (regex): {lines_per_second_regex:,.0f} lines/s")
+    print(f"lex_amount()     (lexer): {lines_per_second_lexer:,.0f} lines/s ({lines_per_second_lexer / lines_per_second_regex:.2f} x)")
+
+    return not differences
+
+
+
+# ==============================
+# Processing
+# ==============================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that lex_amount() gives the same records as extract_amount() and compare their speed.")
+    parser.add_argument("paths", nargs='*', default=['test/data/raw/_all/'], help="text files or directories with text files")
+    parser.add_argument("--repeat", type=int, default=3, help="number of times each line is processed to measure the speed")
+    arguments = parser.parse_args()
+
+    run_benchmark(read_texts(arguments.paths), arguments.repeat)
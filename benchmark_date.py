@@ -0,0 +1,104 @@
+"""
+Module: benchmark_date.py
+
+Description:
+Compare the two ways of standardizing the dates:
+- the reference: extract_roman_numerals(), convert_roman_to_arabic(), then find_day(), find_year() and find_month() from main_handler_date.py (as standardize_date() did before parse_date());
+- standardize_date() from main_handler_date.py, which finds the day, the month and the year in one pass (parse_date()), measured without and with the memory of parsed dates (find_date_mentions(), see date_cache_statistics()).
+Each line of the given files is a date extracted from text (for example the column start_date_extracted of the table "date", or any line of the texts).
+The dates are processed in order, each one with the previous standardized date (as in process_date()).
+The script checks that both give exactly the same dates and uncertainties, and measures the number of dates processed per second by each of them.
+
+    >>> python benchmark_date.py dates.txt
+    >>> python benchmark_date.py test/data/raw/_all/ --repeat 10
+
+"""
+
+# Import libraries
+# ------------------------------------------
+import argparse # to read the arguments of the command line
+import time # to measure the processing time
+
+# Import custom functions
+# ------------------------------------------
+from benchmark_amount import read_texts
+from main_handler_date import standardize_date, standardize_date_mentions, find_date_mentions, extract_roman_numerals, convert_roman_to_arabic, find_day, find_year, find_month, date_cache_statistics, clear_date_caches
+
+
+# Reference: standardize one date with find_day(), find_year() and find_month()
+# ------------------------------------------
+def standardize_date_reference(date_extracted, previous_date_standardized='1000-01-01'):
+    arabic_numerals, date_uncertainty = convert_roman_to_arabic(extract_roman_numerals(date_extracted))
+    day, day_count = find_day(date_extracted, arabic_numerals, previous_date_standardized)
+    year, year_count = find_year(arabic_numerals, previous_date_standardized)
+    month, month_count = find_month(date_extracted, previous_date_standardized)
+
+    if day_count != 1 or year_count > 1 or month_count != 1:
+        date_uncertainty += 1
+
+    return f"{year}-{month.zfill(2)}-{day.zfill(2)}", date_uncertainty
+
+
+# Standardize all dates in order (each one with the previous standardized date)
+# ------------------------------------------
+def standardize_dates(standardize, dates_extracted):
+    dates_standardized = []
+    previous_date_standardized = '1000-01-01'
+    for date_extracted in dates_extracted:
+        date_standardized, date_uncertainty = standardize(date_extracted, previous_date_standardized)
+        dates_standardized.append((date_standardized, date_uncertainty))
+        previous_date_standardized = date_standardized
+    return dates_standardized
+
+
+# Measure the dates per second of one function
+# ------------------------------------------
+def measure(standardize, dates_extracted, repeat):
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        clear_date_caches() # each repetition starts with an empty memory
+        standardize_dates(standardize, dates_extracted)
+    elapsed_seconds = time.perf_counter() - start_time
+    return len(dates_extracted) * repeat / elapsed_seconds if elapsed_seconds else float('inf')
+
+
+# Compare the dates and the speed
+# ------------------------------------------
+def run_benchmark(dates_extracted, repeat=3):
+
+    # 1. Same dates
+    dates_reference = standardize_dates(standardize_date_reference, dates_extracted)
+    dates_parsed = standardize_dates(standardize_date, dates_extracted)
+    differences = [(date_extracted, reference, parsed) for date_extracted, reference, parsed in zip(dates_extracted, dates_reference, dates_parsed) if reference != parsed]
+
+    print(f"Dates: {len(dates_extracted)}")
+    if differences:
+        print(f"DIFFERENT dates for {len(differences)} texts, for example:")
+        for date_extracted, reference, parsed in differences[:10]:
+            print(f"    {date_extracted}: {reference} / {parsed}")
+    else:
+        print("Same dates and uncertainties for all texts")
+
+    # 2. Speed
+    dates_per_second_reference = measure(standardize_date_reference, dates_extracted, repeat)
+    dates_per_second_parsed = measure(lambda date_extracted, previous_date_standardized: standardize_date_mentions(find_date_mentions.__wrapped__(date_extracted), previous_date_standardized), dates_extracted, repeat) # without the memory
+    dates_per_second_memory = measure(standardize_date, dates_extracted, repeat)
+    print(f"find_day/find_year/find_month (reference): {dates_per_second_reference:,.0f} dates/s")
+    print(f"standardize_date()           (one pass): {dates_per_second_parsed:,.0f} dates/s ({dates_per_second_parsed / dates_per_second_reference:.2f} x)")
+    print(f"standardize_date()   (one pass + memory): {dates_per_second_memory:,.0f} dates/s ({dates_per_second_memory / dates_per_second_reference:.2f} x), {date_cache_statistics()['find_date_mentions']}")
+
+    return not differences
+
+
+
+# ==============================
+# Processing
+# ==============================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that standardize_date() gives the same dates as find_day(), find_year() and find_month() and compare their speed.")
+    parser.add_argument("paths", nargs='*', default=['test/data/raw/_all/'], help="text files (one date per line) or directories with text files")
+    parser.add_argument("--repeat", type=int, default=3, help="number of times each date is processed to measure the speed")
+    arguments = parser.parse_args()
+
+    run_benchmark(read_texts(arguments.paths), arguments.repeat)
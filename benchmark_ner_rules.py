@@ -0,0 +1,118 @@
+"""
+Module: benchmark_ner_rules.py
+
+Description:
+Compare the entities DATE and AMOUNT found by the rules (RuleNerModel, see main_handler_ner_rules.py) with the entities found by the trained spaCy model, on a sample of texts.
+The entities of the model are the reference:
+- precision: part of the entities of the rules which are also found by the model (same label, same start and end in the line);
+- recall: part of the entities of the model which are also found by the rules;
+- partly found: entities of the model which overlap an entity of the rules with the same label, but don't have exactly the same start and end.
+The script also compares what is written into the database: the lines with the same type of line (assign_line_type()) and with the same standardized start date (extract_date()).
+Finally, it measures the number of lines processed per second by the model and by the rules.
+
+    >>> python benchmark_ner_rules.py test/data/raw/_all/23_ASV_intr.ex.194.txt
+    >>> python benchmark_ner_rules.py test/data/raw/_all/ --model training/training-itself/full/models/model-best
+
+"""
+
+# Import libraries
+# ------------------------------------------
+import argparse # to read the arguments of the command line
+import time # to measure the processing time
+
+# Import custom functions
+# ------------------------------------------
+from benchmark_amount import read_texts
+from main_service_ner import load_model
+from main_handler_ner import index_line_entities
+from main_handler_ner_rules import RuleNerModel
+from main_handler_utils import assign_line_type
+from main_handler_date import extract_date
+
+
+labels = ("DATE", "AMOUNT")
+
+
+# Process all lines with one model and measure the lines per second
+# ------------------------------------------
+def process_lines(nlp_model, lines, batch_size=256):
+    start_time = time.perf_counter()
+    lines_nlp = [index_line_entities(line_nlp) for line_nlp in nlp_model.pipe(lines, batch_size=batch_size)]
+    elapsed_seconds = time.perf_counter() - start_time
+    return lines_nlp, len(lines) / elapsed_seconds if elapsed_seconds else float('inf')
+
+
+# Compare the entities of one label
+# ------------------------------------------
+def compare_entities(lines_model, lines_rules, label):
+    count_model = count_rules = count_same = count_partly = 0
+
+    for line_model, line_rules in zip(lines_model, lines_rules):
+        spans_model = {(ent.start_char, ent.end_char) for ent in line_model.ents if ent.label_ == label}
+        spans_rules = {(ent.start_char, ent.end_char) for ent in line_rules.ents if ent.label_ == label}
+
+        count_model += len(spans_model)
+        count_rules += len(spans_rules)
+        count_same += len(spans_model & spans_rules)
+        count_partly += sum(1 for start, end in spans_model - spans_rules if any(start < rule_end and rule_start < end for rule_start, rule_end in spans_rules))
+
+    return {
+        "model": count_model,
+        "rules": count_rules,
+        "precision": round(count_same / count_rules, 3) if count_rules else 0.0,
+        "recall": round(count_same / count_model, 3) if count_model else 0.0,
+        "partly_found": count_partly
+    }
+
+
+# Compare the type of line and the start date (the dates are standardized in order, each one with the previous date)
+# ------------------------------------------
+def compare_lines(lines, lines_model, lines_rules):
+    same_type = same_date = 0
+    previous_date_model = previous_date_rules = '1000-01-01'
+
+    for line, line_model, line_rules in zip(lines, lines_model, lines_rules):
+        line_type_model = assign_line_type(line, line_model)
+        line_type_rules = assign_line_type(line, line_rules)
+        date_model, previous_date_model = extract_date(line, line_type_model, line_model, previous_date_model)
+        date_rules, previous_date_rules = extract_date(line, line_type_rules, line_rules, previous_date_rules)
+
+        same_type += line_type_model == line_type_rules
+        same_date += date_model["start_date_standardized"] == date_rules["start_date_standardized"]
+
+    return same_type, same_date
+
+
+# Compare the rules with the model
+# ------------------------------------------
+def run_benchmark(nlp_model, lines, batch_size=256):
+    lines_model, lines_per_second_model = process_lines(nlp_model, lines, batch_size)
+    lines_rules, lines_per_second_rules = process_lines(RuleNerModel(), lines, batch_size)
+
+    # 1. Entities
+    print(f"Lines: {len(lines)}")
+    for label in labels:
+        print(f"{label}: {compare_entities(lines_model, lines_rules, label)}")
+
+    # 2. Data of lines
+    same_type, same_date = compare_lines(lines, lines_model, lines_rules)
+    print(f"Same type of line: {same_type / len(lines):.1%}, same start date: {same_date / len(lines):.1%}")
+
+    # 3. Speed
+    print(f"Trained model: {lines_per_second_model:,.0f} lines/s")
+    print(f"Rules:         {lines_per_second_rules:,.0f} lines/s ({lines_per_second_rules / lines_per_second_model:.1f} x)")
+
+
+
+# ==============================
+# Processing
+# ==============================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the entities DATE and AMOUNT found by the rules with the entities of the trained model (precision, recall and speed).")
+    parser.add_argument("paths", nargs='*', default=['test/data/raw/_all/'], help="text files or directories with text files")
+    parser.add_argument("--model", default="training/training-itself/full/models/model-best", help="path of the spaCy model (or address of the NER service)")
+    parser.add_argument("--batch-size", type=int, default=256, help="number of lines sent together to the model")
+    arguments = parser.parse_args()
+
+    run_benchmark(load_model(arguments.model), read_texts(arguments.paths), arguments.batch_size)
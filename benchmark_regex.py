@@ -0,0 +1,167 @@
+"""
+Module: benchmark_regex.py
+
+Description:
+Check that no line of text, even a long line of OCR noise, can stop the processing because of a regular expression.
+With some regular expressions, the time grows with the square (or the cube) of the length of the line when no match is found, because the regex tries again from each character (e.g. the old regex of amounts on "I I I I ... I", or the old regex of folios on "[1[1[1...").
+
+The script builds adversarial lines (the worst cases for the regular expressions of each step of extract_line()) with growing lengths, and measures the time of each step on them:
+- the time of one line must stay under --max-seconds;
+- the time must grow as the length of the line (linear): when the length is doubled, the time must be multiplied by less than --max-growth (about 2 for a linear time, about 4 for a square time).
+Then random lines built from pieces of amounts, dates, names and noise are processed by extract_line() and the slowest one is reported (--fuzz).
+The script returns an error code if one check fails.
+
+    >>> python benchmark_regex.py
+    >>> python benchmark_regex.py --max-seconds 0.05 --fuzz 20000
+
+"""
+
+# Import libraries
+# ------------------------------------------
+import argparse # to read the arguments of the command line
+import random # to build random lines
+import sys # to return the error code
+import time # to measure the processing time
+
+# Import custom functions
+# ------------------------------------------
+from main_handler_amount import extract_amount
+from main_handler_amount_lexer import lex_amount
+from main_handler_date import extract_roman_numerals, process_date
+from main_handler_ner import LineEntities, EntitySpan
+from main_handler_utils import folio_extraction, extract_participants, process_rubric_subrubric_from_text, assign_line_type
+from main_processor_line import extract_line
+
+
+# ==============================
+# Steps to measure
+# ==============================
+
+# The whole line is given as entity of each label, so the functions of the entities read all the text
+def line_entities(line):
+    return LineEntities(line, [EntitySpan(line, label, 0, len(line)) for label in ("DATE", "AMOUNT", "PRODUCT", "PERSON_PAYEE")])
+
+
+def new_state():
+    return {"line_number": 0, "folio_previous": "", "previous_date_standardized": '1000-01-01', "participant_previous": "", "rubric_extracted_id": None, "subrubric_extracted_id": None}
+
+
+steps = {
+    "extract_amount": extract_amount,
+    "lex_amount": lex_amount,
+    "folio_extraction": folio_extraction,
+    "participants": lambda line: extract_participants(line_entities(line), ""),
+    "rubric": lambda line: process_rubric_subrubric_from_text("RUBRIC_NAME " + line, 'rubric'),
+    "roman_numerals": extract_roman_numerals,
+    "date": lambda line: process_date([line]),
+    "line_type": lambda line: assign_line_type(line, line_entities(line)),
+    "extract_line": lambda line: extract_line(line, line_entities(line), new_state())
+}
+
+
+# ==============================
+# Adversarial lines
+# ==============================
+
+"""
+Each function returns a line of about n characters.
+"""
+
+adversarial_lines = {
+    "roman numerals and spaces": lambda n: ": " + "I " * (n // 2),
+    "roman numerals": lambda n: ": " + "I" * n,
+    "minus": lambda n: ": " + "minus " * (n // 6) + "X",
+    "units": lambda n: ": " + "I l " * (n // 4) + "1",
+    "currencies": lambda n: ": I " + "fl " * (n // 3),
+    "dots": lambda n: ": I l" + "." * n + " x",
+    "brackets and digits": lambda n: "[1" * (n // 2),
+    "brackets": lambda n: "[" * n + "1",
+    "lowercase words": lambda n: "Petro " + "ab" * (n // 2) + " 1",
+    "spaces": lambda n: "Petro" + " " * n + "a",
+    "punctuation": lambda n: "Petro" + "!" * n,
+    "names": lambda n: "Ab " * (n // 3),
+    "noise": lambda n: ("I l. M M xx [f." * (n // 16))
+}
+
+fuzz_pieces = ["Item", "die", "XII", "I", "IIII", "VM", "IIIC", "mensis", "maii", "ultima", "eadem", "Petro", "de", "pro", "pane", ":", "l.", "s.", "d.", "fl.", "tur.", "gros.", "minus", "dominus", "singulis", "[f.12v]", "[", "]", "1", "Summa", "septimanarum", "RUBRIC_NAME", ",", ".", "!", "", " ", "  "]
+
+
+# Time of one call
+# ------------------------------------------
+def measure(step, line, repeat=5):
+    best_seconds = float('inf')
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        step(line)
+        best_seconds = min(best_seconds, time.perf_counter() - start_time)
+    return best_seconds
+
+
+
+# ==============================
+# Checks
+# ==============================
+
+def run_benchmark(lengths=(1000, 2000, 4000, 8000), max_seconds=0.1, max_growth=3.0, count_fuzz=5000, seed=0):
+    failures = []
+
+    # 1. Adversarial lines
+    # ------------------------------------------
+    print(f"Adversarial lines ({', '.join(str(length) for length in lengths)} characters), seconds:")
+    for line_name, build_line in adversarial_lines.items():
+        for step_name, step in steps.items():
+            times = [measure(step, build_line(length)) for length in lengths]
+            # the growth is only checked when the time is long enough to be measured
+            growth = max((later / earlier for earlier, later in zip(times, times[1:]) if earlier > 0.001), default=1.0)
+
+            problems = []
+            if times[-1] > max_seconds:
+                problems.append(f"more than {max_seconds} s")
+            if growth > max_growth:
+                problems.append(f"growth {growth:.1f} x")
+            if problems:
+                failures.append(f"{step_name} on {line_name}: {', '.join(problems)}")
+
+            if problems or times[-1] > 0.001:
+                print(f"    {line_name:28} {step_name:18} {' '.join(f'{seconds:.4f}' for seconds in times)}  {'SLOW: ' + ', '.join(problems) if problems else ''}")
+
+    # 2. Random lines
+    # ------------------------------------------
+    randomizer = random.Random(seed)
+    slowest_seconds, slowest_line = 0.0, ""
+    for _ in range(count_fuzz):
+        line = " ".join(randomizer.choice(fuzz_pieces) for _ in range(randomizer.randint(1, 400)))
+        seconds = measure(steps["extract_line"], line, repeat=1)
+        if seconds > slowest_seconds:
+            slowest_seconds, slowest_line = seconds, line
+    print(f"Random lines: {count_fuzz}, slowest extract_line(): {slowest_seconds:.4f} s ({len(slowest_line)} characters)")
+    if slowest_seconds > max_seconds:
+        failures.append(f"extract_line() on a random line: {slowest_seconds:.4f} s: {slowest_line[:200]}")
+
+    # 3. Result
+    # ------------------------------------------
+    if failures:
+        print(f"{len(failures)} checks failed:")
+        for failure in failures:
+            print(f"    {failure}")
+    else:
+        print(f"All lines processed in less than {max_seconds} s with a linear time")
+
+    return not failures
+
+
+
+# ==============================
+# Processing
+# ==============================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that the time of the regular expressions of extract_line() stays bounded and linear on adversarial lines.")
+    parser.add_argument("--max-seconds", type=float, default=0.1, help="maximum time of one line (seconds)")
+    parser.add_argument("--max-growth", type=float, default=3.0, help="maximum growth of the time when the length of the line is doubled")
+    parser.add_argument("--fuzz", type=int, default=5000, help="number of random lines")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random lines")
+    arguments = parser.parse_args()
+
+    success = run_benchmark(max_seconds=arguments.max_seconds, max_growth=arguments.max_growth, count_fuzz=arguments.fuzz, seed=arguments.seed)
+    sys.exit(0 if success else 1)
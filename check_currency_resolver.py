@@ -0,0 +1,131 @@
+"""
+Module: check_currency_resolver.py
+
+Description:
+Check which currency is chosen when many currencies start with the name of currency to search (see find_currency_standardized_id() and CurrencyResolver in main_writer_database.py).
+The choice must stay the same as in the first version of the processing, so the ids are the same as in the data already in the database:
+- in currency_standardized, the only currency found, or the second one (in the order of ids) if many are found;
+- if none is found, the first currency found in currency_variant.
+
+1. Without database: the choice of CurrencyResolver is checked on a small fixed table of currencies (example_currencies), with the expected id for each name to search.
+2. With --database: for each beginning of name (up to --letters letters) of all currencies of the database, and for the special names ("turonensis parvorum", "grossus"),
+   the result of CurrencyResolver is compared with the queries of find_currency_standardized_id(). The names with many currencies are displayed with the currency chosen.
+The script returns an error code if one check fails.
+
+    >>> python check_currency_resolver.py
+    >>> python check_currency_resolver.py --database --letters 3
+
+"""
+
+# Import libraries
+# ------------------------------------------
+import argparse # to read the arguments of the command line
+import sys # to return the error code
+
+# Import custom functions
+# ------------------------------------------
+from main_writer_database import CurrencyResolver, find_currency_standardized_id, normalize_currency_name
+
+
+# ==============================
+# Fixed table of currencies
+# ==============================
+
+# (currency_standardized_id, name), in the order of ids
+example_currencies = {
+    "standardized": [(1, "florenus"), (2, "turonensis grossus"), (3, "grossus"), (4, "turonensis parvorum"), (5, "viennensis"), (6, "libra"), (7, "Florenus papalis")],
+    "variant": [(5, "vien."), (8, "obolus"), (9, "obolus albus"), (1, "flor.")]
+}
+
+# name to search: expected currency_standardized_id
+expected_currencies = {
+    "fl": 7, # florenus and Florenus papalis: the second one
+    "Fl": 7, # without case
+    "flo": 7,
+    "florenus p": 7,
+    "tu": 4, # turonensis grossus and turonensis parvorum: the second one
+    "turonensis parvorum": 4,
+    "grossus": 3, # only one
+    "gr": 3,
+    "vi": 5, # only one in currency_standardized (not searched in currency_variant)
+    "li": 6,
+    "ob": 8, # not in currency_standardized: the first one in currency_variant
+    "obolus a": 9,
+    "xx": None
+}
+
+
+def check_examples():
+    failures = []
+    currency_resolver = CurrencyResolver(None)
+    currency_resolver.load_rows(example_currencies["standardized"], example_currencies["variant"])
+
+    for currency_to_search, expected_id in expected_currencies.items():
+        currency_standardized_id = currency_resolver.resolve(currency_to_search)
+        if currency_standardized_id != expected_id:
+            failures.append(f"'{currency_to_search}': {currency_standardized_id} instead of {expected_id}")
+
+    print(f"Fixed table: {len(expected_currencies) - len(failures)} of {len(expected_currencies)} names give the expected currency")
+    return failures
+
+
+
+# ==============================
+# Currencies of the database
+# ==============================
+
+def check_database(letters=2):
+    from database_config import connect_to_database # only with --database
+
+    failures = []
+    connection = connect_to_database()
+    cursor = connection.cursor(buffered=True)
+    currency_resolver = CurrencyResolver(connection)
+
+    try:
+        # all beginnings of names of currencies
+        cursor.execute("SELECT currency_name FROM currency_standardized UNION ALL SELECT currency_variant_name FROM currency_variant")
+        names = [normalize_currency_name(name) for (name,) in cursor.fetchall() if name]
+        names_to_search = sorted({name[:end] for name in names for end in range(1, letters + 1)} | {"turonensis parvorum", "grossus"})
+
+        for currency_to_search in names_to_search:
+            expected_id = find_currency_standardized_id(cursor, currency_to_search)
+            currency_standardized_id = currency_resolver.resolve(currency_to_search)
+            if currency_standardized_id != expected_id:
+                failures.append(f"'{currency_to_search}': {currency_standardized_id} in memory, {expected_id} with the queries")
+
+            # names with many currencies
+            cursor.execute("SELECT currency_standardized_id, currency_name FROM currency_standardized WHERE currency_name LIKE %s ORDER BY currency_standardized_id", (f"{currency_to_search}%",))
+            found = cursor.fetchall()
+            if len(found) > 1:
+                print(f"    '{currency_to_search}': {len(found)} currencies ({', '.join(f'{name} = {found_id}' for found_id, name in found)}), chosen: {currency_standardized_id}")
+
+        print(f"Database: {len(names_to_search) - len(failures)} of {len(names_to_search)} names give the same currency in memory and with the queries")
+
+    finally:
+        cursor.close()
+        connection.close()
+
+    return failures
+
+
+
+# ==============================
+# Processing
+# ==============================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check which currency is chosen when many currencies start with the name to search.")
+    parser.add_argument("--database", action="store_true", help="also compare the search in memory with the queries on the currencies of the database")
+    parser.add_argument("--letters", type=int, default=2, help="length of the beginnings of names searched in the database")
+    arguments = parser.parse_args()
+
+    failures = check_examples()
+    if arguments.database:
+        failures.extend(check_database(arguments.letters))
+
+    if failures:
+        print(f"{len(failures)} checks failed:")
+        for failure in failures:
+            print(f"    {failure}")
+    sys.exit(1 if failures else 0)
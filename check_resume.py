@@ -0,0 +1,141 @@
+"""
+Module: check_resume.py
+
+Description:
+Check that a document is never inserted twice with resume=True (see the checkpoints in main_processor_line.py), in particular without commit_every (one commit at the end of the document).
+
+The script processes a small generated text as the lines of a test document (the document must exist in the table "document" and have no lines), with the fast rules of NER (RuleNerModel, the spaCy model is not needed):
+1. resume=True without commit_every, twice: the second processing must find the checkpoint "completed" and insert nothing;
+2. the checkpoint is deleted, then resume=True again: the processing must stop with an error (the document has lines but no checkpoint) and insert nothing;
+3. the same as 1. with commit_every.
+At the end, the lines of the test document (with their products, participants and amounts) and its checkpoint are deleted. The script returns an error code if one check fails.
+Use a test database (see database_config.py), not the database of the project.
+
+    >>> python check_resume.py --document-id 9999
+
+"""
+
+# Import libraries
+# ------------------------------------------
+import argparse # to read the arguments of the command line
+import sys # to return the error code
+
+# Import custom functions
+# ------------------------------------------
+from database_config import connect_to_database
+from main_processor_line import process_line
+from main_handler_ner_rules import RuleNerModel
+
+
+# ==============================
+# Test document
+# ==============================
+
+def generate_text(count_lines):
+    lines = ["RUBRIC_NAME Pro coquina", "Anno Domini millesimo CCCXVI, die XII mensis augusti [f.1]"]
+    for line_number in range(count_lines):
+        lines.append(f"Item die {'XIIII' if line_number % 2 else 'XV'} mensis augusti Petro Rostagni pro pane : {'X' * (line_number % 3 + 1)} fl.")
+        if line_number % 50 == 49:
+            lines.append("SUBRUBRIC_NAME Pro vino")
+    return lines
+
+
+def count_lines(connection, document_id):
+    cursor = connection.cursor(buffered=True)
+    cursor.execute("SELECT COUNT(*) FROM line WHERE document_id = %s", (document_id,))
+    count = cursor.fetchone()[0]
+    cursor.close()
+    connection.commit() # new snapshot for the next count
+    return count
+
+
+# Delete the lines of the test document and its checkpoint
+# ------------------------------------------
+def delete_document_lines(connection, document_id):
+    cursor = connection.cursor(buffered=True)
+    cursor.execute("DELETE amount_simple_subpart FROM amount_simple_subpart JOIN amount_simple USING (amount_simple_id) JOIN line ON line.line_id = amount_simple.line_id WHERE line.document_id = %s", (document_id,))
+    for table in ["amount_simple", "amount_composite", "product", "participant", "exchange_rate_internal_reference"]:
+        cursor.execute(f"DELETE {table} FROM {table} JOIN line USING (line_id) WHERE line.document_id = %s", (document_id,))
+    cursor.execute("DELETE FROM line WHERE document_id = %s", (document_id,))
+    cursor.execute("DELETE FROM ingestion_checkpoint WHERE document_id = %s", (document_id,))
+    connection.commit()
+    cursor.close()
+
+
+
+# ==============================
+# Checks
+# ==============================
+
+def run_checks(document_id, class_id='1', lines_to_generate=200):
+    failures = []
+    connection = connect_to_database()
+    nlp_model = RuleNerModel()
+    text = generate_text(lines_to_generate)
+
+    if count_lines(connection, document_id):
+        print(f"The document {document_id} already has lines: use an empty test document")
+        connection.close()
+        return False
+
+    try:
+        for commit_every in [None, 50]:
+            name = f"commit_every = {commit_every}"
+
+            # 1. Twice with resume=True
+            # -------------------------
+            process_line(connection, iter(text), nlp_model, document_id, class_id, commit_every=commit_every, resume=True)
+            count_first = count_lines(connection, document_id)
+            process_line(connection, iter(text), nlp_model, document_id, class_id, commit_every=commit_every, resume=True)
+            count_second = count_lines(connection, document_id)
+            print(f"{name}: {count_first} lines after the first processing, {count_second} after the second one")
+            if count_first != len(text):
+                failures.append(f"{name}: {count_first} lines inserted instead of {len(text)}")
+            if count_second != count_first:
+                failures.append(f"{name}: the document was inserted again with resume=True")
+
+            # 2. Lines without checkpoint
+            # -------------------------
+            cursor = connection.cursor(buffered=True)
+            cursor.execute("DELETE FROM ingestion_checkpoint WHERE document_id = %s", (document_id,))
+            connection.commit()
+            cursor.close()
+            try:
+                process_line(connection, iter(text), nlp_model, document_id, class_id, commit_every=commit_every, resume=True)
+                failures.append(f"{name}: no error for a document with lines but without checkpoint")
+            except ValueError as error:
+                connection.rollback()
+                print(f"{name}: without checkpoint: {error}")
+            if count_lines(connection, document_id) != count_first:
+                failures.append(f"{name}: lines inserted for a document with lines but without checkpoint")
+
+            delete_document_lines(connection, document_id)
+
+    finally:
+        delete_document_lines(connection, document_id)
+        connection.close()
+
+    if failures:
+        print(f"{len(failures)} checks failed:")
+        for failure in failures:
+            print(f"    {failure}")
+    else:
+        print("No document inserted twice with resume=True")
+
+    return not failures
+
+
+
+# ==============================
+# Processing
+# ==============================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that a document is never inserted twice with resume=True (with and without commit_every).")
+    parser.add_argument("--document-id", required=True, help="id of an empty test document (in the table document)")
+    parser.add_argument("--class-id", default='1', help="1 = expense (default), 2 = revenue")
+    parser.add_argument("--lines", type=int, default=200, help="number of generated lines")
+    arguments = parser.parse_args()
+
+    success = run_checks(arguments.document_id, arguments.class_id, arguments.lines)
+    sys.exit(0 if success else 1)
@@ -3,26 +3,29 @@ Module: main.py
 
 Description:
 Main file for processing data from a text file and storing it into a SQL database.
-In this file, we define the parameters to connect to our database and specify the text file we want to process.
+In this file, we define the parameters to connect to our database and specify the text files we want to process (one document, a manifest of documents or a directory, see parse_arguments()).
 The main function processes the text line by line with the aid of the function process_line from the file line_processor.
 The processed data will be stored in a SQL database (the storing process is implemented in the file line_processor and other associated files).
 
 To personalize this file for your own purpose:
 - Change the database connection parameters where you want to store processed data. Please note, your database model must be the same as that used in this code to be usable by this Python code.
 - Specify your spaCy model which you want to apply to your text. Be careful, your spaCy model must use the same label names to be usable by this Python code.
-- Specify the path and name of the text you want to process.
+- Specify the path of the texts you want to process and give the documents to process in the command line.
 
 """
 
 # Import libraries
 # ------------------------------------------
-import spacy # to text NLP processing
+import argparse # to read the arguments of the command line
 
 # Import custom functions
 # ------------------------------------------
 from database_config import connect_to_database
-from main_handler_utils import process_text
-from main_processor_line import process_line
+from main_corpus import load_manifest, list_documents_in_directory, process_corpus, process_corpus_parallel, load_rule_model, SegmentExtractor
+from main_service_ner import load_model
+from main_handler_ner_cache import CachedNerModel
+from main_handler_ner_selective import SelectiveNerModel
+from main_handler_date import date_cache_statistics
 # import database
 
 
@@ -30,42 +33,116 @@ from main_processor_line import process_line
 # Functions
 # ==============================
 
+# Read the documents to process from the command line
+# ------------------------------------------
+"""
+The documents to process can be given in three ways:
+- a manifest (CSV file with the columns: file_name, document_id, class_id):
+    >>> python main.py --manifest corpus.csv
+- a directory with text files named with the id of document at the beginning (e.g. "23_ASV_intr.ex.194.txt"):
+    >>> python main.py --directory test/data/raw/_all/ --class-id 1
+- only one document:
+    >>> python main.py --file-name ASV_intr.ex.194 --document-id 23 --class-id 1
+Remember to insert each document into the database (table "document") before processing.
+"""
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Process the text files and store the extracted data into the database.")
+    parser.add_argument("--manifest", help="CSV file with the columns: file_name, document_id, class_id")
+    parser.add_argument("--directory", help="directory with the text files to process (file names start with the document id, e.g. 23_name.txt)")
+    parser.add_argument("--file-name", help="file name (without extension) of only one document to process")
+    parser.add_argument("--document-id", help="id of the document given with --file-name")
+    parser.add_argument("--class-id", default='1', help="1 = expense (default), 2 = revenue")
+    return parser.parse_args()
+
+
 # Main function to process data
 # ------------------------------------------
 def main():
 
     # Define general variables
     # -------------------------
-    nlp_model = spacy.load("training/training-itself/full/models/model-best") # load custom spaCy model
+    model_path = "training/training-itself/full/models/model-best" # custom spaCy model (or the address of the NER service, e.g. "http://127.0.0.1:8765", see main_service_ner.py)
     input_data_path = 'test/data/raw/_all/' # path for text to process
-
-    # Change manually then process each document
-    # -------------------------------------------
-
-    file_name = 'ASV_intr.ex.194' # file name without extension
-    document_id = '23' # manually specify the id of document after insert the document into database
-
-
-
-    # -------------------------------------------
-
-    class_id = '1' # 1 = expense, 2 = revenue
-
-    # Process text (get original text and text with rubrics)
+    ner_cache_path = None # file of the NER cache (e.g. "ner_cache.sqlite"), the lines already processed by the same model are taken from this file (None = no cache), see main_handler_ner_cache.py
+    ner_source = "model" # "model" = trained spaCy model, "rules" = fast mode: DATE and AMOUNT found by rules, PRODUCT and PERSON_PAYEE taken from the NER cache (if ner_cache_path is given) or left empty, see main_handler_ner_rules.py
+    ner_rules = None # rules to send to the model only the lines which can contain entities (e.g. {} = default rules, None = all lines are sent to the model), see main_handler_ner_selective.py
+    processes = 1 # number of documents processed in parallel (each worker process loads its own model and opens its own connection, see main_corpus.py)
+    segment_processes = None # number of worker processes for the segments of each document: huge documents are cut at the names of rubrics and the segments are processed at the same time (None = no segments), see SegmentExtractor in main_corpus.py
+    segment_lines = 2000 # minimum number of lines of a segment (the segment ends at the next name of rubric)
+
+    # Parameters of processing (NER: see main_handler_ner.py)
+    processing_options = {
+        "batch_size": 256, # number of lines sent together to spaCy (None = line by line)
+        "sort_by_length": False, # True = batch the lines of similar length together (the original order of lines is restored)
+        "n_process": 1, # number of processes for NER of one document (the model loaded here is shared with the worker processes)
+        "commit_every": None, # commit every N lines with a checkpoint of the document (None = one commit at the end of the document), see main_processor_line.py
+        "resume": False, # True = continue the documents from their checkpoint (after a crash or a lost connection)
+        "write_batch_size": None, # number of lines inserted together into the database with INSERTs of many rows (None = line by line), see main_writer_database.py
+        "intern_dates": False, # True = the lines with the same dates share one row of the table "date" (needs the column date_hash, see README.md; with processes, the new rows are committed at once in short transactions, so the workers don't wait for each other)
+        "extract_processes": None, # number of processes for the extraction of the lines of one document (extract_line_partial(), the values carried from the previous lines are resolved after in order), None = in this process, see main_processor_line.py
+        "pipeline_queue_size": None, # number of lines kept in the queue of the writer thread: the lines are inserted into the database while the next lines are processed (None = no writer thread), see main_processor_line.py
+        "strict_roman": False, # True = the sub-parts of amounts with a Roman numeral not correctly written (e.g. "MM", "IIIIII", parts in a wrong order) are marked as uncertain, see is_valid_roman_numeral() in main_handler_roman.py
+        "line_time_budget": None # maximum seconds for the extraction of one line: a slower line is stopped and written with the data of a line without entities (None = no limit), see main_processor_line.py
+    }
+
+    # Define documents to process
+    # -------------------------
+    arguments = parse_arguments()
+
+    if arguments.manifest:
+        documents = load_manifest(arguments.manifest)
+    elif arguments.directory:
+        input_data_path = arguments.directory
+        documents = list_documents_in_directory(input_data_path, arguments.class_id)
+    elif arguments.file_name and arguments.document_id:
+        documents = [{"file_name": arguments.file_name, "document_id": arguments.document_id, "class_id": arguments.class_id}]
+    else:
+        print("Nothing to process: give --manifest, --directory or --file-name with --document-id")
+        return
+
+    # Process each document
     # -------------------------
     """
-    The function process_text() adds rubrics and subrubrics markers (RUBRIC_NAME, SUBRUBRIC_NAME) to the original text. These markers are added depending on the number of line breaks between the text of paragraphs. These markers are necessary to recognize and process the rubrics and subrubrics names. Unfortunately, it can't be done in any other way because the original text is a plain text file, so we can't use any other formatting or style to mark the rubrics and subrubrics names in the original text.
-    Also, this function returns the full original text (text_original) without rubrics and subrubrics markers. For now, the original text is not used anywhere, but we keep it just in case.
+    For each document, the function stream_text() adds rubrics and subrubrics markers (RUBRIC_NAME, SUBRUBRIC_NAME) to the original text. These markers are added depending on the number of line breaks between the text of paragraphs. These markers are necessary to recognize and process the rubrics and subrubrics names. Unfortunately, it can't be done in any other way because the original text is a plain text file, so we can't use any other formatting or style to mark the rubrics and subrubrics names in the original text.
+    The lines are read from the file and processed one by one (the whole text is never loaded in memory), so the first lines are processed before the file is fully read.
+    Then the function process_line() processes each line of the text.
 
-    For more details about this function, see the file with this function in the utils.py file.
+    For more details, see the files main_corpus.py and main_handler_utils.py.
     """
-    text_original, text_with_rubrics = process_text(input_data_path, file_name)
-
-    # Process each line
-    # -------------------------
-    process_line(connection, text_with_rubrics, nlp_model, document_id, class_id)
-
-    print ("Text processed")
+    if processes > 1:
+        process_corpus_parallel(connection, model_path, input_data_path, documents, processes, processing_options, ner_cache_path, ner_rules, ner_source)
+    elif segment_processes:
+        # the models are loaded by the worker processes of the segments (the model is not loaded here)
+        segment_extractor = SegmentExtractor(model_path, segment_processes, segment_lines, ner_cache_path, ner_rules, ner_source, processing_options["batch_size"] or 256)
+
+        process_corpus(connection, None, input_data_path, documents, processing_options, segment_extractor)
+
+        print(f"Segments: {segment_extractor.statistics()}")
+        segment_extractor.close()
+    elif ner_source == "rules":
+        nlp_model = load_rule_model(model_path, ner_cache_path) # the model is not loaded, only its fingerprint is needed to read the cache
+
+        process_corpus(connection, nlp_model, input_data_path, documents, processing_options)
+
+        print(f"Rule NER: {nlp_model.statistics()}")
+        if nlp_model.ner_cache:
+            nlp_model.ner_cache.close()
+    else:
+        nlp_model = load_model(model_path) # load custom spaCy model (only once for all documents)
+        if ner_cache_path:
+            nlp_model = ner_cache = CachedNerModel(nlp_model, ner_cache_path, model_path=model_path)
+        if ner_rules is not None:
+            nlp_model = ner_selective = SelectiveNerModel(nlp_model, ner_rules) # in front of the cache: the skipped lines are not even looked up in the cache
+
+        process_corpus(connection, nlp_model, input_data_path, documents, processing_options)
+
+        if ner_rules is not None:
+            print(f"Selective NER: {ner_selective.statistics()}")
+        if ner_cache_path:
+            print(f"NER cache: {ner_cache.statistics()}")
+            ner_cache.close()
+
+        print(f"Date cache: {date_cache_statistics()}")
 
     # Close database connection
     connection.close()
@@ -0,0 +1,440 @@
+"""
+Module: main_corpus.py
+
+Description:
+This module contains functions to process a whole corpus (many documents) in one run.
+The spaCy model is loaded and the database connection is opened only once (in main.py), then each document is processed with the functions stream_text() and process_line().
+For each document we report if it was processed successfully or not and how much time it took.
+
+Functions:
+
+load_manifest():
+    Read the list of documents to process from a manifest file (CSV file with the columns: file_name, document_id, class_id).
+
+list_documents_in_directory():
+    Make the list of documents to process from all text files of a directory. The document_id is taken from the beginning of the file name (e.g. "23_ASV_intr.ex.194.txt" is the document 23).
+
+process_document(), rollback_document():
+    Process one document (stream_text() + process_line()) and return the report of this processing (if the document fails, its transaction is cancelled, and the connection is opened again if it was lost).
+
+process_corpus():
+    Process each document of the list and print the report for each document and for the whole corpus.
+
+process_corpus_parallel():
+    Process the documents concurrently in many worker processes. Each worker loads its own spaCy model (see initialize_worker()), then processes one document at a time with process_document(), with a database connection opened and closed for this document (see process_document_in_worker()).
+
+load_rule_model():
+    Make the model of the fast mode (ner_source = "rules", see main_handler_ner_rules.py), which reads the NER cache without loading the spaCy model.
+
+SegmentExtractor:
+    Process the lines of one huge document in many worker processes: the document is cut into segments at the names of rubrics, and the segments are processed (NER and extract_line_partial()) at the same time, each one by a worker with its own spaCy model. The data of the lines is given back to process_line() in order of lines (see the note below).
+
+seed_rubric_subrubric():
+    Insert the names of all rubrics and subrubrics of the documents before starting the worker processes (see the note below).
+
+check_shared_tables():
+    Check that the shared tables have the unique keys needed by get_or_create() before processing in parallel (see the note below).
+
+Note about the tables shared by all documents (when processing in parallel):
+    The tables rubric_extracted, rubric_standardized, subrubric_extracted and subrubric_standardized are shared by all documents and are filled with "check if the name exists, if not insert it".
+    If two workers (or two processings started at the same time) do it for the same name, the name could be inserted twice. To avoid it, the names are inserted with get_or_create() (see main_writer_database.py), with a unique key on the column of the name: the same name is never inserted twice, and the workers which insert it at the same time get the same id. The keys are added once with migrate_unique_keys.py and checked before processing (check_shared_tables()): they are required when many processes write at the same time (process_corpus_parallel()); without them, process_corpus() only displays a warning and inserts the names as before (with extract_processes or SegmentExtractor, the lines are still written by the main process only).
+    The main process also inserts all these names before starting the workers (seed_rubric_subrubric()), so the workers usually only find the existing names (a SELECT, without lock) and don't wait for each other.
+    A new name is written by the worker on a second connection, in its own short transaction committed at once (see run_shared() in main_writer_database.py): the document is written in one long transaction, and a name inserted in it would be locked until the end of the document (the other workers would wait for it, or stop with a deadlock).
+    date has only one row for each hash with intern_dates (unique key on date_hash). currency_standardized and currency_variant are only read, and the tables person and person_role are filled during the post-processing (also with get_or_create()).
+
+Note about the segments of one document (SegmentExtractor):
+    Only a few values are carried from one line to the next (folio, date, participant, current rubric and subrubric). They are not needed to process the text of a line: the workers only run the first step of the extraction (extract_line_partial(), see main_processor_line.py), which doesn't use them.
+    The starting values of each segment are found by process_line() when it resolves the lines of the previous segment (resolve_line(), a fast pass without NER, in order of lines), then the lines are inserted by the main process in one transaction. So the lines have contiguous line_number values and the database contains exactly the same data as without segments.
+    The segments start at a rubric (the first line of a rubric doesn't depend on the text of the previous rubric, except for the date, the folio and the participant resolved as above), and have about segment_lines lines.
+
+"""
+
+# Import libraries
+# ------------------------------------------
+import csv # to read the manifest file
+import mysql.connector # to recognize the errors of the database
+import multiprocessing # to process many documents in parallel
+import os # to list the files of a directory
+import re # to work with regular expressions
+import signal # to stop the lines which take too much time in the worker processes of segments
+import time # to measure the processing time
+from collections import deque # to keep the segments being processed in order
+
+# Import custom functions
+# ------------------------------------------
+from database_config import connect_to_database
+from main_handler_utils import stream_text, process_rubric_subrubric_from_text, process_rubric_subrubric_into_database
+from main_processor_line import process_line, extract_line_partial_in_time, raise_line_timeout
+from main_handler_ner import process_ner, index_line_entities
+from main_service_ner import load_model
+from main_handler_ner_cache import CachedNerModel, find_model_fingerprint, model_fingerprint
+from main_handler_ner_selective import SelectiveNerModel
+from main_handler_ner_rules import RuleNerModel
+from main_writer_database import LookupCache, check_unique_keys, ingestion_tables
+
+
+# ==============================
+# Documents to process
+# ==============================
+
+"""
+Each document to process is a dictionary with the keys: file_name (without extension), document_id and class_id.
+    >>> Example: {'file_name': 'ASV_intr.ex.194', 'document_id': '23', 'class_id': '1'}
+Remember that the document must be inserted into the database (table "document") before processing, see README.md
+"""
+
+# Read the manifest file
+# ------------------------------------------
+def load_manifest(manifest_path):
+    documents = []
+
+    with open(manifest_path, newline='') as manifest_file:
+        for row in csv.DictReader(manifest_file):
+            documents.append({
+                "file_name": re.sub(r'\.txt$', '', row["file_name"].strip()), # the file name can be written with or without extension
+                "document_id": row["document_id"].strip(),
+                "class_id": row.get("class_id", "").strip() or '1' # 1 = expense (default), 2 = revenue
+            })
+
+    return documents
+
+
+# Take all text files of a directory
+# ------------------------------------------
+def list_documents_in_directory(input_data_path, class_id='1'):
+    documents = []
+
+    for file in sorted(os.listdir(input_data_path)):
+        if file.endswith('.txt'):
+            file_name = file[:-len('.txt')]
+
+            # the document_id is the number at the beginning of the file name (if not found, the document will be reported as failed)
+            match = re.match(r'(\d+)_', file_name)
+
+            documents.append({
+                "file_name": file_name,
+                "document_id": match.group(1) if match else None,
+                "class_id": class_id
+            })
+
+    return documents
+
+
+
+# ==============================
+# Process one document
+# ==============================
+
+def process_document(connection, nlp_model, input_data_path, document, processing_options=None, lookup_cache=None, segment_extractor=None):
+
+    # Initialize the report of the document
+    report = {
+        "file_name": document["file_name"],
+        "document_id": document["document_id"],
+        "status": "failed",
+        "error": None,
+        "lines": 0,
+        "seconds": 0.0
+    }
+    start_time = time.perf_counter()
+
+    try:
+        if not document["document_id"]:
+            raise ValueError("no document_id for this file")
+
+        # Process text (get text with rubrics line by line), see main.py for more details
+        text_with_rubrics = stream_text(input_data_path, document["file_name"])
+
+        # Process each line (process_line() commits the document at the end)
+        report["lines"] = process_line(connection, text_with_rubrics, nlp_model, document["document_id"], document["class_id"], lookup_cache=lookup_cache, segment_extractor=segment_extractor, **(processing_options or {}))
+        report["status"] = "ok"
+
+    except Exception as error:
+        report["error"] = f"{type(error).__name__}: {error}"
+
+        # Cancel everything not committed for this document and continue with the next one
+        try:
+            rollback_document(connection)
+        except mysql.connector.Error as connection_error:
+            report["error"] += f" (the connection to the database could not be restored: {connection_error})"
+        if lookup_cache:
+            lookup_cache.clear() # the ids inserted by this document are cancelled too
+
+    report["seconds"] = round(time.perf_counter() - start_time, 2)
+
+    return report
+
+
+
+# Cancel the transaction of a failed document
+# ------------------------------------------
+"""
+If the connection is lost (the reason of the error, e.g. the server was restarted), the rollback fails too: the transaction is already cancelled by the server,
+so the connection is only opened again for the next documents (the lines already committed are kept, see resume in main_processor_line.py).
+"""
+def rollback_document(connection):
+    try:
+        connection.rollback()
+    except mysql.connector.Error:
+        connection.reconnect(attempts=3, delay=5)
+
+
+
+# ==============================
+# Process all documents
+# ==============================
+
+def process_corpus(connection, nlp_model, input_data_path, documents, processing_options=None, segment_extractor=None):
+    reports = []
+    start_time = time.perf_counter()
+
+    # The shared names are inserted only once (see check_shared_tables())
+    check_shared_tables(connection, processing_options, required=False)
+
+    # The ids of names of rubrics and subrubrics are loaded once for all documents (see LookupCache in main_writer_database.py)
+    lookup_cache = LookupCache(connection)
+
+    for document in documents:
+        report = process_document(connection, nlp_model, input_data_path, document, processing_options, lookup_cache, segment_extractor)
+        reports.append(report)
+        print_report(report)
+
+    print_corpus_report(reports, time.perf_counter() - start_time)
+
+    return reports
+
+
+# Inform about the result of each document
+# ------------------------------------------
+def print_report(report):
+    if report["status"] == "ok":
+        print(f"OK     {report['file_name']} (document {report['document_id']}): {report['lines']} lines in {report['seconds']} s")
+    else:
+        print(f"FAILED {report['file_name']} (document {report['document_id']}): {report['error']} ({report['seconds']} s)")
+
+
+# Inform about the result of the whole corpus
+# ------------------------------------------
+def print_corpus_report(reports, elapsed_seconds):
+    count_ok = sum(1 for report in reports if report["status"] == "ok")
+    total_seconds = round(sum(report["seconds"] for report in reports), 2)
+    print(f"Corpus processed: {count_ok} of {len(reports)} documents processed successfully in {round(elapsed_seconds, 2)} s (sum of the documents: {total_seconds} s)")
+
+
+
+# Check the unique keys of the shared tables
+# ------------------------------------------
+"""
+Without the unique keys, the same name could be inserted twice by two processes (see the note at the beginning of this file):
+with required=True (many processes), the processing doesn't start; with required=False (one process), only a warning is displayed (see check_unique_keys() in main_writer_database.py and README.md).
+"""
+def check_shared_tables(connection, processing_options=None, required=True):
+    tables = ingestion_tables + (["date"] if (processing_options or {}).get("intern_dates") else [])
+    cursor = connection.cursor(buffered=True)
+    check_unique_keys(cursor, tables, required)
+    cursor.close()
+
+
+
+# ==============================
+# Process all documents in parallel
+# ==============================
+
+# Insert the names of rubrics and subrubrics before starting the workers
+# ------------------------------------------
+"""
+The names are found in the same way as in process_line(): the lines with the tag RUBRIC_NAME or SUBRUBRIC_NAME (added by stream_text()) are the lines with the names of rubrics and subrubrics.
+This doesn't need the spaCy model, so it is quick.
+"""
+def seed_rubric_subrubric(connection, input_data_path, documents):
+    cursor = connection.cursor(buffered=True)
+
+    for document in documents:
+        try:
+            text_with_rubrics = list(stream_text(input_data_path, document["file_name"]))
+        except OSError:
+            continue # the missing file will be reported as failed by the worker
+
+        for line in text_with_rubrics:
+            words = line.split()
+            if words[0] == "RUBRIC_NAME":
+                category = 'rubric'
+            elif words[0] == "SUBRUBRIC_NAME":
+                category = 'subrubric'
+            else:
+                continue
+
+            name_extracted, name_standardized = process_rubric_subrubric_from_text(line, category)
+            process_rubric_subrubric_into_database(cursor, name_extracted, name_standardized, category)
+
+    connection.commit()
+    cursor.close()
+
+
+# Worker process
+# ------------------------------------------
+"""
+Each worker process has its own spaCy model (or its own client of the NER service, see main_service_ner.py), loaded only once when the worker starts and then used for all documents processed by this worker.
+The database connections (a connection can't be shared between processes) and the LookupCache are created for each document and closed at the end of the document:
+- the pool has no function called when a worker stops, so a connection kept by the worker would never be closed;
+- the LookupCache is loaded at the start of each document, so it contains the names inserted by the other workers (or by seed_rubric_subrubric()) until then;
+- the second connection (shared_connection) writes the shared names in short transactions (see the note at the beginning of this file).
+"""
+worker_nlp_model = None
+
+def initialize_worker(model_path, ner_cache_path=None, ner_rules=None, ner_source="model"):
+    global worker_nlp_model
+    worker_nlp_model = load_worker_model(model_path, ner_cache_path, ner_rules, ner_source)
+
+
+def load_worker_model(model_path, ner_cache_path=None, ner_rules=None, ner_source="model"):
+    if ner_source == "rules":
+        return load_rule_model(model_path, ner_cache_path)
+
+    nlp_model = load_model(model_path)
+    if ner_cache_path:
+        nlp_model = CachedNerModel(nlp_model, ner_cache_path, model_path=model_path) # the cache file is shared by all workers
+    if ner_rules is not None:
+        nlp_model = SelectiveNerModel(nlp_model, ner_rules)
+    return nlp_model
+
+
+# Fast mode (see main_handler_ner_rules.py): the entities not found by the rules are read from the cache, without loading the model
+# ------------------------------------------
+"""
+The cache only needs the fingerprint of the model (see find_model_fingerprint() in main_handler_ner_cache.py).
+If it is not found (NER service, or a model without meta.json never used with this cache), the model is loaded only to calculate it (the client of the NER service doesn't load anything).
+"""
+def load_rule_model(model_path, ner_cache_path=None):
+    if not ner_cache_path:
+        return RuleNerModel()
+
+    fingerprint = find_model_fingerprint(ner_cache_path, model_path)
+    if fingerprint is None:
+        fingerprint = model_fingerprint(load_model(model_path))
+    return RuleNerModel(CachedNerModel(None, ner_cache_path, fingerprint=fingerprint))
+
+
+def process_document_in_worker(task):
+    input_data_path, document, processing_options = task
+    connection = connect_to_database()
+    shared_connection = connect_to_database()
+    try:
+        return process_document(connection, worker_nlp_model, input_data_path, document, processing_options, LookupCache(connection, shared_connection))
+    finally:
+        shared_connection.close()
+        connection.close()
+
+
+# Process the documents in the worker processes
+# ------------------------------------------
+def process_corpus_parallel(connection, model_path, input_data_path, documents, processes, processing_options=None, ner_cache_path=None, ner_rules=None, ner_source="model"):
+    start_time = time.perf_counter()
+
+    # The documents are already processed in parallel, so the NER and the extraction of each document are done in one process (a worker can't start other processes)
+    processing_options = dict(processing_options or {}, n_process=1, extract_processes=None) # (and without SegmentExtractor)
+
+    # Insert the shared names before starting the workers (see the note at the beginning of this file)
+    check_shared_tables(connection, processing_options, required=True)
+    seed_rubric_subrubric(connection, input_data_path, documents)
+
+    # Process the documents, each worker takes a new document as soon as it has finished the previous one
+    reports = []
+    tasks = [(input_data_path, document, processing_options) for document in documents]
+
+    with multiprocessing.Pool(processes, initializer=initialize_worker, initargs=(model_path, ner_cache_path, ner_rules, ner_source)) as pool:
+        for report in pool.imap_unordered(process_document_in_worker, tasks):
+            reports.append(report)
+            print_report(report)
+
+    print_corpus_report(reports, time.perf_counter() - start_time)
+
+    return reports
+
+
+
+# ==============================
+# Process one huge document in segments
+# ==============================
+
+"""
+The worker processes are started once (each one loads its own model, see load_worker_model()) and used for all documents.
+process_line() calls extract() with the lines of the document (see process_line() in main_processor_line.py), which returns the data of each line found by extract_line_partial(), in order of lines.
+At most processes + 1 segments are processed or waiting at the same time, so the memory stays limited even if the insertion into the database is slower than the workers.
+"""
+
+class SegmentExtractor:
+    def __init__(self, model_path, processes, segment_lines=2000, ner_cache_path=None, ner_rules=None, ner_source="model", batch_size=256):
+        self.processes = processes
+        self.segment_lines = segment_lines
+        self.batch_size = batch_size
+        self.pool = multiprocessing.Pool(processes, initializer=initialize_segment_worker, initargs=(model_path, ner_cache_path, ner_rules, ner_source))
+
+        # Statistics
+        self.segments = 0
+        self.lines = 0
+
+    # Data of the lines (extract_line_partial()) in order of lines
+    # ------------------------------------------
+    def extract(self, lines, first_line_number=1, line_time_budget=None, strict_roman=False):
+        pending_segments = deque()
+
+        for segment in split_into_segments(lines, self.segment_lines):
+            pending_segments.append(self.pool.apply_async(extract_segment_in_worker, (segment, first_line_number, line_time_budget, self.batch_size, strict_roman)))
+            first_line_number += len(segment)
+            self.segments += 1
+            self.lines += len(segment)
+
+            if len(pending_segments) > self.processes:
+                yield from pending_segments.popleft().get()
+
+        while pending_segments:
+            yield from pending_segments.popleft().get()
+
+    # Statistics
+    # ------------------------------------------
+    def statistics(self):
+        return {
+            "segments": self.segments,
+            "lines": self.lines,
+            "lines_per_segment": round(self.lines / self.segments) if self.segments else 0
+        }
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+
+# Cut the lines into segments at the names of rubrics
+# ------------------------------------------
+"""
+A segment is ended at the first name of rubric (line with RUBRIC_NAME, see stream_text()) after segment_lines lines. A document without names of rubrics is one segment.
+    >>> split_into_segments(['RUBRIC_NAME A', 'x', 'y', 'RUBRIC_NAME B', 'z'], 2) = [['RUBRIC_NAME A', 'x', 'y'], ['RUBRIC_NAME B', 'z']]
+"""
+
+def split_into_segments(lines, segment_lines):
+    segment = []
+    for line in lines:
+        if len(segment) >= segment_lines and line.startswith("RUBRIC_NAME "):
+            yield segment
+            segment = []
+        segment.append(line)
+    if segment:
+        yield segment
+
+
+# Worker process
+# ------------------------------------------
+worker_segment_model = None
+
+def initialize_segment_worker(model_path, ner_cache_path=None, ner_rules=None, ner_source="model"):
+    global worker_segment_model
+    worker_segment_model = load_worker_model(model_path, ner_cache_path, ner_rules, ner_source)
+    if hasattr(signal, "setitimer"):
+        signal.signal(signal.SIGALRM, raise_line_timeout) # time budget of lines (see extract_line_partial_in_time())
+
+
+def extract_segment_in_worker(segment, first_line_number, line_time_budget=None, batch_size=256, strict_roman=False):
+    lines_nlp = map(index_line_entities, process_ner(worker_segment_model, segment, batch_size))
+    stop_lines = bool(line_time_budget) and hasattr(signal, "setitimer")
+    return [extract_line_partial_in_time(line, line_nlp, line_number, line_time_budget, stop_lines, strict_roman) for line_number, (line, line_nlp) in enumerate(zip(segment, lines_nlp), first_line_number)]
@@ -3,6 +3,7 @@ Module: main_handler_amount.py
 
 Description:
 This module contains various functions utilized for processing amounts present in text.
+Each function process_...() extracts the data from text (with the function extract_...(), which doesn't use the database and returns records) and then inserts these records into the database (with the functions insert_...() from main_writer_database.py).
 
 Functions:
 
@@ -14,13 +15,16 @@ process_amount():
 process_amount_simple():
     This function processes simple amounts.
 
+find_currency_to_search():
+    This function gives the name of the currency to search in the tables of currencies (also used by main_handler_amount_lexer.py).
+
 process_subpart():
     Each simple amount can be divided into different parts. For example, the amount "XII l. II s. vien." can be divided into "XII l." and "II s.". Each part represents a subdivision of the amount (e.g., livre, sou, denier). 
     This function processes each of these subparts of the simple amount.
 
 convert_roman_to_arabic_complex():
     This function converts complex composite numbers like "VM IIIC XII" into Arabic numerals. 
-    To convert each part of this complex composite number, the function calls the more general function "convert_roman_to_arabic()" from date_handler.py.
+    The conversion itself is done by the function "convert_roman_numeral_complex()" from main_handler_roman.py.
 
 """
 
@@ -30,14 +34,47 @@ import re # to work with regular expressions
 
 # Import custom functions
 # ------------------------------------------
-from main_handler_date import convert_roman_to_arabic
+from main_handler_roman import convert_roman_numeral_complex
+from main_writer_database import insert_amount, insert_amount_simple, insert_subpart
 
 
 # ============================
 # Pre-process amount
 # ============================
 
+"""
+The amounts are processed in two steps:
+1. Extraction (functions extract_...): the amounts are extracted from text and returned as records (dictionaries), without using the database.
+2. Insertion (functions insert_... in main_writer_database.py): the records are inserted into the database.
+The functions process_... do both steps (extraction + insertion), as before.
+
+The record of amounts of a line (returned by extract_amount()) is a dictionary:
+- 'amount_composite': None (simple amount) or {'amount_composite_extracted': ..., 'amount_composite_uncertainty': ...}
+- 'exchange_rate_extracted': text of the composite amount if it contains an exchange rate ("singul..." or "computa..."), otherwise None
+- 'amounts_simple': list of records of simple amounts (see extract_amount_simple())
+    >>> Example: {'amount_composite': None, 'exchange_rate_extracted': None, 'amounts_simple': [{'amount_simple_extracted': 'XII l. II s. vien.', ...}]}
+"""
+
+"""
+The main regex to find all parts of amounts (used by extract_amount()) was:
+    (?:minus\s)*[IVXLCDM]+(?:\s[IVXLCDM]+)*\s\b(?!l|d|s|o|p|m)(?!minus)[a-z]+\b\.*(?:\s\b(?!l|d|s|o|p|m)(?!minus)[a-z]+\b\.*)*
+    |(?:minus\s)*(?:[IVXLCDM]+(?:\s[IVXLCDM]+)*\s(?:\b(?=l|d|s|o|p|m)(?!minus)[a-z]+\b)+\.*)+(?:\s[IVXLCDM]+\s(?:\b(?=l|d|s|o|p|m)(?!minus)[a-z]+\b)+\.*)*(?:\s(?!minus)[a-z]*\.*)*
+When no amount is found, re.findall() tries again from each next character, and each time the regex reads again all Roman numerals and all "minus" which follow (e.g. "I I I I ... I" without unit or currency, or "IIIIIIII...", or "minus minus ... minus"): the time grows with the square of the length of the line, and a long line of OCR noise can stop the processing.
+A new attempt from the middle of Roman numerals (after a Roman numeral, or after a Roman numeral and a space) or from the middle of "minus minus ..." always fails if the attempt from their beginning failed (the regex reads the same characters until the same end), and an amount never ends there.
+So the regex starts only at the beginning of Roman numerals or of "minus" (lookbehinds below), which gives exactly the same amounts in a time proportional to the length of the line (see benchmark_regex.py).
+"""
+
+amounts_pattern = re.compile(r'(?:(?<!\bminus\s)(?:minus\s)+|(?<![IVXLCDM])(?<![IVXLCDM]\s))(?:[IVXLCDM]+(?:\s[IVXLCDM]+)*\s\b(?!l|d|s|o|p|m)(?!minus)[a-z]+\b\.*(?:\s\b(?!l|d|s|o|p|m)(?!minus)[a-z]+\b\.*)*|(?:[IVXLCDM]+(?:\s[IVXLCDM]+)*\s(?:\b(?=l|d|s|o|p|m)(?!minus)[a-z]+\b)+\.*)+(?:\s[IVXLCDM]+\s(?:\b(?=l|d|s|o|p|m)(?!minus)[a-z]+\b)+\.*)*(?:\s(?!minus)[a-z]*\.*)*)')
+
+
 def process_amount(cursor, line, line_id):
+    amount_record = extract_amount(line)
+
+    if amount_record:
+        insert_amount(cursor, line_id, amount_record)
+
+
+def extract_amount(line):
 
     # Initialize variables
     amount_composite_uncertainty = 0
@@ -63,14 +100,14 @@ def process_amount(cursor, line, line_id):
         else:
             amount_composite_uncertainty = "1" # if not found amount, warning - need to check manually
             extracted_part_with_amounts = None
-            return
+            return None
 
     # Define amount type (composite or simple)
     # ------------------------------------------
             
     # extract amounts from the previously extracted text
     # This is a main regex to find all parts of amounts. See more detailed explanations in the manual
-    amounts_extracted = re.findall(r'(?:minus\s)*[IVXLCDM]+(?:\s[IVXLCDM]+)*\s\b(?!l|d|s|o|p|m)(?!minus)[a-z]+\b\.*(?:\s\b(?!l|d|s|o|p|m)(?!minus)[a-z]+\b\.*)*|(?:minus\s)*(?:[IVXLCDM]+(?:\s[IVXLCDM]+)*\s(?:\b(?=l|d|s|o|p|m)(?!minus)[a-z]+\b)+\.*)+(?:\s[IVXLCDM]+\s(?:\b(?=l|d|s|o|p|m)(?!minus)[a-z]+\b)+\.*)*(?:\s(?!minus)[a-z]*\.*)*', extracted_part_with_amounts)
+    amounts_extracted = amounts_pattern.findall(extracted_part_with_amounts)
 
     # count amounts in the extracted text to know if it is composite or simple amount
     count_amounts = len(amounts_extracted)
@@ -92,51 +129,33 @@ def process_amount(cursor, line, line_id):
     # ------------------------------------------
     if amount_composite_extracted:
 
-        # Insert into amount_composite table
-        cursor.execute("INSERT INTO amount_composite (line_id, amount_composite_extracted, amount_composite_uncertainty) VALUES (%s, %s, %s)", (line_id, extracted_part_with_amounts, amount_composite_uncertainty,))
-
-        # Retrieve auto-incremented ID
-        amount_composite_id = cursor.lastrowid
-
         # Check if amount_composite_extracted contains the beginning of "singul" or "computa"
         check_exchange_rate = re.search(r'\b(singul|computa)\w*\b', extracted_part_with_amounts, re.IGNORECASE)
 
-        if check_exchange_rate:
-            # Retrieve date_id from line table
-            # cursor.execute("SELECT date_id FROM line WHERE line_id = %s", (line_id,))
-            # Retrieve auto-incremented ID
-            # date_id = cursor.fetchone()[0]
-
-            # OLD / Insert into exchange_rate table
-            # cursor.execute("INSERT INTO exchange_rate (exchange_rate_extracted) VALUES (%s)", (extracted_part_with_amounts,))
-            # exchange_rate_id = cursor.lastrowid
-
-            # OLD / Insert into exchange_rate_internal_reference table
-            # cursor.execute("INSERT INTO exchange_rate_internal_reference (line_id, exchange_rate_id) VALUES (%s, %s)", (line_id, exchange_rate_id,))
-
-            # Check if the row with the same line_id already exists in the exchange_rate_internal_reference table
-            cursor.execute("SELECT COUNT(*) FROM exchange_rate_internal_reference WHERE line_id = %s", (line_id,))
-            count_existing = cursor.fetchone()[0]
-
-            # If the line_id does not exist, insert the new data
-            if count_existing == 0:
-                # Insert into exchange_rate_internal_reference table
-                cursor.execute("INSERT INTO exchange_rate_internal_reference (exchange_rate_extracted, line_id) VALUES (%s, %s)", (extracted_part_with_amounts, line_id,))
-
-
-
         # Process each part of amount_composite_extracted as amount_simple_extracted
-        for amount_simple_extracted in amount_composite_extracted:
-            line_id = None # there are no line_id case in this cas amount_simple will be linked directly to amount_composite
-            process_amount_simple(cursor, line_id, amount_composite_id, amount_simple_extracted)
+        # (there are no line_id case in this cas amount_simple will be linked directly to amount_composite)
+        return {
+            "amount_composite": {
+                "amount_composite_extracted": extracted_part_with_amounts,
+                "amount_composite_uncertainty": amount_composite_uncertainty
+            },
+            "exchange_rate_extracted": extracted_part_with_amounts if check_exchange_rate else None,
+            "amounts_simple": [extract_amount_simple(amount_simple_extracted) for amount_simple_extracted in amount_composite_extracted]
+        }
 
 
     # Process amount simple
     # ------------------------------------------
     elif amount_simple_extracted:
-        amount_composite_id = None # there are no amount_composite_id case in this cas amount_simple will be linked directly to line
-        # amount_simple_extracted = amount_simple_extracted[0]
-        process_amount_simple(cursor, line_id, amount_composite_id, amount_simple_extracted[0])
+        # (there are no amount_composite_id case in this cas amount_simple will be linked directly to line)
+        return {
+            "amount_composite": None,
+            "exchange_rate_extracted": None,
+            "amounts_simple": [extract_amount_simple(amount_simple_extracted[0])]
+        }
+
+    # No amount to insert (if amount_composite_uncertainty = "1", need to check manually)
+    return None
 
 
 
@@ -148,11 +167,23 @@ def process_amount(cursor, line, line_id):
 
 # amount_simple_uncertainty = 1 : if more then 1 currency and if no sub-parts found
 
+"""
+The record of simple amount (returned by extract_amount_simple()) is a dictionary with the values of the table "amount_simple":
+amount_simple_extracted, currency_extracted, arithmetic_operator, amount_simple_uncertainty
+and also:
+- 'currency_to_search': the beginning of the currency name to search in the tables of currencies (to find currency_standardized_id when the record is inserted into the database)
+- 'subparts': list of records of sub-parts (see extract_subpart())
+"""
+
 def process_amount_simple(cursor, line_id, amount_composite_id, amount_simple_extracted):
+    insert_amount_simple(cursor, line_id, amount_composite_id, extract_amount_simple(amount_simple_extracted))
+
+
+def extract_amount_simple(amount_simple_extracted):
 
     # Initialize variables
     currency_extracted =  None
-    currency_standardized_id = None
+    currency_to_search = None
     arithmetic_operator = None
     amount_simple_uncertainty = 0
 
@@ -170,39 +201,7 @@ def process_amount_simple(cursor, line_id, amount_composite_id, amount_simple_ex
     if currencies_extracted:
         amount_simple_uncertainty = 1 if len(currencies_extracted) > 1 else None
         currency_extracted = currencies_extracted[0]
-
-        """
-        To identify currencies, we will take the first two letters of the extracted currency (two letters, because the smallest abbreviation is "fl") and look for standardized currencies that begin with these two letters. However, this method can produce errors. For this reason, for certain currencies whose names may be ambiguous and produce errors (most often currencies with two words in the name like "tur.parv" and "tur.gros"), we will clearly define the name to search for.
-        """
-
-        # Check if currency_extracted corresponds to (parv. tur.) ou (parve monete) ou (tur. parv.)"
-        if re.search(r"\b(parv)", currency_extracted):
-            currency_to_search = "turonensis parvorum"
-
-        # Check if currency_extracted corresponds to (tur. gros.)
-        elif re.search(r"\b(tur).*\b.*\b(gr).*\b", currency_extracted):
-            currency_to_search = "grossus"
-
-        # If none of the above conditions are met, take the first two characters of currency_extracted
-        else:
-            currency_to_search = currency_extracted[:2]
-
-
-        # Search for currency_to_search in currency_name from the "currency_standardized" table
-        cursor.execute("SELECT currency_standardized_id FROM currency_standardized WHERE currency_name LIKE %s", (f"{currency_to_search}%",))
-        result_from_currency_standardized = cursor.fetchone()
-       # cursor.fetchone() will take the only firs one result, to retrieve all possible results, use cursor.fetchall()
-
-        if result_from_currency_standardized:
-            currency_standardized_id = result_from_currency_standardized[0]  # Return the associated currency_standardized_id
-
-        # If not found, search in currency_variant_name from the "currency_variant" table
-        else: 
-            cursor.execute("SELECT currency_standardized_id FROM currency_variant WHERE currency_variant_name LIKE %s", (f"{currency_to_search}%",))
-        result_from_currency_variant = cursor.fetchone()
-        if result_from_currency_variant:
-            currency_standardized_id = result_from_currency_variant[0]
-        # currency_standardized_id = cursor.fetchone()[0]
+        currency_to_search = find_currency_to_search(currency_extracted)
 
 
     # Process sub-parts of simple amount
@@ -218,20 +217,37 @@ def process_amount_simple(cursor, line_id, amount_composite_id, amount_simple_ex
     # arithmetic_operator = re.search(r'\bminus\b', amount_simple_extracted)
     arithmetic_operator = 'minus' if re.search(r'\bminus\b', amount_simple_extracted) else None
 
-    # Insert into table "amount_simple"
+    # Record of simple amount
     # ------------------------------------------
+    return {
+        "amount_simple_extracted": amount_simple_extracted,
+        "currency_extracted": currency_extracted,
+        "currency_to_search": currency_to_search,
+        "arithmetic_operator": arithmetic_operator,
+        "amount_simple_uncertainty": amount_simple_uncertainty,
+        "subparts": [extract_subpart(subpart_extracted) for subpart_extracted in subparts_extracted] # process each sup-part
+    }
 
-    # Insert into amount_simple table
-    cursor.execute("INSERT INTO amount_simple (line_id, amount_composite_id, amount_simple_extracted, currency_extracted, currency_standardized_id, arithmetic_operator, amount_simple_uncertainty) VALUES (%s, %s, %s, %s, %s, %s, %s)", (line_id, amount_composite_id, amount_simple_extracted, currency_extracted, currency_standardized_id, arithmetic_operator, amount_simple_uncertainty,))
-    amount_simple_id = cursor.lastrowid
 
 
-    # Call function to process sub-parts (need to call in the end, case need amount_simple_id)
-    # ------------------------------------------
-    if subparts_extracted:
-        # process each sup-part
-        for subpart_extracted in subparts_extracted:
-            process_subpart(cursor, amount_simple_id, subpart_extracted)
+# Name of currency to search
+# ------------------------------------------
+"""
+To identify currencies, we will take the first two letters of the extracted currency (two letters, because the smallest abbreviation is "fl") and look for standardized currencies that begin with these two letters. However, this method can produce errors. For this reason, for certain currencies whose names may be ambiguous and produce errors (most often currencies with two words in the name like "tur.parv" and "tur.gros"), we will clearly define the name to search for.
+The search itself is done when the amount is inserted into the database (see find_currency_standardized_id() in main_writer_database.py).
+"""
+def find_currency_to_search(currency_extracted):
+
+    # Check if currency_extracted corresponds to (parv. tur.) ou (parve monete) ou (tur. parv.)"
+    if re.search(r"\b(parv)", currency_extracted):
+        return "turonensis parvorum"
+
+    # Check if currency_extracted corresponds to (tur. gros.)
+    if re.search(r"\b(tur).*\b.*\b(gr).*\b", currency_extracted):
+        return "grossus"
+
+    # If none of the above conditions are met, take the first two characters of currency_extracted
+    return currency_extracted[:2]
 
 
 
@@ -239,7 +255,16 @@ def process_amount_simple(cursor, line_id, amount_composite_id, amount_simple_ex
 # Process subpart
 # ============================
 
+"""
+The record of sub-part (returned by extract_subpart()) is a dictionary with the values of the table "amount_simple_subpart":
+subpart_extracted, roman_numeral, arabic_numeral, amount_simple_subpart_uncertainty, unit_of_count_id
+"""
+
 def process_subpart(cursor, amount_simple_id, subpart_extracted):
+    insert_subpart(cursor, amount_simple_id, extract_subpart(subpart_extracted))
+
+
+def extract_subpart(subpart_extracted):
 
     # Inititalize variables
     amount_simple_subpart_uncertainty = 0
@@ -284,9 +309,15 @@ def process_subpart(cursor, amount_simple_id, subpart_extracted):
     else:
         unit_of_count_id = None # Set a default value for unit_of_count_id
 
-    # Insert into table "amount_simple_subpart"
+    # Record of sub-part
     # ------------------------------------------
-    cursor.execute("INSERT INTO amount_simple_subpart (amount_simple_id, subpart_extracted, roman_numeral, arabic_numeral, amount_simple_subpart_uncertainty, unit_of_count_id) VALUES (%s, %s, %s, %s, %s, %s)", (amount_simple_id, subpart_extracted, roman_numeral, arabic_numeral, amount_simple_subpart_uncertainty, unit_of_count_id,))
+    return {
+        "subpart_extracted": subpart_extracted,
+        "roman_numeral": roman_numeral,
+        "arabic_numeral": arabic_numeral,
+        "amount_simple_subpart_uncertainty": amount_simple_subpart_uncertainty,
+        "unit_of_count_id": unit_of_count_id
+    }
 
 
 
@@ -312,44 +343,5 @@ def convert_roman_to_arabic_complex(roman_numeral_complex):
             return number_converted, uncertainty_conversion
 
 
-    # Initialize variables
-    uncertainty_conversion = None
-
-    # split complex number into parts
-    number_original_divided = re.findall(r'[IVXLCDM]+', roman_numeral_complex) 
-    number_converted = 0
-    # uncertainty_conversion = 0 # to report any errors
-
-    # calculate the number of parts in amounts
-    number_of_parts_in_amount = len(number_original_divided) 
-
-    # usualy the full complex amount can consiste of 3 parts: thousand (...M), hundred (...C) and ten (I..XCIX)
-    # so if there no parts or too many parts, we will report uncertainty but process each part
-    if number_of_parts_in_amount > 3 or number_of_parts_in_amount == 0: 
-        uncertainty_conversion = 1
-    
-    # process each part of complex number
-    for number_part in number_original_divided: 
-        length = len(number_part) # check the the length of value (to hundle numbers like just "M" or just "C")
-        last_char = number_part[-1] # assign variable to last character of number (to identifiy the parts of "thousand" or "hundred)
-
-        if length > 1:  # if the length is greater than 1 (it means that it is not a just "M" or just "C")
-            if last_char == 'M' and number_part != 'CM': # construct the part of "thousand"
-                number_part_list = [number_part[:-1]] # convert string to list to be able to use function "convert_roman_to_arabic"
-                converted_part, uncertainty_conversion = convert_roman_to_arabic(number_part_list)
-                # the result of function convert_roman_to_arabic is a list, to make a calulation we need to take a only first element (there is anyway only one element in list) and convert it to integer (same for all others below)
-                number_converted += int(converted_part[0]) * 1000
-            elif last_char == 'C' and number_part != 'XC': # construct the part of "hundred"
-                number_part_list = [number_part[:-1]] # convert string to list to be able to use function "convert_roman_to_arabic"
-                converted_part, uncertainty_conversion = convert_roman_to_arabic(number_part_list)
-                number_converted += int(converted_part[0]) * 100
-            else: # if not part of "thousand" or "hundred",then it is "simple" number
-                number_part_list = [number_part] # convert string to list to be able to use function "convert_roman_to_arabic"
-                converted_part, uncertainty_conversion = convert_roman_to_arabic(number_part_list)
-                number_converted += int(converted_part[0])
-        else: # if the length is less than 1 (it means that it is or a just "M" or just "C" or just a simple number like "XII", etc.)
-            number_part_list = [number_part] # convert string to list to be able to use function "convert_roman_to_arabic"
-            converted_part, uncertainty_conversion = convert_roman_to_arabic(number_part_list)
-            number_converted += int(converted_part[0])
-    return number_converted, uncertainty_conversion # return full converted number (it may also complex as simple number)
-
+    # Convert the numeral (see main_handler_roman.py, the value of each different numeral is calculated only once)
+    return convert_roman_numeral_complex(roman_numeral_complex)
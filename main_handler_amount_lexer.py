@@ -0,0 +1,358 @@
+"""
+Module: main_handler_amount_lexer.py
+
+Description:
+This module extracts the amounts of a line in one pass over the text of amounts.
+In main_handler_amount.py, the text of amounts goes through many regular expressions: the main regex to find all amounts (with many lookarounds), the search of "singul"/"computa", then for each simple amount the regex of currencies, the regex of sub-parts and the search of "minus", and for each sub-part the regex of Roman numerals and the search of the unit of count.
+Here the text is cut only once into tokens (Roman numerals, words, spaces, dots, other characters) and each token gets a kind (one letter). All the following steps read only the string of kinds of tokens (e.g. "RSuDSRSuDSc" for "XII l. II s. vien"), which is much shorter than the text and doesn't need any lookaround on the letters anymore.
+
+The result is exactly the same record as extract_amount() (see main_handler_amount.py), with the same simple amounts, sub-parts, currencies, units of count and uncertainties.
+extract_amount() stays the reference: if a rule of amounts is changed there, it must be changed here too (benchmark_amount.py checks that both give the same records and measures their speed).
+
+Functions:
+
+lex_amount():
+    The same as extract_amount(): extract the amounts of the line and return the record of amounts (or None).
+    With strict_roman=True (option of process_line()), the sub-parts with a Roman numeral not correctly written are also uncertain (see is_valid_roman_numeral() in main_handler_roman.py); extract_amount() doesn't have this option.
+
+tokenize_amount():
+    Cut the text into tokens and return the tokens, their positions in the text and the string of their kinds.
+
+find_amount_span():
+    Return the position of the amounts in the line (from the beginning of the first amount to the end of the last one), used as AMOUNT entity by the rules of main_handler_ner_rules.py.
+
+lex_amount_simple(), lex_subpart():
+    The same as extract_amount_simple() and extract_subpart() for the tokens of one simple amount.
+
+Kinds of tokens:
+- 'R': Roman numerals (all letters IVXLCDM which follow each other, e.g. "XII", or "I" at the end of "PETRI")
+- lowercase words (all letters a-z which follow each other), by their first letters:
+    'u': starts with l, d, s, o, p or m (unit of count, e.g. "l", "sol"), 'c': starts with another letter (currency, e.g. "fl", "tur")
+    'm': the word "minus", 'x': starts with "minus" (e.g. "minusculo")
+    'z', 'y', 'w': the same as 'u', 'c', 'x' but the word ends with "minus" (e.g. "dominus"): the regex of amounts can start at this "minus"
+- 'S': one space (or another whitespace character): each space is a token, because the regular expressions accept only one space between the parts of amounts
+- 'D': dots
+- 'O': another character of word (uppercase letter, digit, accented letter, "_"), 'N': another character (",", ";", etc.)
+There is a word boundary (\\b) after a lowercase word if the next token is not 'R' or 'O' (two lowercase words never follow each other).
+
+"""
+
+# Import libraries
+# ------------------------------------------
+import re # to cut the text into tokens and to read the kinds of tokens
+from itertools import accumulate # to calculate the positions of tokens
+
+# Import custom functions
+# ------------------------------------------
+from main_handler_amount import find_currency_to_search
+from main_handler_roman import convert_roman_numeral_complex
+
+
+# ==============================
+# Tokens
+# ==============================
+
+token_pattern = re.compile(r'[IVXLCDM]+|[a-z]+|\s|\.+|.', re.DOTALL)
+colon_pattern = re.compile(r':\s*(.*)')
+roman_start_pattern = re.compile(r'[IVXLCDM]')
+
+"""
+The kind of each different token (and below, the currency to search of each different currency) is calculated only once: the same tokens come back all the time.
+The dictionary is emptied if it becomes too big.
+"""
+class CalculatedOnce(dict):
+    def __init__(self, calculate, max_size=100000):
+        super().__init__()
+        self.calculate = calculate
+        self.max_size = max_size
+
+    def __missing__(self, key):
+        if len(self) >= self.max_size:
+            self.clear()
+        value = self[key] = self.calculate(key)
+        return value
+
+
+def find_kind(token):
+    first = token[0]
+
+    if first in 'IVXLCDM':
+        return 'R'
+
+    if 'a' <= first <= 'z':
+        if token == 'minus':
+            return 'm'
+        if token.startswith('minus'):
+            kind = 'x'
+        elif first in 'ldsopm':
+            kind = 'u'
+        else:
+            kind = 'c'
+        if token.endswith('minus'):
+            kind = {'x': 'w', 'u': 'z', 'c': 'y'}[kind]
+        return kind
+
+    if first == '.':
+        return 'D'
+    if token.isspace():
+        return 'S'
+    if token.isalnum() or token == '_':
+        return 'O'
+    return 'N'
+
+
+kinds_of_tokens = CalculatedOnce(find_kind)
+
+def tokenize_amount(text):
+    tokens = token_pattern.findall(text)
+    kinds = ''.join(map(kinds_of_tokens.__getitem__, tokens))
+
+    # positions[k] is the start of the token k in the text, positions[k + 1] its end
+    positions = [0, *accumulate(map(len, tokens))]
+
+    return tokens, positions, kinds
+
+
+
+# ==============================
+# Patterns on the kinds of tokens
+# ==============================
+
+"""
+Each pattern reads the kinds of tokens exactly as the regex of main_handler_amount.py reads the text.
+
+Main regex of extract_amount():
+    (?:minus\\s)*[IVXLCDM]+(?:\\s[IVXLCDM]+)*\\s\\b(?!l|d|s|o|p|m)(?!minus)[a-z]+\\b\\.*(?:\\s\\b(?!l|d|s|o|p|m)(?!minus)[a-z]+\\b\\.*)*
+    |(?:minus\\s)*(?:[IVXLCDM]+(?:\\s[IVXLCDM]+)*\\s(?:\\b(?=l|d|s|o|p|m)(?!minus)[a-z]+\\b)+\\.*)+(?:\\s[IVXLCDM]+\\s(?:\\b(?=l|d|s|o|p|m)(?!minus)[a-z]+\\b)+\\.*)*(?:\\s(?!minus)[a-z]*\\.*)*
+An amount starts with "minus " (the first "minus" can be the end of a word, the regex has no word boundary before it) or with Roman numerals, then:
+- first form: Roman numerals, a space and currency words (not starting with l, d, s, o, p, m), e.g. "XII fl. auri"
+- second form: Roman numerals, a space and a unit of count (word starting with l, d, s, o, p, m), repeated, then the other words (or spaces alone), e.g. "XII l. II s. vien."
+As amounts_pattern in main_handler_amount.py, an amount doesn't start in the middle of Roman numerals separated by spaces ("RS" before) or of "minus minus ..." ("mS" before a "minus"): these attempts always fail and would make the time grow with the square of the length of the line.
+"""
+amount_pattern = re.compile(r'(?:((?:[yzw]|(?<!mS)m)S(?:mS)*)|(?<!RS))(?:R(?:SR)*S[cy](?![RO])D?(?:S[cy](?![RO])D?)*|(?:R(?:SR)*S[uz](?![RO])D?)+(?:SRS[uz](?![RO])D?)*(?:S(?![mxw])[cuyz]?D?)*)')
+
+"""
+Regex of currencies of extract_amount_simple(): \\b(?!l|d|s|o|p|m)(?!minus)[a-z]+\\b\\.*(?:\\s[a-z]+\\.*)*
+A currency is a word (not starting with l, d, s, o, p, m) followed by the next words separated by one space, e.g. "tur. parv."
+"""
+currency_pattern = re.compile(r'(?<![RO])[cy](?![RO])D?(?:S[muzcyxw]D?)*')
+
+"""
+Regex of sub-parts of extract_amount_simple(): [IVXLCDM]+(?:\\s[IVXLCDM]+)*(?:\\s\\b(?=l|d|s|o|p|m)[a-z]+\\b\\.*)*
+A sub-part is Roman numerals followed by the units of count (here "minus" is also a unit of count), e.g. "XII l."
+"""
+subpart_pattern = re.compile(r'R(?:SR)*(?:S[muzxw](?![RO])D?)*')
+roman_group_pattern = re.compile(r'R(?:SR)*')
+
+"""
+Search of the arithmetic operator of extract_amount_simple(): \\bminus\\b
+"""
+minus_pattern = re.compile(r'(?<![RO])m(?![RO])')
+
+
+
+# ==============================
+# Process amount
+# ==============================
+
+"""
+The same steps as extract_amount() (see main_handler_amount.py for the explanations):
+1. text with amounts (after ":" or from the first Roman numeral)
+2. amounts found in this text (composite amount if more than one)
+3. for each simple amount: currency, sub-parts, arithmetic operator
+"""
+
+def lex_amount(line, strict_roman=False):
+
+    # Extract part of text with possible amounts
+    # ------------------------------------------
+    colon = colon_pattern.search(line)
+    if colon:
+        text = colon.group(1)
+    else:
+        roman = roman_start_pattern.search(line, 1)
+        if not roman:
+            return None # if not found amount, warning - need to check manually
+        text = line[roman.start():]
+
+    tokens, positions, kinds = tokenize_amount(text)
+
+    # Define amount type (composite or simple)
+    # ------------------------------------------
+    amounts = list(amount_pattern.finditer(kinds))
+    count_amounts = len(amounts)
+
+    if count_amounts > 10 or count_amounts == 0:
+        return None
+
+    amounts_simple = []
+    for amount in amounts:
+        first, last = amount.span()
+        amount_kinds = kinds[first:last]
+        amount_positions = positions[first:last + 1]
+
+        # the amount starts at the "minus" at the end of the first word
+        if amount.group(1) and amount_kinds[0] != 'm':
+            amount_kinds = 'm' + amount_kinds[1:]
+            amount_positions[0] = amount_positions[1] - 5
+
+        amounts_simple.append(lex_amount_simple(text, amount_kinds, amount_positions, strict_roman))
+
+    # Process amount composite
+    # ------------------------------------------
+    if count_amounts > 1:
+        return {
+            "amount_composite": {
+                "amount_composite_extracted": text,
+                "amount_composite_uncertainty": 0
+            },
+            "exchange_rate_extracted": text if has_exchange_rate(text) else None,
+            "amounts_simple": amounts_simple
+        }
+
+    # Process amount simple
+    # ------------------------------------------
+    return {
+        "amount_composite": None,
+        "exchange_rate_extracted": None,
+        "amounts_simple": amounts_simple
+    }
+
+
+# Position of the amounts in the line
+# ------------------------------------------
+"""
+The same amounts as lex_amount(), but only their position in the line is returned: (start, end), or None if there is no amount.
+    >>> find_amount_span('Item eidem pro cera : XII fl. V s.') = (22, 34), "XII fl. V s."
+"""
+
+def find_amount_span(line):
+    colon = colon_pattern.search(line)
+    if colon:
+        offset, text = colon.start(1), colon.group(1)
+    else:
+        roman = roman_start_pattern.search(line, 1)
+        if not roman:
+            return None
+        offset, text = roman.start(), line[roman.start():]
+
+    tokens, positions, kinds = tokenize_amount(text)
+    amounts = list(amount_pattern.finditer(kinds))
+    if not amounts:
+        return None
+
+    start = positions[amounts[0].start()]
+    if amounts[0].group(1) and kinds[amounts[0].start()] != 'm': # the amount starts at the "minus" at the end of the first word
+        start = positions[amounts[0].start() + 1] - 5
+    end = positions[amounts[-1].end()]
+
+    return offset + start, offset + end
+
+
+# Check if the composite amount contains an exchange rate
+# ------------------------------------------
+"""
+The same as re.search(r'\\b(singul|computa)\\w*\\b', text, re.IGNORECASE): a word starts with "singul" or "computa" (in lowercase or uppercase).
+The regex is used only if the text contains "ngul" or "mputa" (these letters have no other form when the case is ignored).
+"""
+exchange_rate_pattern = re.compile(r'\b(?:singul|computa)', re.IGNORECASE)
+
+def has_exchange_rate(text):
+    text_lower = text.lower()
+    if 'ngul' not in text_lower and 'mputa' not in text_lower:
+        return False
+    return exchange_rate_pattern.search(text) is not None
+
+
+
+# ==============================
+# Process amount simple
+# ==============================
+
+"""
+The simple amount is given by the kinds of its tokens and their positions in the text (amount_positions[k] is the start of the token k, the last position is the end of the amount).
+"""
+
+currencies_to_search = CalculatedOnce(find_currency_to_search)
+
+def lex_amount_simple(text, amount_kinds, amount_positions, strict_roman=False):
+    amount_simple_extracted = text[amount_positions[0]:amount_positions[-1]]
+
+    currency_extracted = None
+    currency_to_search = None
+    amount_simple_uncertainty = 0
+
+    # Process currencies
+    # ------------------------------------------
+    # the first currency is kept, the uncertainty is 1 if there is another one
+    currencies = currency_pattern.finditer(amount_kinds)
+    currency = next(currencies, None)
+
+    if currency:
+        amount_simple_uncertainty = 1 if next(currencies, None) else None
+        currency_extracted = text[amount_positions[currency.start()]:amount_positions[currency.end()]]
+        currency_to_search = currencies_to_search[currency_extracted]
+
+    # Process sub-parts of simple amount
+    # ------------------------------------------
+    subparts = [lex_subpart(text, amount_kinds, amount_positions, subpart.start(), subpart.end(), strict_roman) for subpart in subpart_pattern.finditer(amount_kinds)]
+
+    if not subparts:
+        amount_simple_uncertainty = 1
+
+    # Process arithmetic operator
+    # ------------------------------------------
+    arithmetic_operator = 'minus' if minus_pattern.search(amount_kinds) else None
+
+    # Record of simple amount (see extract_amount_simple())
+    # ------------------------------------------
+    return {
+        "amount_simple_extracted": amount_simple_extracted,
+        "currency_extracted": currency_extracted,
+        "currency_to_search": currency_to_search,
+        "arithmetic_operator": arithmetic_operator,
+        "amount_simple_uncertainty": amount_simple_uncertainty,
+        "subparts": subparts
+    }
+
+
+
+# ==============================
+# Process subpart
+# ==============================
+
+"""
+In a sub-part, the Roman numerals are always followed by a space or by the end of the sub-part, so there is only one group of Roman numerals (the same as the regex of Roman numerals of extract_subpart()).
+The unit of count is given by the first letter of the first word after the Roman numerals.
+"""
+
+unit_of_count_prefix_to_id = {
+    'l': '1',
+    's': '2',
+    'd': '3',
+    'o': '4',
+    'p': '5',
+    'm': '6'
+}
+
+def lex_subpart(text, amount_kinds, amount_positions, first, last, strict_roman=False):
+    subpart_extracted = text[amount_positions[first]:amount_positions[last]]
+
+    # Process Roman numerals
+    roman_end = roman_group_pattern.match(amount_kinds, first).end()
+    roman_numeral = text[amount_positions[first]:amount_positions[roman_end]]
+    arabic_numeral, amount_simple_subpart_uncertainty = convert_roman_numeral_complex(roman_numeral, strict_roman) # with strict_roman, a numeral not correctly written is uncertain (see is_valid_roman_numeral())
+
+    # Process unit of count (the token after the space which follows the Roman numerals)
+    unit_of_count_id = None
+    if roman_end < last:
+        unit_of_count_id = unit_of_count_prefix_to_id.get(text[amount_positions[roman_end + 1]])
+
+    # Record of sub-part (see extract_subpart())
+    return {
+        "subpart_extracted": subpart_extracted,
+        "roman_numeral": roman_numeral,
+        "arabic_numeral": arabic_numeral,
+        "amount_simple_subpart_uncertainty": amount_simple_subpart_uncertainty,
+        "unit_of_count_id": unit_of_count_id
+    }
@@ -11,18 +11,31 @@ Functions:
    - Parameters: dates_extracted (list), previous_date_standardized (str, optional)
    - Returns: dates_processed (list)
 
+   find_dates(dates_extracted), resolve_dates(dates_found, previous_date_standardized="1000-01-01"):
+   - Description: The two steps of process_date(): find what is written in each date without the previous date (can be done for all lines at the same time), then complete the dates in order with the previous date.
+   - Returns: dates_found (list of (date_extracted, date_mentions)), dates_processed (list)
+
 2. standardize_date(date_extracted, previous_date_standardized='1000-01-01'):
-   - Description: Standarize a date extracted from text to YYYY-MM-DD format.
+   - Description: Standarize a date extracted from text to YYYY-MM-DD format (each different text of date is parsed only once by find_date_mentions(), see date_cache_statistics()).
    - Parameters: date_extracted (str), previous_date_standardized (str, optional)
    - Returns: date_standardized (str), date_uncertainty (int)
 
+   parse_date(date_extracted, previous_date_standardized='1000-01-01'):
+   - Description: Find the day, the month and the year of a date in one pass (the same result as find_day(), find_year() and find_month()).
+   - Parameters: date_extracted (str), previous_date_standardized (str, optional)
+   - Returns: date_parts (dict)
+
+   find_date_mentions(date_extracted), resolve_date_mentions(date_mentions, previous_date_standardized='1000-01-01'), standardize_date_mentions(date_mentions, previous_date_standardized='1000-01-01'):
+   - Description: The two steps of parse_date() and standardize_date(): the day, the month and the year written in the date (without the previous date, each different text is processed only once), then completed with the previous date.
+   - Returns: date_mentions (dict), date_parts (dict), (date_standardized (str), date_uncertainty (int))
+
 3. extract_roman_numerals(date_extracted):
    - Description: Extract Roman numerals from provided text.
    - Parameters: date_extracted (str)
    - Returns: roman_numerals (list)
 
 4. convert_roman_to_arabic(roman_numerals):
-   - Description: Convert a list of Roman numerals to Arabic numerals.
+   - Description: Convert a list of Roman numerals to Arabic numerals (with convert_roman_numerals() from main_handler_roman.py).
    - Parameters: roman_numerals (list)
    - Returns: arabic_numerals (list, int), date_uncertainty (int)
 
@@ -42,11 +55,21 @@ Functions:
    - Returns: month (str), month_count (int)
 
 8. process_date_into_database(cursor, line, line_type, line_nlp, previous_date_standardized):
-   - Description: Process date to insert into database.
+   - Description: Process date to insert into database (extract_date() + insert_date() from main_writer_database.py).
    - Parameters: cursor, line, line_type, line_nlp, previous_date_standardized
+   - Returns: date_id (int), previous_date_standardized (str)
+
+   extract_date(line, line_type, line_nlp, previous_date_standardized):
+   - Description: Extract the dates of the line without database.
+   - Parameters: line, line_type, line_nlp, previous_date_standardized
+   - Returns: date_record (dict), previous_date_standardized (str)
+
+   resolve_date(line, line_type, dates_found, previous_date_standardized):
+   - Description: The second step of extract_date(): the record of dates from the dates found by find_dates() and the previous date.
+   - Returns: date_record (dict), previous_date_standardized (str)
 
 9. process_duration(line, start_date_standardized, start_date_uncertainty, end_date_uncertainty):
-   - Description: Process duration to insert into database.
+   - Description: Process duration to insert into database (each different call is processed only once, see date_cache_statistics()).
    - Parameters: line, start_date_standardized, start_date_uncertainty, end_date_uncertainty
 
 10. extract_preceding_words(line, target_words, excerpt_size):
@@ -60,6 +83,46 @@ Functions:
 import re # to work with regular expressions
 import calendar # to work with calendars date
 from datetime import datetime, timedelta # to work with datetime objects (to add or substruct days from given date)
+from functools import lru_cache # to process each different date (and each different word of date) only once
+
+# Import custom functions
+# ------------------------------------------
+from main_writer_database import insert_date
+from main_handler_roman import convert_roman_numerals
+from main_handler_ner import index_line_entities
+
+
+# ==============================
+# Memory of processed dates
+# ==============================
+
+"""
+The same dates come back thousands of times in the accounts ("eadem die", "die XII mensis augusti", sums of weeks, etc.), and the result of find_date_mentions() (the text of the date) and of process_duration() (the text of the line and its dates) depends only on their parameters.
+So the result of each different call is kept in memory (functools.lru_cache, at most date_cache_size results for each function, the least recently used are deleted first): a date already parsed is found in the memory instead of being parsed again.
+The completion with the previous date (resolve_dates(), standardize_date_mentions()) is only a few operations, so it is not kept in memory.
+date_cache_statistics() gives the hits (results found in the memory) and the misses (results calculated) of each function, clear_date_caches() empties the memory.
+"""
+
+date_cache_size = 16384
+
+def date_cache_statistics():
+    statistics = {}
+    for function in (find_date_mentions, process_duration):
+        cache_info = function.cache_info()
+        count_calls = cache_info.hits + cache_info.misses
+        statistics[function.__name__] = {
+            "hits": cache_info.hits,
+            "misses": cache_info.misses,
+            "hit_rate": round(cache_info.hits / count_calls, 3) if count_calls else 0.0,
+            "entries": cache_info.currsize
+        }
+    return statistics
+
+
+def clear_date_caches():
+    find_date_mentions.cache_clear()
+    process_duration.cache_clear()
+
 
 # ==============================
 # Date Full Processing 
@@ -90,26 +153,50 @@ Returns (output):
 """
 
 def process_date(dates_extracted, previous_date_standardized="1000-01-01"):
+    return resolve_dates(find_dates(dates_extracted), previous_date_standardized)
+
+
+"""
+The processing of dates is done in two steps, so the first one (the slowest) can be done for all lines at the same time, in any order (see extract_line_partial() in main_processor_line.py):
+1. find_dates(): find what is written in each date without the previous date: the day, the month and the year mentioned (find_date_mentions()), or None if the date is the same as the previous date ("eadem die", "dicta die");
+2. resolve_dates(): complete the dates in order of lines with the previous date (cheap).
+process_date() = resolve_dates(find_dates()).
+"""
+
+def find_dates(dates_extracted):
+    dates_found = []
+
+    # if date has "eadem die" or "dicta die", use the previous date
+    exclude_keywords = {"eadem die", "dicta die"}
+    for date_extracted in dates_extracted:
+        if any(keyword.lower() in date_extracted.lower() for keyword in exclude_keywords):
+            dates_found.append((date_extracted, None))
+        else:
+            dates_found.append((date_extracted, find_date_mentions(date_extracted)))
+
+    return dates_found
+
+
+def resolve_dates(dates_found, previous_date_standardized="1000-01-01"):
     ## VARIABLES
     dates_processed = []
 
     # if line have the date(s)
-    if dates_extracted:
+    if dates_found:
 
         # process each date
-        for date_extracted in dates_extracted:
+        for date_extracted, date_mentions in dates_found:
             # Initialize variables
             date_standardized = None
             date_uncertainty = 0
 
-            # if date has "eadem die" or "dicta die", use the previous date
-            exclude_keywords = {"eadem die", "dicta die"}
-            if any(keyword.lower() in date_extracted.lower() for keyword in exclude_keywords):
+            # "eadem die" or "dicta die": the previous date
+            if date_mentions is None:
                 date_standardized = previous_date_standardized
                 date_uncertainty += 1
-            # if not, process DATE and calculate new values
+            # if not, calculate new values
             else:
-                date_standardized, date_uncertainty = standardize_date(date_extracted, previous_date_standardized)
+                date_standardized, date_uncertainty = standardize_date_mentions(date_mentions, previous_date_standardized)
 
             # to pass previous date through iterination
             previous_date_standardized = date_standardized
@@ -162,21 +249,16 @@ Returns (output):
 
 
 def standardize_date(date_extracted, previous_date_standardized='1000-01-01'):
+    return standardize_date_mentions(find_date_mentions(date_extracted), previous_date_standardized)
 
-    # 1. Extract Roman Numerals
-    roman_numerals = extract_roman_numerals(date_extracted)
-
-    # 2. Convert Roman to Arabic
-    arabic_numerals, date_uncertainty = convert_roman_to_arabic(roman_numerals)
 
-    # 3. Find a day
-    day, day_count = find_day(date_extracted, arabic_numerals, previous_date_standardized)
+# Standardize the day, the month and the year found in a date (see find_date_mentions()) with the previous date
+# ------------------------------------------
+def standardize_date_mentions(date_mentions, previous_date_standardized='1000-01-01'):
 
-    # 4. Find a year
-    year, year_count = find_year(arabic_numerals, previous_date_standardized)
-
-    # 5. Find a month
-    month, month_count = find_month(date_extracted, previous_date_standardized)
+    # 1-5. Extract and convert Roman numerals, find a day, a year and a month (in one pass, see parse_date())
+    date_parts = resolve_date_mentions(date_mentions, previous_date_standardized)
+    date_uncertainty = date_parts["conversion_uncertainty"]
 
     # 6. Set up the uncertain variable if there are several mentions of day, month
     # for year the warning only there are more than one mention,
@@ -184,15 +266,144 @@ def standardize_date(date_extracted, previous_date_standardized='1000-01-01'):
     # Be careful, if there are many values for day, month or year we keep only a last found ones (beacause we want to construt a valid date in format YYYY-MM-DD)
     # If need to keep all values, feel free to adapt the code to your need
 
-    if day_count != 1 or year_count > 1 or month_count != 1:
+    if date_parts["day_count"] != 1 or date_parts["year_count"] > 1 or date_parts["month_count"] != 1:
         date_uncertainty += 1  # if we have zero or more than one mentions for day, month or year, so, Houston, we have a problem
 
     # 7. Date standarization to SQL
-    date_standardized = f"{year}-{month.zfill(2)}-{day.zfill(2)}"
+    date_standardized = f"{date_parts['year']}-{date_parts['month'].zfill(2)}-{date_parts['day'].zfill(2)}"
 
     return date_standardized, date_uncertainty
 
 
+# ==============================
+# Parse date in one pass
+# ==============================
+
+"""
+Description:
+Finds the day, the month and the year of a date extracted from text in one pass.
+The result is exactly the same as with the functions find_day(), find_year() and find_month() below (they are kept as the reference of the rules, see benchmark_date.py), but:
+- the Roman numerals are extracted and converted only once (find_day() calls find_year() and find_month() again);
+- the previous date is split only once, and the last day of the month is calculated only if the day is "ultima";
+- each word of the text is compared to the names of months and to the keywords of days only the first time it is found (lookup_date_word()), the words are always the same ("die", "mensis", "augusti", etc.).
+
+Parameters (input):
+- date_extracted (str): The text containing the date information.
+    >>> Example: date_extracted = 'Anno Domini millesimo CCCXVI, die XII mensis augusti'
+- previous_date_standardized (str, optional): The previously standardized date (default is '1000-01-01' if unknown).
+    >>> Example: previous_date_standardized = '1000-01-01'
+
+Returns (output):
+- date_parts (dict): The year, month and day (str) with the counts of their mentions (as returned by find_year(), find_month() and find_day()), and the uncertainty of conversion of Roman numerals (as returned by convert_roman_to_arabic()).
+    >>> Example: date_parts = {'year': '1316', 'year_count': 1, 'month': '08', 'month_count': 1, 'day': '12', 'day_count': 1, 'conversion_uncertainty': 0}
+"""
+
+def parse_date(date_extracted, previous_date_standardized='1000-01-01'):
+    return resolve_date_mentions(find_date_mentions(date_extracted), previous_date_standardized)
+
+
+"""
+parse_date() is done in two steps:
+- find_date_mentions(): the day, the month and the year written in the date (None if not found), without the previous date, so the result depends only on the text (each different text is processed only once, see date_cache_statistics());
+- resolve_date_mentions(): the values not found are taken from the previous date, and the last day of month ("ultima") is calculated with the month and the year.
+"""
+
+@lru_cache(maxsize=date_cache_size)
+def find_date_mentions(date_extracted):
+    year = month = day = None # not found
+    year_count = 0
+    month_count = 0
+    day_count = 0
+    last_day = False
+
+    # 1. Year and day from Roman numerals
+    arabic_numerals, conversion_uncertainty = convert_roman_to_arabic(extract_roman_numerals(date_extracted))
+
+    for arabic_numeral in arabic_numerals:
+        if arabic_numeral >= 1000:
+            # for case like "Anno Domini MCCCXVII"
+            year = str(arabic_numeral)
+            year_count += 1
+        elif 100 <= arabic_numeral <= 999:
+            # for case like "Anno Domini millesimo CCCXVI"
+            year = str(arabic_numeral + 1000)
+            year_count += 1
+        elif 1 <= arabic_numeral <= 31:
+            day = str(arabic_numeral)
+            day_count += 1
+
+    # 2. Month and keywords of day from words
+    keywords_found = 0 # one bit for each keyword of day_keywords found in the text
+    for word in date_extracted.split():
+        word_month, word_month_count, word_keywords = lookup_date_word(word)
+        if word_month_count:
+            month = word_month
+            month_count += word_month_count
+        keywords_found |= word_keywords
+
+    # 3. Day from keywords (only if there is no valid day in Roman numerals)
+    # as in find_day(), each keyword found is counted once and the last keyword of day_keywords gives the day
+    if day_count == 0 and keywords_found:
+        day_count = bin(keywords_found).count('1')
+        day = day_keywords[keywords_found.bit_length() - 1][1]
+        last_day = day is None # "ultima", the last day of month (calculated with the month and the year)
+
+    return {
+        "year": year,
+        "year_count": year_count,
+        "month": month,
+        "month_count": month_count,
+        "day": day,
+        "day_count": day_count,
+        "last_day": last_day,
+        "conversion_uncertainty": conversion_uncertainty
+    }
+
+
+def resolve_date_mentions(date_mentions, previous_date_standardized='1000-01-01'):
+    year, month, day = previous_date_standardized.split('-') # default values, if not found
+    year = date_mentions["year"] or year
+    month = date_mentions["month"] or month
+    day = date_mentions["day"] or day
+    if date_mentions["last_day"]:
+        day = str(calendar.monthrange(int(year), int(month))[1])
+
+    return {
+        "year": year,
+        "year_count": date_mentions["year_count"],
+        "month": month,
+        "month_count": date_mentions["month_count"],
+        "day": day,
+        "day_count": date_mentions["day_count"],
+        "conversion_uncertainty": date_mentions["conversion_uncertainty"]
+    }
+
+
+# Compare one word to the names of months and to the keywords of days
+# ------------------------------------------
+"""
+Return the month of the word (the last name of month which starts the word, as in find_month()), the number of names of months which start the word, and the keywords of days contained in the word (one bit for each keyword of day_keywords).
+The keywords of days are searched in the whole text by find_day(), but they don't contain spaces, so they are always inside one word.
+"""
+
+@lru_cache(maxsize=4096)
+def lookup_date_word(word):
+    word_lower = word.lower()
+    word_month = None
+    word_month_count = 0
+    for month_name, month_number in month_mapping.items():
+        if word_lower.startswith(month_name):
+            word_month = month_number
+            word_month_count += 1
+
+    word_keywords = 0
+    for position, (keyword, value) in enumerate(day_keywords):
+        if keyword in word:
+            word_keywords |= 1 << position
+
+    return word_month, word_month_count, word_keywords
+
+
 # ==============================
 # Extract roman numerals
 # ==============================
@@ -239,24 +450,12 @@ Returns (output):
 
 
 def convert_roman_to_arabic(roman_numerals):
-    roman_dict = {'I': 1, 'V': 5, 'X': 10, 'L': 50, 'C': 100, 'D': 500, 'M': 1000}
     arabic_numerals = [] # to store all converted arabic numerals
     uncertainty_conversion = 0
 
-    for roman_numeral in roman_numerals:
-        arabic_numeral = 0
-        prev_value = 0
-        for char in reversed(roman_numeral):
-            if char not in roman_dict:  # Check if the character is a valid Roman numeral
-                uncertainty_conversion += 1
-                continue # if this function is used separetly, then it will ignore non valid roman numeral and continue
-            value = roman_dict[char]
-            if value < prev_value:
-                arabic_numeral -= value
-            else:
-                arabic_numeral += value
-            prev_value = value
-
+    # each numeral is converted by main_handler_roman.py (the value of each different numeral is calculated only once)
+    for arabic_numeral, invalid_characters in convert_roman_numerals(roman_numerals, complex=False):
+        uncertainty_conversion += invalid_characters # if this function is used separetly, then it will ignore non valid roman numeral and continue
         arabic_numerals.append(arabic_numeral)
 
     return arabic_numerals, uncertainty_conversion
@@ -289,6 +488,42 @@ Returns (output):
 """
 
 
+# Values of days expressed in letters or with special writing (in this order, the last one found gives the day)
+# "ultima" is the last day of month (None: calculated from the month and the year)
+day_keywords = [
+    ("prima", "01"),
+    ("secunda", "02"),
+    ("tertia", "03"),
+    ("quarta", "04"),
+    ("quinta", "05"),
+    ("septima", "07"),
+    ("nona", "09"),
+    ("decima", "10"),
+    ("ultima", None),
+    ("XXIIII", "24"),
+    ("XIIII", "14"),
+    ("IIII", "04")
+]
+
+# Beginnings of names of months
+month_mapping = {
+    'januar': '01',
+    'februar': '02',
+    'febroar': '02',
+    'mart': '03',
+    'april': '04',
+    'mad': '05',
+    'maii': '05',
+    'jun': '06',
+    'jul': '07',
+    'august': '08',
+    'septembr': '09',
+    'octobr': '10',
+    'novembr': '11',
+    'decembr': '12',
+}
+
+
 # Find a day
 def find_day(date_extracted, arabic_numerals, previous_date_standardized='1000-01-01'):
     # day = 'O1' # default day
@@ -319,20 +554,7 @@ def find_day(date_extracted, arabic_numerals, previous_date_standardized='1000-0
     # if there are no valid day value found in the arabic values, look for value expressed in letters or with special writing 
     # to start, create the map of values
     if not found_valid_day_in_arabic_values:
-        keyword_to_day = {
-            "prima": "01",
-            "secunda": "02",
-            "tertia": "03",
-            "quarta": "04",
-            "quinta": "05",
-            "septima": "07",
-            "nona": "09",
-            "decima": "10",
-            "ultima": num_days_in_month,
-            "XXIIII": "24",
-            "XIIII": "14",
-            "IIII": "04"
-        }
+        keyword_to_day = {keyword: value if value else num_days_in_month for keyword, value in day_keywords} # "ultima" is the last day of month
 
         # look for mentionned values in the initial text of date
         for keyword, value in keyword_to_day.items():
@@ -417,23 +639,6 @@ def find_month(date_extracted, previous_date_standardized='1000-01-01'):
     month = previous_date_standardized.split('-')[1]  # default month, if no month found
     month_count = 0
 
-    month_mapping = {
-        'januar': '01',
-        'februar': '02',
-        'febroar': '02',
-        'mart': '03',
-        'april': '04',
-        'mad': '05',
-        'maii': '05',
-        'jun': '06',
-        'jul': '07',
-        'august': '08',
-        'septembr': '09',
-        'octobr': '10',
-        'novembr': '11',
-        'decembr': '12',
-    }
-
     # Split the text into words
     words = date_extracted.split()
 
@@ -459,7 +664,28 @@ def find_month(date_extracted, previous_date_standardized='1000-01-01'):
 # Process date to insert into database
 # =====================================================
 
+"""
+The dates of the line are extracted by extract_date() (without database) and returned as a record with the values of the table "date":
+start_date_extracted, start_date_standardized, start_date_uncertainty, end_date_extracted, end_date_standardized, end_date_uncertainty, duration_extracted, duration_standardized_in_days, duration_uncertainty
+Then the record is inserted by insert_date() (see main_writer_database.py).
+"""
+
 def process_date_into_database(cursor, line, line_type, line_nlp, previous_date_standardized):
+    date_record, previous_date_standardized = extract_date(line, line_type, index_line_entities(line_nlp), previous_date_standardized)
+    date_id = insert_date(cursor, date_record)
+
+    return date_id, previous_date_standardized
+
+
+def extract_date(line, line_type, line_nlp, previous_date_standardized):
+    return resolve_date(line, line_type, find_dates(line_nlp.by_label.get("DATE", ())), previous_date_standardized)
+
+
+"""
+resolve_date() makes the record of dates of the line from the dates found by find_dates() (see process_date()) and the previous date.
+"""
+
+def resolve_date(line, line_type, dates_found, previous_date_standardized):
 
     # Initialize variables for start and end dates
     # start_date_extracted = None
@@ -476,19 +702,8 @@ def process_date_into_database(cursor, line, line_type, line_nlp, previous_date_
     duration_standardized_in_days = None
     duration_uncertainty = None
 
-    # Initialize variable for date_id if there are no dates
-    date_id = None
-
-    # Extract all Data NER entity
-    dates_extracted = []
-
-    for ent in line_nlp.ents:
-        # Checking if the entity has the label "DATE"
-        if ent.label_ == "DATE":
-            dates_extracted.append(ent.text)
-
-    # process extracted date(s)
-    dates_processed = process_date(dates_extracted, previous_date_standardized)
+    # process the dates found in the line (entities DATE)
+    dates_processed = resolve_dates(dates_found, previous_date_standardized)
 
     # Check if any dates were processed
     # if dates_processed:
@@ -508,10 +723,18 @@ def process_date_into_database(cursor, line, line_type, line_nlp, previous_date_
     if line_type == "8": # = "SumPeriod"
         start_date_standardized, start_date_uncertainty, end_date_standardized, end_date_uncertainty, duration_extracted, duration_standardized_in_days, duration_uncertainty = process_duration (line, start_date_standardized, start_date_uncertainty, end_date_standardized, end_date_uncertainty)
 
-    # Insert data into database
-    cursor.execute("INSERT INTO date (start_date_extracted, start_date_standardized, start_date_uncertainty, end_date_extracted, end_date_standardized, end_date_uncertainty, duration_extracted, duration_standardized_in_days, duration_uncertainty) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)", (start_date_extracted, start_date_standardized, start_date_uncertainty, end_date_extracted, end_date_standardized, end_date_uncertainty, duration_extracted, duration_standardized_in_days, duration_uncertainty,))
-    date_id = cursor.lastrowid  # Retrieve auto-incremented ID
-
+    # Record of dates
+    date_record = {
+        "start_date_extracted": start_date_extracted,
+        "start_date_standardized": start_date_standardized,
+        "start_date_uncertainty": start_date_uncertainty,
+        "end_date_extracted": end_date_extracted,
+        "end_date_standardized": end_date_standardized,
+        "end_date_uncertainty": end_date_uncertainty,
+        "duration_extracted": duration_extracted,
+        "duration_standardized_in_days": duration_standardized_in_days,
+        "duration_uncertainty": duration_uncertainty
+    }
 
     # UPDATE VARIABLES
     if end_date_standardized:
@@ -519,7 +742,7 @@ def process_date_into_database(cursor, line, line_type, line_nlp, previous_date_
     else:
         previous_date_standardized = start_date_standardized
 
-    return date_id, previous_date_standardized
+    return date_record, previous_date_standardized
 
 
 
@@ -527,6 +750,7 @@ def process_date_into_database(cursor, line, line_type, line_nlp, previous_date_
 # Process duration to insert into database
 # =====================================================
 
+@lru_cache(maxsize=date_cache_size)
 def process_duration (line, start_date_standardized, start_date_uncertainty, end_date_standardized, end_date_uncertainty):
 
     # Variables
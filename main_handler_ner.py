@@ -0,0 +1,217 @@
+"""
+Module: main_handler_ner.py
+
+Description:
+This module contains functions to apply the spaCy model (NER) to the lines of text.
+The NER is the most expensive step of the processing, so instead of calling the model once per line, the lines can be sent to the model in batches (with nlp.pipe).
+
+Functions:
+
+process_ner():
+    This is the main function to apply the spaCy model to the lines of text. It returns the processed lines (spaCy Doc objects) one by one and always in the original order of the lines, so the function process_line() can work with them as before.
+    If no batch size is given, each line is processed separately (as before).
+    If a batch size is given, the lines are processed in batches with nlp.pipe.
+    If sort_by_length is True, the lines are sorted by their length before batching (lines of similar length are processed together, which is faster) and the original order is restored afterwards.
+    If n_process is greater than 1, the NER of the lines is spread over several worker processes (nlp.pipe(n_process=...)). spaCy returns the processed lines in the order they were sent, so the original order of the lines is kept in this case too. This is important because process_line() carries values from one line to the next (folio, date, participant, rubric and subrubric).
+
+doc_to_spans():
+    Convert a line processed by spaCy (Doc) to a compact list of entities: (start_char, end_char, label). This list is small and easy to send to another process or to store.
+
+spans_to_line_entities():
+    Convert back a compact list of entities to an object which can be used by the functions of process_line() in place of a spaCy Doc (LineEntities).
+
+index_line_entities():
+    Convert a line processed by spaCy (Doc) to LineEntities right after the NER. The entities are grouped by label and the words of the line are split only once, for all functions of process_line(), and the Doc can be freed at once.
+
+pipe_missing_lines():
+    Send only some of the lines to the model (the lines not found in the NER cache, the lines which need NER, see main_handler_ner_cache.py and main_handler_ner_selective.py) through one single nlp.pipe() for all the lines, and return the results of all the lines in the original order.
+
+"""
+
+# Import libraries
+# ------------------------------------------
+from collections import namedtuple # to define a simple structure for entities
+from collections import deque # to keep the lines waiting for the model in order
+
+
+# ==============================
+# Apply NER to the lines of text
+# ==============================
+
+def process_ner(nlp_model, lines, batch_size=None, sort_by_length=False, n_process=1):
+
+    # No batch and no worker processes: process each line separately
+    # ------------------------------------------
+    if not batch_size and n_process == 1:
+        for line in lines:
+            yield nlp_model(line)
+        return
+
+    # Parameters of nlp.pipe (if no batch size is given with many processes, spaCy uses its default batch size)
+    pipe_parameters = {'n_process': n_process}
+    if batch_size:
+        pipe_parameters['batch_size'] = batch_size
+
+    # Batch in the original order of lines
+    # ------------------------------------------
+    if not sort_by_length:
+        yield from nlp_model.pipe(lines, **pipe_parameters)
+        return
+
+    # Batch lines sorted by length
+    # ------------------------------------------
+    """
+    To sort the lines we need to have all of them, so in this case the generator (if any) is converted to a list.
+    The lines are sent to the model from the shortest to the longest one, then each Doc is put back to the position of its line.
+    """
+    lines = list(lines)
+    order = sorted(range(len(lines)), key=lambda i: len(lines[i]))
+
+    docs = [None] * len(lines)
+    for i, doc in zip(order, nlp_model.pipe((lines[i] for i in order), **pipe_parameters)):
+        docs[i] = doc
+
+    yield from docs
+
+
+
+# ==============================
+# Compact entities
+# ==============================
+
+"""
+The functions of process_line() use only the entities of the processed line (line_nlp.ents) and, for each entity, its text (ent.text) and its label (ent.label_).
+So, when the line is not processed by spaCy in the same process (e.g. NER service, see main_service_ner.py), we only need to keep these entities.
+EntitySpan and LineEntities have the same attributes as the spaCy entity (Span) and the spaCy Doc, so they can be used in place of them.
+
+LineEntities is also the index of the line used by all functions of process_line(), built once per line:
+- by_label: the texts of the entities grouped by label, in the order of the line (e.g. {"DATE": ("die XII iunii",), "AMOUNT": ("fl. XII",)}), so each function reads only the entities of its label instead of going through all entities of the line;
+- words: the words of the line (line.split()), used by assign_line_type().
+It keeps only strings and tuples, so it is much smaller than a Doc and quick to send to another process.
+"""
+
+EntitySpan = namedtuple('EntitySpan', ['text', 'label_', 'start_char', 'end_char'])
+
+
+class LineEntities:
+    __slots__ = ('text', 'ents', 'by_label', 'words')
+
+    def __init__(self, text, ents):
+        self.text = text
+        self.ents = tuple(ents)
+        self.words = text.split()
+
+        by_label = {}
+        for ent in self.ents:
+            by_label.setdefault(ent.label_, []).append(ent.text)
+        self.by_label = {label: tuple(texts) for label, texts in by_label.items()}
+
+    # __slots__ without __dict__: give the attributes to pickle (to send the line to another process)
+    def __getstate__(self):
+        return self.text, self.ents
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+
+# Convert a spaCy Doc to a compact list of entities
+# ------------------------------------------
+def doc_to_spans(doc):
+    return [(ent.start_char, ent.end_char, ent.label_) for ent in doc.ents]
+
+
+# Convert a compact list of entities to LineEntities
+# ------------------------------------------
+def spans_to_line_entities(line, spans):
+    return LineEntities(line, [EntitySpan(line[start_char:end_char], label, start_char, end_char) for start_char, end_char, label in spans])
+
+
+# Convert a spaCy Doc to LineEntities (index of the line)
+# ------------------------------------------
+def index_line_entities(line_nlp):
+    # already converted (NER cache, NER service)
+    if isinstance(line_nlp, LineEntities):
+        return line_nlp
+    return LineEntities(line_nlp.text, [EntitySpan(ent.text, ent.label_, ent.start_char, ent.end_char) for ent in line_nlp.ents])
+
+
+
+# ==============================
+# Send only some lines to the model
+# ==============================
+
+"""
+CachedNerModel and SelectiveNerModel send to the model only some of the lines (cache misses, lines which need NER), and put the other lines back between them in the original order:
+- batches: the lines are given by batches of (line, key, result); result is None when the line must be sent to the model;
+- the lines with the same key (not None) waiting at the same time for the model are sent only once (e.g. the same line repeated in a document);
+- convert_doc() is called once for each line processed by the model and its result is given to all lines with the same key.
+Return (line, key, result, sent) for each line in the original order; sent is True for the lines processed by the model (only the first one for a key).
+
+With one_pipe = False, the lines of each batch are sent to the model with their own call of pipe_model (one batch is read at a time, as without the wrapper).
+With n_process > 1, spaCy starts (and stops) its worker processes, which load the model again, at each call of nlp.pipe(), so it must be called only once: with one_pipe = True, all the lines for the model go through one single call of pipe_model for all the lines.
+In this case the batches are read when the model asks for more lines: the model reads lines until it has a full batch for its processes, so the lines found without the model (e.g. cache hits) are kept in memory until the lines before them come back from the model.
+"""
+def pipe_missing_lines(pipe_model, batches, convert_doc=None, one_pipe=False):
+    batches = iter(batches)
+    output = deque() # [line, key, result, waiting for the model, sent], in the original order
+    waiting = {} # key of each line sent to the model: lines waiting for its result
+    keys_sent = deque() # keys in the order of the lines sent to the model
+    lines_for_model = deque()
+
+    def read_batch():
+        batch = next(batches, None)
+        if batch is None:
+            return False
+        for line, key, result in batch:
+            entry = [line, key, result, result is None, False]
+            output.append(entry)
+            if result is None:
+                model_key = key if key is not None else object() # a line without key is sent alone
+                if model_key in waiting:
+                    waiting[model_key].append(entry)
+                else:
+                    waiting[model_key] = [entry]
+                    keys_sent.append(model_key)
+                    lines_for_model.append(line)
+        return True
+
+    # lines given to the model, read from the batches only when the model asks for them (one_pipe)
+    def read_lines_for_model():
+        while lines_for_model or read_batch():
+            while lines_for_model:
+                yield lines_for_model.popleft()
+
+    # lines given to the model, only the lines already read
+    def take_lines_for_model():
+        lines = list(lines_for_model)
+        lines_for_model.clear()
+        return lines
+
+    docs = None
+    try:
+        while True:
+            if not output:
+                if not read_batch():
+                    break
+                continue
+
+            line, key, result, is_waiting, sent = output[0]
+            if is_waiting:
+                if docs is None:
+                    docs = iter(pipe_model(read_lines_for_model() if one_pipe else take_lines_for_model())) # started at the first line for the model only
+                doc = next(docs, None)
+                if doc is None: # all lines sent to this call are processed (not with one_pipe)
+                    docs = None
+                    continue
+                entries = waiting.pop(keys_sent.popleft())
+                result = convert_doc(doc) if convert_doc else doc
+                for position, entry in enumerate(entries):
+                    entry[2:] = [result, False, position == 0]
+                continue
+
+            output.popleft()
+            yield line, key, result, sent
+    finally:
+        if docs is not None and hasattr(docs, 'close'):
+            docs.close() # stop the worker processes of spaCy if the lines are not all read
+
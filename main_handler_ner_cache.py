@@ -0,0 +1,229 @@
+"""
+Module: main_handler_ner_cache.py
+
+Description:
+This module contains a persistent cache of the NER results (entities of each line).
+We re-run the processing of the same texts many times (for example, after a correction of the rules in main_handler_amount.py or main_handler_date.py), and each time the model processes again exactly the same lines.
+With the cache, the entities of a line already processed are taken from the cache and only the new lines (cache misses) are sent to the model.
+
+The cache is a SQLite file. Each entry is identified by:
+- the hash of the text of the line;
+- the fingerprint of the model (hash of nlp.meta: name, version, pipeline, scores, etc.), so the entities of an old model are never used with a new one.
+The size of the cache is limited (max_entries): when it is full, the entries which were not used for the longest time are deleted.
+The fingerprint of each model is also kept in the cache with the path of the model (table ner_cache_model), so the entries can be read without loading the model (see find_model_fingerprint()).
+
+Functions and classes:
+
+model_fingerprint(), meta_fingerprint():
+    Calculate the fingerprint of the model (or of its meta).
+
+find_model_fingerprint():
+    Find the fingerprint of a model without loading it: from the cache, or from the file meta.json of the model.
+
+CachedNerModel:
+    The cache. It can be used in place of the spaCy model in process_line() (it has the same functions: nlp_model(line) and nlp_model.pipe(lines)) and it returns the entities of each line as LineEntities (see main_handler_ner.py).
+    It counts the hits (lines found in the cache), the misses (lines sent to the model) and the deleted entries (evictions), see statistics().
+    The entities of lines can also be read from the cache without the model (find_spans(), used by RuleNerModel, see main_handler_ner_rules.py): the cache is then created with the fingerprint of the model instead of the model.
+
+"""
+
+# Import libraries
+# ------------------------------------------
+import hashlib # to calculate the hash of lines and of the model
+import json # to store the entities
+import os # to find the file meta.json of the model
+import sqlite3 # to store the cache in a file
+import time # to know when an entry was used for the last time
+
+# Import custom functions
+# ------------------------------------------
+from main_handler_ner import doc_to_spans, spans_to_line_entities, pipe_missing_lines
+
+
+# ==============================
+# Fingerprint of the model
+# ==============================
+
+def model_fingerprint(nlp_model):
+    return meta_fingerprint(getattr(nlp_model, 'meta', {}))
+
+
+def meta_fingerprint(meta):
+    meta = json.dumps(meta, sort_keys=True, default=str)
+    return hashlib.sha1(meta.encode('utf-8')).hexdigest()
+
+
+# Fingerprint of a model without loading it (None if not found)
+# ------------------------------------------
+"""
+Loading the spaCy model takes many seconds, and RuleNerModel (see main_handler_ner_rules.py) only needs the fingerprint to read the cache.
+1. The fingerprint kept in the cache for this path of model (written by CachedNerModel each time it is used with the model);
+2. if the model was never used with this cache, the fingerprint of the file meta.json of the model (spaCy writes nlp.meta in this file when the model is saved, so it is the same fingerprint as the loaded model).
+"""
+def find_model_fingerprint(cache_path, model_path):
+    database = sqlite3.connect(cache_path, timeout=60)
+    try:
+        create_model_table(database)
+        row = database.execute("SELECT model FROM ner_cache_model WHERE model_path = ?", (model_path,)).fetchone()
+    finally:
+        database.close()
+    if row:
+        return row[0]
+
+    meta_path = os.path.join(model_path, 'meta.json')
+    if os.path.isfile(meta_path):
+        with open(meta_path, encoding='utf-8') as meta_file:
+            return meta_fingerprint(json.load(meta_file))
+
+    return None
+
+
+def create_model_table(database):
+    database.execute("CREATE TABLE IF NOT EXISTS ner_cache_model (model_path TEXT PRIMARY KEY, model TEXT)")
+    database.commit()
+
+
+# Hash of the text of the line
+# ------------------------------------------
+def line_hash(line):
+    return hashlib.sha1(line.encode('utf-8')).hexdigest()
+
+
+
+# ==============================
+# Cache
+# ==============================
+
+"""
+Without nlp_model (fingerprint given, see find_model_fingerprint()), the cache can only be read with find_spans().
+With model_path, the fingerprint of the model is kept in the cache for this path.
+"""
+
+class CachedNerModel:
+    def __init__(self, nlp_model, cache_path='ner_cache.sqlite', max_entries=1000000, model_path=None, fingerprint=None):
+        self.nlp_model = nlp_model
+        self.fingerprint = fingerprint or model_fingerprint(nlp_model)
+        self.max_entries = max_entries
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # Open (or create) the cache file
+        self.database = sqlite3.connect(cache_path, timeout=60) # timeout: wait if another process writes into the cache
+        self.database.execute("CREATE TABLE IF NOT EXISTS ner_cache (model TEXT, line_hash TEXT, spans TEXT, last_used REAL, PRIMARY KEY (model, line_hash))")
+        self.database.execute("CREATE INDEX IF NOT EXISTS ner_cache_last_used ON ner_cache (last_used)")
+        self.database.commit()
+        create_model_table(self.database)
+        if nlp_model is not None and model_path:
+            self.database.execute("INSERT OR REPLACE INTO ner_cache_model (model_path, model) VALUES (?, ?)", (model_path, self.fingerprint))
+            self.database.commit()
+        self.count_entries = self.database.execute("SELECT COUNT(*) FROM ner_cache").fetchone()[0]
+        self.new_spans = {} # entities found by the model, not yet inserted into the cache
+
+    @property
+    def meta(self):
+        return self.nlp_model.meta if self.nlp_model is not None else {}
+
+    # Process one line (as nlp_model(line))
+    def __call__(self, line):
+        return next(self.pipe([line], batch_size=1))
+
+    # Process many lines (as nlp_model.pipe(lines)): the lines are looked up in the cache by batches, and only the missing lines are sent to the model
+    """
+    The missing lines of all batches are sent to the model with pipe_missing_lines() (see main_handler_ner.py): with n_process > 1, they go through one single nlp_model.pipe(), so the worker processes of spaCy are started only once for all the lines.
+    """
+    def pipe(self, lines, batch_size=256, n_process=1):
+        if self.nlp_model is None:
+            raise ValueError("the NER cache was opened without model, it can only be read with find_spans()")
+        pipe_model = lambda missing_lines: self.nlp_model.pipe(missing_lines, batch_size=batch_size, n_process=n_process)
+
+        try:
+            for line, hash_line, spans, sent in pipe_missing_lines(pipe_model, self.find_batches(lines, batch_size), doc_to_spans, one_pipe=n_process > 1):
+                # Count hits and misses (a line repeated while it is processed by the model is counted as a miss only once)
+                if sent:
+                    self.new_spans[hash_line] = spans
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                yield spans_to_line_entities(line, spans)
+        finally:
+            self.save_new_spans()
+
+    # Look for the lines of each batch in the cache: (line, hash, entities) with entities = None for a missing line
+    def find_batches(self, lines, batch_size):
+        batch = []
+        for line in lines:
+            batch.append(line)
+            if len(batch) == batch_size:
+                yield self.find_batch(batch)
+                batch = []
+        if batch:
+            yield self.find_batch(batch)
+
+    def find_batch(self, lines):
+        self.save_new_spans() # the lines processed by the model since the previous batch can be found in the cache
+
+        hashes = [line_hash(line) for line in lines]
+        unique_hashes = list(dict.fromkeys(hashes))
+        spans_by_hash = self.find_spans(unique_hashes)
+
+        # Update the time of use of the lines found
+        now = time.time()
+        self.database.executemany("UPDATE ner_cache SET last_used = ? WHERE model = ? AND line_hash = ?", [(now, self.fingerprint, hash_line) for hash_line in unique_hashes if hash_line in spans_by_hash])
+        self.database.commit()
+
+        return [(line, hash_line, spans_by_hash.get(hash_line)) for line, hash_line in zip(lines, hashes)]
+
+    # Insert the entities of the lines processed by the model into the cache
+    def save_new_spans(self):
+        if not self.new_spans:
+            return
+
+        now = time.time()
+        self.database.executemany("INSERT OR REPLACE INTO ner_cache (model, line_hash, spans, last_used) VALUES (?, ?, ?, ?)", [(self.fingerprint, hash_line, json.dumps(spans), now) for hash_line, spans in self.new_spans.items()])
+        self.database.commit()
+
+        self.count_entries += len(self.new_spans)
+        self.new_spans = {}
+        if self.count_entries > self.max_entries:
+            self.evict()
+
+    # Find the entities of lines in the cache (hashes of lines without duplicates), without the model
+    # ------------------------------------------
+    def find_spans(self, hashes):
+        spans_by_hash = {}
+        for start in range(0, len(hashes), 500): # SQLite limits the number of parameters of one query
+            part = hashes[start:start + 500]
+            rows = self.database.execute(f"SELECT line_hash, spans FROM ner_cache WHERE model = ? AND line_hash IN ({', '.join('?' * len(part))})", (self.fingerprint, *part))
+            for hash_found, spans in rows:
+                spans_by_hash[hash_found] = json.loads(spans)
+        return spans_by_hash
+
+    # Delete the entries which were not used for the longest time
+    # ------------------------------------------
+    def evict(self):
+        # keep 10% of free space, so we don't need to delete entries after each batch
+        self.count_entries = self.database.execute("SELECT COUNT(*) FROM ner_cache").fetchone()[0]
+        count_to_delete = self.count_entries - int(self.max_entries * 0.9)
+        if count_to_delete > 0:
+            self.database.execute("DELETE FROM ner_cache WHERE rowid IN (SELECT rowid FROM ner_cache ORDER BY last_used LIMIT ?)", (count_to_delete,))
+            self.database.commit()
+            self.evictions += count_to_delete
+            self.count_entries -= count_to_delete
+
+    # Statistics of the cache
+    # ------------------------------------------
+    def statistics(self):
+        count_lines = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / count_lines, 3) if count_lines else 0.0,
+            "evictions": self.evictions,
+            "entries": self.count_entries
+        }
+
+    def close(self):
+        self.database.close()
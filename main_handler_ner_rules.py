@@ -0,0 +1,139 @@
+"""
+Module: main_handler_ner_rules.py
+
+Description:
+This module finds the entities DATE and AMOUNT with rules (regular expressions) instead of the trained spaCy model.
+It is a fast mode for the bulk re-extraction of texts (for example after a correction of the rules of amounts or dates), when the speed is more important than finding all entities:
+- DATE: the words of dates known by main_handler_date.py (day keywords, Roman numerals, names of months, "eadem die", "Anno Domini millesimo ...");
+- AMOUNT: the amounts found by the lexer of amounts (find_amount_span(), see main_handler_amount_lexer.py).
+The rules don't find PRODUCT and PERSON_PAYEE. These entities are taken from the NER cache if the line is already there (see main_handler_ner_cache.py), otherwise the line has no product and no participant.
+Check the rules against the trained model with benchmark_ner_rules.py (precision, recall and speed).
+
+Functions and classes:
+
+find_date_spans(), find_rule_spans():
+    Find the entities of a line with the rules: a list of (start_char, end_char, label), the same compact list as doc_to_spans() (see main_handler_ner.py).
+
+RuleNerModel:
+    It can be used in place of the spaCy model in process_line() (it has the same functions: nlp_model(line) and nlp_model.pipe(lines)) and it returns the entities of each line as LineEntities (see main_handler_ner.py).
+
+"""
+
+# Import libraries
+# ------------------------------------------
+import re # to find the dates
+
+# Import custom functions
+# ------------------------------------------
+from main_handler_ner import spans_to_line_entities
+from main_handler_ner_cache import line_hash
+from main_handler_amount_lexer import find_amount_span
+from main_handler_date import day_keywords, month_mapping
+
+
+# ==============================
+# Rules
+# ==============================
+
+"""
+A date is written in one of these forms (the year and the month are optional):
+    >>> "Anno Domini millesimo CCCXVI, die XII mensis augusti"
+    >>> "die ultima julii", "die prima mensis julii", "die IIII"
+    >>> "eadem die"
+The names of months are the beginnings of month_mapping (in lowercase or uppercase) and the days are Roman numerals or the keywords of day_keywords.
+"""
+
+roman_pattern = r'[IVXLCDM]+'
+day_pattern = '(?:' + '|'.join([roman_pattern] + [keyword for keyword, value in day_keywords if keyword.islower()]) + ')'
+month_pattern = '(?i:' + '|'.join(month_mapping) + ')[a-z]*'
+year_pattern = rf'Anno\s+Domini\s+millesimo\s+{roman_pattern}(?:\s+{roman_pattern})*'
+day_month_pattern = rf'(?:eadem\s+die|die\s+{day_pattern}(?:\s+mensis)?(?:\s+{month_pattern})?)'
+
+date_pattern = re.compile(rf'\b(?:{year_pattern},?\s+{day_month_pattern}|{year_pattern}|{day_month_pattern})\b')
+
+
+# Find the dates of a line
+# ------------------------------------------
+def find_date_spans(line):
+    return [(date.start(), date.end(), "DATE") for date in date_pattern.finditer(line)]
+
+
+# Find all entities of a line (DATE and AMOUNT)
+# ------------------------------------------
+"""
+    >>> find_rule_spans('Item die XII mensis maii Petro pro pane : XII fl.') = [(5, 24, 'DATE'), (42, 49, 'AMOUNT')]
+"""
+def find_rule_spans(line):
+    spans = find_date_spans(line)
+
+    # the Roman numerals of dates are not amounts: the dates are replaced by spaces (same positions) before searching the amounts
+    line_without_dates = line
+    for start, end, label in spans:
+        line_without_dates = line_without_dates[:start] + ' ' * (end - start) + line_without_dates[end:]
+
+    amount_span = find_amount_span(line_without_dates)
+    if amount_span:
+        start, end = amount_span
+        end = start + len(line[start:end].rstrip()) # without the spaces at the end
+        spans.append((start, end, "AMOUNT"))
+
+    return spans
+
+
+
+# ==============================
+# Rule model
+# ==============================
+
+class RuleNerModel:
+    meta = {"name": "rules", "version": "1.0.0", "labels": ["DATE", "AMOUNT"]}
+
+    def __init__(self, ner_cache=None, cache_labels=("PRODUCT", "PERSON_PAYEE")):
+        self.ner_cache = ner_cache # CachedNerModel (optional): the entities of cache_labels are taken from it
+        self.cache_labels = set(cache_labels)
+
+        # Statistics
+        self.lines = 0
+        self.lines_from_cache = 0
+
+    # Process one line (as nlp_model(line))
+    def __call__(self, line):
+        return next(self.pipe([line], batch_size=1))
+
+    # Process many lines (as nlp_model.pipe(lines)): the lines are looked up in the cache by batches
+    def pipe(self, lines, batch_size=256, n_process=1):
+        batch = []
+        for line in lines:
+            batch.append(line)
+            if len(batch) == batch_size:
+                yield from self.process_batch(batch)
+                batch = []
+        if batch:
+            yield from self.process_batch(batch)
+
+    def process_batch(self, lines):
+        hashes = []
+        spans_by_hash = {}
+        if self.ner_cache:
+            hashes = [line_hash(line) for line in lines]
+            spans_by_hash = self.ner_cache.find_spans(list(dict.fromkeys(hashes)))
+
+        for i, line in enumerate(lines):
+            spans = find_rule_spans(line)
+
+            # entities not found by the rules (from the cache)
+            cached_spans = spans_by_hash.get(hashes[i]) if hashes else None
+            if cached_spans is not None:
+                self.lines_from_cache += 1
+                spans.extend(tuple(span) for span in cached_spans if span[2] in self.cache_labels)
+
+            self.lines += 1
+            yield spans_to_line_entities(line, sorted(spans)) # in the order of the line, as the entities of spaCy
+
+    # Statistics
+    # ------------------------------------------
+    def statistics(self):
+        return {
+            "lines": self.lines,
+            "lines_from_cache": self.lines_from_cache
+        }
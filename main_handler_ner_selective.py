@@ -0,0 +1,183 @@
+"""
+Module: main_handler_ner_selective.py
+
+Description:
+This module sends to the NER model only the lines which can contain entities.
+Many lines of the texts can't contain any entity: short fragments of titles, folio markers alone ("[f.12v]"), lines without any capital letter (the dates and the amounts are written with Roman numerals and the names of persons start with a capital letter), etc.
+For these lines, the model is not called and the functions of process_line() get a line without entities (LineEntities, see main_handler_ner.py), exactly as if the model had found nothing.
+
+The rules used to decide if a line is sent to the model are given in a dictionary (see default_ner_rules), each rule can be disabled with None:
+- min_length: the lines with less characters (without spaces) are not sent to the model;
+- required_pattern: the lines which don't contain this regular expression are not sent to the model;
+- ignore_brackets: the text within brackets (folio markers, "[sic]", etc.) is removed before checking the other rules.
+Be careful, if the rules are too strict, some entities are lost (for example a line "eadem die pro pane" has a date and a product but no capital letter). Check the rules on the texts with compare_ner_rules() before using them.
+
+Functions and classes:
+
+needs_ner():
+    Check if a line must be sent to the model.
+
+SelectiveNerModel:
+    It can be used in place of the spaCy model in process_line() (it has the same functions: nlp_model(line) and nlp_model.pipe(lines)), like CachedNerModel (see main_handler_ner_cache.py), and it can be put in front of the cache or of the client of the NER service.
+    It counts the lines sent to the model and the skipped lines, and estimates the time saved (see statistics()).
+
+compare_ner_rules():
+    Process the lines with the model and count the entities which would be lost with the rules (entities found in the skipped lines).
+
+"""
+
+# Import libraries
+# ------------------------------------------
+import re # to check the rules
+import time # to measure the processing time of the model
+
+# Import custom functions
+# ------------------------------------------
+from main_handler_ner import LineEntities, index_line_entities, pipe_missing_lines
+
+
+# ==============================
+# Rules
+# ==============================
+
+default_ner_rules = {
+    "min_length": 3, # number of characters (without spaces)
+    "required_pattern": r'[A-Z0-9]', # capital letter (Roman numeral, name) or digit
+    "ignore_brackets": True
+}
+
+brackets_pattern = re.compile(r'\[[^\]]*\]')
+
+
+# Check if a line must be sent to the model
+# ------------------------------------------
+"""
+    >>> needs_ner('Item die XII mensis maii Petro pro pane : XII fl.') = True
+    >>> needs_ner('[f.12v]') = False, only a folio marker
+    >>> needs_ner('et pro eodem') = False, no capital letter
+"""
+def needs_ner(line, rules=default_ner_rules, required_pattern=None):
+    if rules.get("ignore_brackets"):
+        line = brackets_pattern.sub('', line)
+
+    min_length = rules.get("min_length")
+    if min_length and len(''.join(line.split())) < min_length:
+        return False
+
+    if required_pattern is None and rules.get("required_pattern"):
+        required_pattern = re.compile(rules["required_pattern"])
+    if required_pattern and not required_pattern.search(line):
+        return False
+
+    return True
+
+
+
+# ==============================
+# Selective model
+# ==============================
+
+class SelectiveNerModel:
+    def __init__(self, nlp_model, rules=None):
+        self.nlp_model = nlp_model
+        self.rules = dict(default_ner_rules, **(rules or {}))
+        self.required_pattern = re.compile(self.rules["required_pattern"]) if self.rules.get("required_pattern") else None
+
+        # Statistics
+        self.sent = 0
+        self.skipped = 0
+        self.model_seconds = 0.0
+
+    @property
+    def meta(self):
+        return self.nlp_model.meta
+
+    # Process one line (as nlp_model(line))
+    def __call__(self, line):
+        return next(self.pipe([line], batch_size=1))
+
+    # Process many lines (as nlp_model.pipe(lines)): only the lines which need NER are sent to the model
+    """
+    The lines which need NER are sent to the model with pipe_missing_lines() (see main_handler_ner.py): with n_process > 1, they go through one single nlp_model.pipe(), so the worker processes of spaCy are started only once for all the lines.
+    """
+    def pipe(self, lines, batch_size=256, n_process=1):
+        pipe_model = lambda lines_for_model: self.timed_pipe(lines_for_model, batch_size, n_process)
+
+        for line, _, line_nlp, sent in pipe_missing_lines(pipe_model, self.select_batches(lines, batch_size), one_pipe=n_process > 1):
+            if sent:
+                self.sent += 1
+            else:
+                self.skipped += 1
+            yield line_nlp
+
+    # Give the lines by batches: (line, None, entities) with entities = None for a line which needs NER, no entities for the skipped lines
+    def select_batches(self, lines, batch_size):
+        batch = []
+        for line in lines:
+            batch.append((line, None, None if needs_ner(line, self.rules, self.required_pattern) else LineEntities(line, ())))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    # Send the lines to the model and measure the time of the model
+    def timed_pipe(self, lines, batch_size, n_process):
+        docs = iter(self.nlp_model.pipe(lines, batch_size=batch_size, n_process=n_process))
+        while True:
+            start_time = time.perf_counter()
+            doc = next(docs, None)
+            self.model_seconds += time.perf_counter() - start_time
+            if doc is None:
+                return
+            yield doc
+
+    # Statistics of the skipped lines
+    # ------------------------------------------
+    """
+    The time saved is estimated with the average time of the model for one line sent to it.
+    """
+    def statistics(self):
+        count_lines = self.sent + self.skipped
+        seconds_per_line = self.model_seconds / self.sent if self.sent else 0.0
+        return {
+            "lines": count_lines,
+            "skipped": self.skipped,
+            "skip_ratio": round(self.skipped / count_lines, 3) if count_lines else 0.0,
+            "model_seconds": round(self.model_seconds, 3),
+            "seconds_saved": round(self.skipped * seconds_per_line, 3)
+        }
+
+    def close(self):
+        if hasattr(self.nlp_model, 'close'):
+            self.nlp_model.close()
+
+
+
+# ==============================
+# Check the rules
+# ==============================
+
+"""
+All lines are processed by the model, so this function is slow: use it once on a sample of texts to choose the rules.
+Return the number of lines, of skipped lines, and of entities of the skipped lines (by label), with some examples of these lines.
+"""
+
+def compare_ner_rules(nlp_model, lines, rules=None, batch_size=256):
+    rules = dict(default_ner_rules, **(rules or {}))
+    lines = list(lines) # the lines are read twice (model and rules)
+    report = {"lines": 0, "skipped": 0, "entities_lost": {}, "examples": []}
+
+    for line, doc in zip(lines, nlp_model.pipe(lines, batch_size=batch_size)):
+        report["lines"] += 1
+        if needs_ner(line, rules):
+            continue
+
+        report["skipped"] += 1
+        line_entities = index_line_entities(doc)
+        for label, texts in line_entities.by_label.items():
+            report["entities_lost"][label] = report["entities_lost"].get(label, 0) + len(texts)
+        if line_entities.ents and len(report["examples"]) < 10:
+            report["examples"].append(line)
+
+    return report
@@ -0,0 +1,171 @@
+"""
+Module: main_handler_roman.py
+
+Description:
+This module converts Roman numerals into Arabic numerals, for the dates (main_handler_date.py) and for the amounts (main_handler_amount.py and main_handler_amount_lexer.py).
+The same numerals come back all the time ("I", "XII", "VM IIIC", etc.), so the result of each different numeral is calculated only once and kept in memory (functools.lru_cache).
+
+Two types of numerals:
+- simple numeral (e.g. "XII", "CCCXVI", "IIII"): the value of each letter is added, or subtracted if it is followed by a greater letter ("IX" = 9);
+- complex numeral (e.g. "VM IIIC XII" = 5000 + 300 + 12): several parts separated by spaces, a part ending with "M" is a number of thousands ("VM" = 5000) and a part ending with "C" is a number of hundreds ("IIIC" = 300).
+
+Functions:
+
+convert_roman_numeral():
+    Convert one simple numeral and return the value and the number of invalid characters (the same as convert_roman_to_arabic() of main_handler_date.py for one numeral).
+
+convert_roman_numeral_complex():
+    Convert one complex numeral and return the value and the uncertainty (the same as convert_roman_to_arabic_complex() of main_handler_amount.py).
+
+convert_roman_numerals():
+    Convert a list of numerals at once (for example a whole column of a table): each different numeral is converted only once.
+
+is_valid_roman_numeral():
+    Check strictly if a complex numeral is correctly written (with the medieval forms "IIII", "VIIII", "VM", "IIIC", etc.).
+
+"""
+
+# Import libraries
+# ------------------------------------------
+import re # to check the form of numerals
+from functools import lru_cache # to calculate only once the value of each different numeral
+
+
+# ==============================
+# Convert simple numeral
+# ==============================
+
+"""
+Each character which is not a Roman numeral (space, lowercase letter, etc.) is ignored and counted as invalid.
+    >>> convert_roman_numeral('XII') = (12, 0)
+    >>> convert_roman_numeral('VM IIIC') = (1096, 1), the space is invalid and "VMIIIC" is read as a simple numeral (use convert_roman_numeral_complex() for such numerals)
+"""
+
+roman_values = {'I': 1, 'V': 5, 'X': 10, 'L': 50, 'C': 100, 'D': 500, 'M': 1000}
+
+@lru_cache(maxsize=4096)
+def convert_roman_numeral(roman_numeral):
+    arabic_numeral = 0
+    previous_value = 0
+    invalid_characters = 0
+
+    for character in reversed(roman_numeral):
+        value = roman_values.get(character)
+        if value is None:
+            invalid_characters += 1
+            continue
+        if value < previous_value:
+            arabic_numeral -= value
+        else:
+            arabic_numeral += value
+        previous_value = value
+
+    return arabic_numeral, invalid_characters
+
+
+
+# ==============================
+# Convert complex numeral
+# ==============================
+
+"""
+The numeral is divided into parts (groups of Roman numerals) and the parts are added:
+- a part ending with "M" (except "M" and "CM") is a number of thousands: "VM" = 5 * 1000;
+- a part ending with "C" (except "C" and "XC") is a number of hundreds: "IIIC" = 3 * 100;
+- otherwise, the part is a simple numeral.
+Be careful, with these rules "MM" = 1000 * 1000 and "CC" = 100 * 100 (is_valid_roman_numeral() reports these numerals as invalid).
+
+The uncertainty is:
+- 1 if there is no part;
+- 0 otherwise (even if there are more than 3 parts, as in convert_roman_to_arabic_complex() where the uncertainty is replaced by the result of the conversion of each part);
+- with strict=True, also 1 if the numeral is not valid (see is_valid_roman_numeral()).
+    >>> convert_roman_numeral_complex('VM IIIC XII') = (5312, 0)
+"""
+
+roman_part_pattern = re.compile(r'[IVXLCDM]+')
+
+@lru_cache(maxsize=4096)
+def convert_roman_numeral_complex(roman_numeral_complex, strict=False):
+    parts = roman_part_pattern.findall(roman_numeral_complex)
+    number_converted = 0
+
+    for part in parts:
+        if len(part) > 1 and part[-1] == 'M' and part != 'CM':
+            number_converted += convert_roman_numeral(part[:-1])[0] * 1000
+        elif len(part) > 1 and part[-1] == 'C' and part != 'XC':
+            number_converted += convert_roman_numeral(part[:-1])[0] * 100
+        else:
+            number_converted += convert_roman_numeral(part)[0]
+
+    uncertainty_conversion = 0 if parts else 1
+    if strict and not is_valid_roman_numeral(roman_numeral_complex):
+        uncertainty_conversion = 1
+
+    return number_converted, uncertainty_conversion
+
+
+
+# ==============================
+# Convert many numerals
+# ==============================
+
+"""
+Return the list of (value, uncertainty) of the numerals, in the same order.
+    >>> convert_roman_numerals(['XII', 'VM IIIC', 'XII']) = [(12, 0), (5300, 0), (12, 0)]
+With complex=False, the numerals are converted as simple numerals and the uncertainty is the number of invalid characters.
+"""
+
+def convert_roman_numerals(roman_numerals, complex=True, strict=False):
+    converted = {}
+    for roman_numeral in roman_numerals:
+        if roman_numeral not in converted:
+            if complex:
+                converted[roman_numeral] = convert_roman_numeral_complex(roman_numeral, strict)
+            else:
+                converted[roman_numeral] = convert_roman_numeral(roman_numeral)
+
+    return [converted[roman_numeral] for roman_numeral in roman_numerals]
+
+
+
+# ==============================
+# Check numeral
+# ==============================
+
+"""
+A valid numeral has at most 3 parts separated by one space, in this order, each of them optional:
+1. thousands: a simple numeral lower than 1000 followed by "M" (e.g. "VM", "XIIM");
+2. hundreds: a simple numeral lower than 100 followed by "C" (e.g. "IIIC");
+3. a simple numeral (e.g. "XII", "MCCCXVI"), which doesn't end with "M" or "C" (otherwise it would be read as thousands or hundreds), except "M", "C", "CM" and "XC".
+A simple numeral is written with the usual rules, and the medieval forms with four times the same letter are accepted ("IIII", "VIIII", "XXXX", "CCCC").
+    >>> is_valid_roman_numeral('VM IIIC XII') = True
+    >>> is_valid_roman_numeral('MM') = False, the numeral is read as 1000 * 1000
+    >>> is_valid_roman_numeral('IIIIII') = False
+"""
+
+roman_below_100 = r'(?:XC|XL|L?X{0,4})(?:IX|IV|V?I{0,4})'
+roman_below_1000 = r'(?:CM|CD|D?C{0,4})' + roman_below_100
+thousands_pattern = re.compile(rf'(?=.){roman_below_1000}') # before "M"
+hundreds_pattern = re.compile(rf'(?=.){roman_below_100}') # before "C"
+simple_numeral_pattern = re.compile(rf'(?=.)M{{0,4}}{roman_below_1000}')
+
+@lru_cache(maxsize=4096)
+def is_valid_roman_numeral(roman_numeral_complex):
+    parts = roman_numeral_complex.split(' ')
+    if len(parts) > 3:
+        return False
+
+    previous_order = 0 # order of the previous part: 1 thousands, 2 hundreds, 3 simple numeral
+    for part in parts:
+        if len(part) > 1 and part[-1] == 'M' and part != 'CM':
+            order, pattern, numeral = 1, thousands_pattern, part[:-1]
+        elif len(part) > 1 and part[-1] == 'C' and part != 'XC':
+            order, pattern, numeral = 2, hundreds_pattern, part[:-1]
+        else:
+            order, pattern, numeral = 3, simple_numeral_pattern, part
+
+        if order <= previous_order or not pattern.fullmatch(numeral):
+            return False
+        previous_order = order
+
+    return True
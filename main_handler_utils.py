@@ -12,10 +12,13 @@ There are different blocks in this file, each corresponding to the treatment of
 
    Function(s):
    - process_text()
+   - stream_text(): the same as process_text(), but the lines are read and returned one by one (for very large texts)
 
    Sub-function(s):
    - load_text()
    - add_rubric_subrubric_tag()
+   - tag_rubric_subrubric()
+   - read_lines()
 
 2) Extract folio (for table "line"):
    This function extracts the folio number from line text.
@@ -54,17 +57,17 @@ There are different blocks in this file, each corresponding to the treatment of
    First, check if the name already exists in the database; if yes, use it, if not insert the new one.
 
    Function(s):
-   - process_rubric_subrubric_into_database()
-
-   Sub-function(s):
-   - check_and_insert_new_data()
+   - process_rubric_subrubric_into_database(): calls insert_rubric_subrubric() from main_writer_database.py
 
 6) Process product:
    Extract the product from text and insert them into the database. 
    The rate of successful recognition of products with NER is quite low (about 56%), so this data must undergo heavy post-treatment and manual verification.
 
    Function(s):
-   - process_product()
+   - process_product(): extract_products() + insert_products() from main_writer_database.py
+
+   Sub-function(s):
+   - extract_products(): returns the records of products without database
 
 7) Process participant:
    This function extracts the name of participants from text and inserts it into the "participant" table. 
@@ -73,7 +76,11 @@ There are different blocks in this file, each corresponding to the treatment of
    So, during the post-treatment of the extracted names in the "participant" table, we need to process each extracted name, clean it, and insert it into the "person" table if this person does not already exist.
 
    Function(s):
-   - process_participant()
+   - process_participant(): extract_participants() + insert_participants() from main_writer_database.py
+
+   Sub-function(s):
+   - extract_participants(): returns the records of participants without database (find_participants() + resolve_participants())
+   - process_participant_text()
 
 
 Note: Each function within this module is documented separately within its respective definition.
@@ -83,6 +90,12 @@ Note: Each function within this module is documented separately within its respe
 # Import libraries
 # ------------------------------------------
 import re # to work with regular expressions
+from functools import lru_cache # to process each different text of participant only once
+
+# Import custom functions
+# ------------------------------------------
+from main_writer_database import insert_rubric_subrubric, insert_products, insert_participants
+from main_handler_ner import index_line_entities
 
 # ==============================
 # Process original text
@@ -127,34 +140,11 @@ def process_text(input_data_path, file_name):
         return text_original, text_with_rubrics
 
 
-    # Add "rubrics" and "subrubrics" tags to text
+    # Add "rubrics" and "subrubrics" tags to text (see tag_rubric_subrubric())
     # -------------------------------------------
-
-    """
-    Description:
-    To identify the names of the rubrics and subrubrics we rely on the layout of the text. 
-    In fact, rubric names have a blank line before and after them. 
-    Subrubric names have one line before the text and, in our case, contain the word that begins with "solutio".
-    It was not possible to identify these names directly and only with NER. 
-    So, to be able to do this you have to pre-work the text and introduce additional identification tags: RUBRIC_NAME and SUBRUBRIC_NAME.
-
-    """
     def add_rubric_subrubric_tag(text_original):
         lines = text_original.split('\n') # split text into a list of lines using the newline character ('\n') as the delimiter. Each element in the resulting list corresponds to a line of text.
-        empty_line_pattern = re.compile(r'^\s*$') # create a regular expression pattern for matching empty lines
-        lines_with_rubric_subrubric_tag = [] # initialize an empty list to store modified lines
-
-        # loop to find lines with rubric and subrubric names and add appropriate tag
-        for i, line in enumerate(lines):
-            if i == 0 or i == len(lines) - 1: # need to keep the first and the last lines
-                lines_with_rubric_subrubric_tag.append(line)
-            elif empty_line_pattern.match(lines[i - 1]) and empty_line_pattern.match(lines[i + 1]):
-                lines_with_rubric_subrubric_tag.append("RUBRIC_NAME " + line)
-            elif empty_line_pattern.match(lines[i - 1]) and 'solutio' in line.lower():
-                lines_with_rubric_subrubric_tag.append("SUBRUBRIC_NAME " + line)
-            else:
-                lines_with_rubric_subrubric_tag.append(line)
-
+        lines_with_rubric_subrubric_tag = list(tag_rubric_subrubric(lines))
         return lines_with_rubric_subrubric_tag
 
     text_original, text_with_rubrics = load_text(input_data_path, file_name)
@@ -162,6 +152,87 @@ def process_text(input_data_path, file_name):
     return text_original, text_with_rubrics
 
 
+# Process original text line by line
+# -----------------------------------
+"""
+Description:
+The same as process_text(), but the text is not loaded in memory: the lines are read from the file and returned one by one (generator), already with the rubrics and subrubrics tags, stripped and without empty lines.
+So the memory used doesn't grow with the size of the file, and the first line can be processed (see process_line()) before the whole file is read.
+The original text is not returned.
+
+Parameters (input):
+- input_data_path (str): path of the text files
+    >>> Example: 'test/data/raw/_all/'
+- file_name (str): file name without extension
+    >>> Example: 'ASV_intr.ex.194'
+
+Returns (output):
+- the lines of text with rubrics and subrubrics tags (generator of str)
+    >>> Example: 'RUBRIC_NAME Pro coquina [f.12]'
+"""
+
+def stream_text(input_data_path, file_name):
+    with open(f"{input_data_path}{file_name}.txt") as file:
+        for line in tag_rubric_subrubric(read_lines(file)):
+            line = line.strip()
+            if line:
+                yield line
+
+
+# Read the lines of file one by one
+# -------------------------------------------
+"""
+The lines are returned exactly as with text.split('\n') (without the line break), also the last empty line if the file ends with a line break.
+This is necessary to find the same rubric names as process_text() (the rubric name needs an empty line after it).
+"""
+
+def read_lines(file):
+    line = ''
+    for line in file:
+        yield line[:-1] if line.endswith('\n') else line
+    if line == '' or line.endswith('\n'):
+        yield ''
+
+
+# Add "rubrics" and "subrubrics" tags to text
+# -------------------------------------------
+
+"""
+Description:
+To identify the names of the rubrics and subrubrics we rely on the layout of the text. 
+In fact, rubric names have a blank line before and after them. 
+Subrubric names have one line before the text and, in our case, contain the word that begins with "solutio".
+It was not possible to identify these names directly and only with NER. 
+So, to be able to do this you have to pre-work the text and introduce additional identification tags: RUBRIC_NAME and SUBRUBRIC_NAME.
+
+The lines are processed one by one (generator), keeping only the previous and the next line to know if they are empty.
+So this function can be used with a list of lines (process_text()) as well as with the lines read from a file one by one (stream_text()).
+"""
+
+def tag_rubric_subrubric(lines):
+    empty_line_pattern = re.compile(r'^\s*$') # create a regular expression pattern for matching empty lines
+
+    lines = iter(lines)
+    line = next(lines, None)
+    if line is None:
+        return
+    line_previous = None # there is no previous line for the first line
+
+    # loop to find lines with rubric and subrubric names and add appropriate tag
+    for line_next in lines:
+        if line_previous is None: # need to keep the first line
+            yield line
+        elif empty_line_pattern.match(line_previous) and empty_line_pattern.match(line_next):
+            yield "RUBRIC_NAME " + line
+        elif empty_line_pattern.match(line_previous) and 'solutio' in line.lower():
+            yield "SUBRUBRIC_NAME " + line
+        else:
+            yield line
+        line_previous, line = line, line_next
+
+    yield line # need to keep the last line
+
+
 
 # ============================================
 # Extract folio (for table "line")
@@ -170,11 +241,17 @@ def process_text(input_data_path, file_name):
 Description:
 Extract folio from text. E.g.: [f.34], [f.45v] etc.
 
+The folio is all data contained within the brackets [] and which contains at least one digit (because we also can have just a text within the brackets [], e.g. [sic]).
+This was the regex \[([^\]]*\d[^\]]*)\], but on a line with many "[" and digits and without "]" (OCR noise, e.g. "[1[1[1...") it tries all positions of digits after each "[" and can take minutes.
+It gives the same folios as: the text of each bracket (from "[" to the next "]"), if this text contains a digit. The search stops at the last "]" of the line, so each "[" is read only once.
 """
 
+bracket_pattern = re.compile(r'\[([^\]]*)\]')
+digit_pattern = re.compile(r'\d')
+
 def folio_extraction(line):
-    pattern = r'\[([^\]]*\d[^\]]*)\]' # extract all data contained within the brackets [] and which contains at least one digit (because we  also can have just a texte within the brackets [], e.g. [sic] )
-    matches = re.findall(pattern, line)
+    brackets = bracket_pattern.findall(line, 0, line.rfind(']') + 1)
+    matches = [bracket for bracket in brackets if digit_pattern.search(bracket)]
     folio_extracted = ', '.join(matches) # return string, if many put comma between values
     return folio_extracted
 
@@ -198,8 +275,8 @@ This function defines the type of line based on the following possible types:
 """
 
 def assign_line_type(line, line_nlp):
-    # Split the text into words
-    words = line.split()
+    # Words of the line (split once in the index of the line, see LineEntities in main_handler_ner.py)
+    words = line_nlp.words
 
     if words:
         # Type: Sums
@@ -224,7 +301,7 @@ def assign_line_type(line, line_nlp):
 
     # Type: Transaction
     # Check if line have the NER AMOUNT
-    entities_amount = ', '.join(ent.text for ent in line_nlp.ents if ent.label_ == "AMOUNT")
+    entities_amount = ', '.join(line_nlp.by_label.get("AMOUNT", ()))
     if entities_amount:
         return "2" # "Transaction"
 
@@ -256,7 +333,15 @@ def process_rubric_subrubric_from_text(line, category):
         }
         pattern = category_patterns.get(category)
 
-        name_extracted = re.sub(rf'{pattern} |\[([^\]]*\d[^\]]*)\]', '', line).strip()
+        # The same as re.sub(rf'{pattern} |\[([^\]]*\d[^\]]*)\]', '', line), but each bracket is read only once (see folio_extraction()):
+        # a bracket (until the next "]") is deleted if it contains a digit, otherwise only the markers within it are deleted
+        def delete_marker_or_folio(match):
+            text = match.group(0)
+            if text[0] == '[' and text[-1] == ']' and digit_pattern.search(text):
+                return ''
+            return text.replace(f'{pattern} ', '')
+
+        name_extracted = re.sub(rf'{pattern} |\[[^\]]*\]?', delete_marker_or_folio, line).strip()
         return name_extracted
 
 
@@ -303,33 +388,12 @@ First, check if the name already exists in the database; if yes, use it, if not
 """
 
 def process_rubric_subrubric_into_database(cursor, name_extracted, name_standardized, category):
-
-    def check_and_insert_new_data(cursor, name, category, data_type):
-
-        # Check if the name exist in the table
-        cursor.execute(f"SELECT {category}_{data_type}_id FROM {category}_{data_type} WHERE {category}_name_{data_type} = %s", (name,))
-        existing_id = cursor.fetchone()
-
-        if existing_id:
-            current_id = existing_id[0]
-        else:
-            # Insert the new name into the table if name doesnt exist already
-            cursor.execute(f"INSERT INTO {category}_{data_type} ({category}_name_{data_type}) VALUES (%s)", (name,))
-            current_id = cursor.lastrowid  # Retrieve auto-incremented ID
-
-        return current_id
-
-    current_extracted_id = check_and_insert_new_data(cursor, name_extracted, category, 'extracted')
-    current_standardized_id = check_and_insert_new_data(cursor, name_standardized, category, 'standardized')
-
-    # Update the (sub)rubric_extracted row with the (sub)rubric_standardized_id
-    cursor.execute(f"UPDATE {category}_extracted SET {category}_standardized_id = %s WHERE {category}_extracted_id = %s", (current_standardized_id, current_extracted_id))
-
-    return current_extracted_id
+    # the insertion itself is done by insert_rubric_subrubric(), see main_writer_database.py
+    return insert_rubric_subrubric(cursor, name_extracted, name_standardized, category)
 
 
 """
-The code above is a short version of the code that follows.
+The code of insert_rubric_subrubric() is a short version of the code that follows.
 Just keep it in case.
 
 # ------------------------------------------------------------------
@@ -427,24 +491,25 @@ The rate of successful recognition of products with NER is quite low (about 56%)
 """
 
 def process_product(cursor, line_id, line_nlp):
+    insert_products(cursor, line_id, extract_products(index_line_entities(line_nlp)))
+
+
+def extract_products(line_nlp):
     # initialize variables
     products_extracted = []
     count_products = 0
     product_uncertainty = None
 
     # extract named entity "PRODUCT" from text
-    for ent in line_nlp.ents:
-        # Checking if the entity has the label "PRODUCT"
-        if ent.label_ == "PRODUCT":
-            products_extracted.append(ent.text)
-            count_products += 1
+    for ent_text in line_nlp.by_label.get("PRODUCT", ()):
+        products_extracted.append(ent_text)
+        count_products += 1
 
     if count_products > 1:
         product_uncertainty = 1
 
-    for product in products_extracted:
-        product_extracted = product
-        cursor.execute("INSERT INTO product (line_id, product_extracted, product_uncertainty) VALUES (%s, %s, %s)", (line_id, product_extracted, product_uncertainty,))
+    # return the records of products (values of the table "product")
+    return [{"product_extracted": product_extracted, "product_uncertainty": product_uncertainty} for product_extracted in products_extracted]
 
 
 
@@ -460,59 +525,89 @@ So, during the post-treatment of the extracted names in the "participant" table,
 """
 
 def process_participant (cursor, line_id, line_nlp, participant_previous):
-    
-    # Initialize variables
-    participants_extracted = []
-    count_participants = 0
-    participant_extracted = None
-    participant_name_extracted = None
-    participant_role_extracted = None
-    additional_participant = None
-    participant_uncertainty = None
+    participant_records, participant_previous = extract_participants(index_line_entities(line_nlp), participant_previous)
+    insert_participants(cursor, line_id, participant_records)
+
+    return participant_previous
 
 
-    # extract named entity "PERSON_PAYEE" from text
-    for ent in line_nlp.ents:
-        # Checking if the entity has the label "PRODUCT"
-        if ent.label_ == "PERSON_PAYEE":
-            participants_extracted.append(ent.text)
-            count_participants += 1
+def extract_participants(line_nlp, participant_previous):
+    return resolve_participants(find_participants(line_nlp), participant_previous)
 
-    # Process each payee_extracted
-    for participant_extracted in participants_extracted:
+
+"""
+The participants are processed in two steps, so the first one (the slowest) can be done for all lines at the same time, in any order (see extract_line_partial() in main_processor_line.py):
+1. find_participants(): the participants of the line (entities PERSON_PAYEE, without "socio") with their name, role and partners (process_participant_text()), and if they are "eidem" or "eisdem" (the same as the previous participant);
+2. resolve_participants(): replace "eidem" and "eisdem" by the previous participant and make the records, in order of lines (cheap).
+extract_participants() = resolve_participants(find_participants()).
+"""
+
+def find_participants(line_nlp):
+    participants_found = []
+
+    # extract named entity "PERSON_PAYEE" from text
+    for participant_extracted in line_nlp.by_label.get("PERSON_PAYEE", ()):
 
         # Check if participant is not "socio"
         if not participant_extracted.lower().startswith("soci"):
+            same_as_previous = participant_extracted.lower().startswith(("eidem", "eisdem"))
+            participants_found.append((participant_extracted, same_as_previous, process_participant_text(participant_extracted)))
 
-            # Check if the same participant as previously
-            if participant_extracted.lower().startswith(("eidem", "eisdem")) and participant_previous:
-                participant_extracted = participant_previous
+    return participants_found
 
-            # Process participant
-            # --------------------------------
-                
-            # Participant name
-            participant_name_extracted_list = re.findall(r'\b(?![a-z])[a-zA-Z]+\b(?:\W*)*(?:\s*[a-z]{2,})*(?:\s*\b(?![a-z])[a-zA-Z]+)*', participant_extracted)
-            participant_name_extracted = participant_name_extracted_list[0] if participant_name_extracted_list else None
-            if len(participant_name_extracted_list) != 1:
-                participant_uncertainty = "1"
 
-            # participant role
-            participant_role_extracted_list = re.findall(r'\b[a-z]{3,}(?:\s*[a-z]{3,})*', participant_extracted)
-            participant_role_extracted = ", ".join(participant_role_extracted_list)
+def resolve_participants(participants_found, participant_previous):
 
+    # Initialize variables
+    participant_records = []
+    participant_uncertainty = None
 
-            # check if there is a mention of "partners" [socio] anywhere in the text (not only in the beggining)
-            # if "socio" in participant_extracted:
-            additional_participant_list = re.findall(r'\b(socio).*', participant_extracted)
-            additional_participant = ", ".join(additional_participant_list)
+    # Process each participant
+    for participant_extracted, same_as_previous, participant_parts in participants_found:
 
-            person_function_id = "1"
+        # Check if the same participant as previously
+        if same_as_previous and participant_previous:
+            participant_extracted = participant_previous
+            participant_parts = process_participant_text(participant_extracted)
 
-            if participant_name_extracted:
-                cursor.execute("INSERT INTO participant (line_id, participant_extracted, participant_name_extracted, participant_role_extracted, additional_participant, person_function_id, participant_uncertainty) VALUES (%s, %s, %s, %s, %s, %s, %s)", (line_id, participant_extracted, participant_name_extracted, participant_role_extracted, additional_participant, person_function_id, participant_uncertainty,))
+        participant_name_extracted, participant_role_extracted, additional_participant, several_names = participant_parts
+        if several_names:
+            participant_uncertainty = "1"
 
-            participant_previous = participant_extracted
+        person_function_id = "1"
 
-    return participant_previous
+        # record of participant (values of the table "participant")
+        if participant_name_extracted:
+            participant_records.append({
+                "participant_extracted": participant_extracted,
+                "participant_name_extracted": participant_name_extracted,
+                "participant_role_extracted": participant_role_extracted,
+                "additional_participant": additional_participant,
+                "person_function_id": person_function_id,
+                "participant_uncertainty": participant_uncertainty
+            })
+
+        participant_previous = participant_extracted
+
+    return participant_records, participant_previous
+
+
+# Process the text of one participant (each different text is processed only once)
+# ------------------------------------------
+@lru_cache(maxsize=4096)
+def process_participant_text(participant_extracted):
+
+    # Participant name
+    participant_name_extracted_list = re.findall(r'\b(?![a-z])[a-zA-Z]+\b\W*(?:\s*[a-z]{2,})*(?:\s*\b(?![a-z])[a-zA-Z]+)*', participant_extracted)
+    participant_name_extracted = participant_name_extracted_list[0] if participant_name_extracted_list else None
+
+    # participant role
+    participant_role_extracted_list = re.findall(r'\b[a-z]{3,}(?:\s*[a-z]{3,})*', participant_extracted)
+    participant_role_extracted = ", ".join(participant_role_extracted_list)
+
+    # check if there is a mention of "partners" [socio] anywhere in the text (not only in the beggining)
+    # if "socio" in participant_extracted:
+    additional_participant_list = re.findall(r'\b(socio).*', participant_extracted)
+    additional_participant = ", ".join(additional_participant_list)
 
+    return participant_name_extracted, participant_role_extracted, additional_participant, len(participant_name_extracted_list) != 1
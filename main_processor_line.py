@@ -6,16 +6,42 @@ This file contains a main function to process the lines of text.
 Each possible part and element of the line is treated here (for example, rubric names, dates, folio numbers, amounts, etc.). 
 So this function serves as an entry point to all other functions to treat each different type of data that a line can contain. 
 For this reason, all other functions are appended to this file (the functions from files: utils.py, amount_handler.py, and date_handler.py).
+
+Extraction and insertion:
+The data of each line is first extracted from text without database (extract_line(), which returns the record of the line), then the record is inserted into the database (write_line(), see main_writer_database.py).
+
+Checkpoints:
+By default, the whole document is inserted in one transaction (one commit at the end). If commit_every is given, the lines are committed every commit_every lines, and each time a checkpoint of the document is saved in the same transaction (table "ingestion_checkpoint", see README.md).
+The checkpoint keeps the number of the last committed line and the values carried from one line to the next (previous folio, previous date, previous participant, current rubric and subrubric).
+If the processing stops (crash, lost connection, etc.), it can be restarted with resume=True: the lines already committed are skipped (they are not even processed by spaCy) and the processing continues exactly where it stopped.
+With commit_every or resume=True, a checkpoint "completed" is saved at the end of the document, so a document already processed is not processed (and inserted) again with resume=True. A document which has lines in the database but no checkpoint (processed without commit_every and without resume) is not processed again with resume=True either: an error is raised (delete its lines to process it again).
+
+Time budget of lines:
+If line_time_budget is given (seconds), a line which takes more time to extract is reported. If the processing runs in the main thread of the process (Unix), the extraction of this line is also stopped at the end of the budget and the line is inserted with its text only (see extract_line_partial_in_time()), so one line of OCR noise can't stop the processing of the document.
+
+Two steps of extraction:
+The data of each line is extracted in two steps (see extract_line()): first everything which depends only on the line itself (extract_line_partial(), which can run for many lines at the same time in extract_processes worker processes), then the values carried from the previous lines in order of lines (resolve_line(), cheap).
+
+Pipeline:
+If pipeline_queue_size is given, the lines are inserted into the database by a writer thread while the next lines are processed by spaCy and extract_line() (see LinePipeline). The records are inserted in the same order and the database contains exactly the same data.
 """
 
 # Import libraries
 # ------------------------------------------
+from itertools import islice, tee # to skip the lines already processed (resume) and to read the same lines for NER and for processing (when the lines are given one by one)
+import multiprocessing # to extract the lines in many processes (extract_processes)
+import queue # to give the records of lines to the writer thread (pipeline)
+import signal # to stop a line which takes too much time
+import threading # to know if the line can be stopped (only in the main thread) and to insert the lines in a writer thread (pipeline)
+import time # to measure the time of each line
 
 # Import custom functions
 # ------------------------------------------
-from main_handler_utils import folio_extraction, assign_line_type, process_rubric_subrubric_from_text, process_rubric_subrubric_into_database, process_product, process_participant
-from main_handler_amount import process_amount
-from main_handler_date import process_date_into_database
+from main_handler_utils import folio_extraction, assign_line_type, process_rubric_subrubric_from_text, extract_products, find_participants, resolve_participants
+from main_handler_amount_lexer import lex_amount
+from main_handler_date import find_dates, resolve_date
+from main_handler_ner import process_ner, index_line_entities
+from main_writer_database import write_line, write_lines, check_consecutive_ids
 
 
 # ============================================
@@ -23,118 +49,589 @@ from main_handler_date import process_date_into_database
 # (+ tables: rubric_extracted, rubric_standardized, subrubric_extracted, subrubric_standardized, date)
 # ============================================
 
-def process_line(connection, text_with_rubrics, nlp_model, document_id, class_id):
-    # Initialize an empty list to store line data
-    data_line = []
+"""
+Each line is processed in two steps:
+1. extract_line(): extract all data of the line from text (without database) and return the record of the line;
+2. write_line(): insert the record into the database (see main_writer_database.py).
+
+The values carried from one line to the next are kept in the state of the processing (dictionary), which is also saved in the checkpoint:
+- line_number, folio_previous, previous_date_standardized, participant_previous: updated by extract_line()
+- rubric_extracted_id, subrubric_extracted_id: updated by write_line() (the ids are known only after the insertion of the names)
+"""
+
+def process_line(connection, text_with_rubrics, nlp_model, document_id, class_id, batch_size=None, sort_by_length=False, n_process=1, commit_every=None, resume=False, write_batch_size=None, lookup_cache=None, intern_dates=False, line_time_budget=None, pipeline_queue_size=None, extract_processes=None, segment_extractor=None, strict_roman=False):
     cursor = connection.cursor(buffered=True)
 
-    # Define variables
-    folio_previous = ""
-    participant_previous = ""
-    rubric_extracted_id = None
-    subrubric_extracted_id = None
-    # rubric_name_extracted = None
-    # subrubric_name_extracted = None
-    previous_date_standardized = '1000-01-01' # default date
+    # Define variables (values carried to the next line)
+    state = {
+        "line_number": 0,
+        "folio_previous": "",
+        "previous_date_standardized": '1000-01-01', # default date
+        "participant_previous": "",
+        "rubric_extracted_id": None,
+        "subrubric_extracted_id": None
+    }
+
+    # ------------------------------------------------------------------
+    # Resume from the checkpoint (if any)
+    # ------------------------------------------------------------------
+    if resume:
+        checkpoint = load_checkpoint(cursor, document_id)
+
+        if checkpoint and checkpoint["completed"]:
+            # the document is already fully processed
+            cursor.close()
+            return checkpoint["line_number"]
+
+        if not checkpoint and document_has_lines(cursor, document_id):
+            # processed before without checkpoint: we don't know where it stopped, and its lines would be inserted twice
+            cursor.close()
+            raise ValueError(f"document {document_id} has lines in the database but no checkpoint, delete its lines to process it again")
+
+        if checkpoint:
+            for key in state:
+                state[key] = checkpoint[key]
+
+            # skip the lines already committed
+            text_with_rubrics = islice(text_with_rubrics, state["line_number"], None)
+
+    # ------------------------------------------------------------------
+    # Process spaCy on the text
+    # ------------------------------------------------------------------
+    # The lines are processed by spaCy one by one or in batches (if batch_size is given), in one or many processes (n_process), see main_handler_ner.py
+    # The processed lines are always returned in the original order of lines (the values carried from one line to the next depend on it)
+    # text_with_rubrics can be a list or a generator (see stream_text()): tee() gives the same lines to spaCy and to the loop below and keeps in memory only the lines which are processed by spaCy but not yet by the loop (about one batch)
+    # Each processed line is converted at once to its index (entities grouped by label and words of the line, see LineEntities in main_handler_ner.py), which is used by all functions of extract_line(), so the spaCy Doc is freed right after the NER
+    # (with a segment_extractor, the NER is done by its worker processes, see below)
+    if not segment_extractor:
+        lines_for_ner, text_with_rubrics = tee(text_with_rubrics)
+        lines_nlp = map(index_line_entities, process_ner(nlp_model, lines_for_ner, batch_size, sort_by_length, n_process))
+
+    # ------------------------------------------------------------------
+    # Insertion of lines into the database
+    # ------------------------------------------------------------------
+    # Each line is inserted as soon as it is extracted (write_line()), or if write_batch_size is given, the records of write_batch_size lines are kept and inserted together (write_lines(), see main_writer_database.py)
+    # The ids of names of rubrics and subrubrics already known are taken from the lookup_cache if it is given (see LookupCache in main_writer_database.py)
+    # If intern_dates is True, the lines with the same dates share one row of the table "date" (see insert_date_interned() in main_writer_database.py), the ids of the shared rows are kept in date_ids
+    # If pipeline_queue_size is given, the lines are inserted by a writer thread while the next lines are processed (see LinePipeline), the writer has its own copy of the state
+    date_ids = None
+    if intern_dates:
+        date_ids = lookup_cache.date_ids if lookup_cache else {}
+    line_writer = LineWriter(connection, cursor, document_id, class_id, dict(state) if pipeline_queue_size else state, commit_every, write_batch_size, lookup_cache, date_ids, resume)
+    pipeline = LinePipeline(line_writer, pipeline_queue_size) if pipeline_queue_size else None
+
+    # ------------------------------------------------------------------
+    # Time budget of lines (see extract_line_partial_in_time())
+    # ------------------------------------------------------------------
+    stop_lines = bool(line_time_budget) and hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread()
+    if stop_lines:
+        previous_handler = signal.signal(signal.SIGALRM, raise_line_timeout)
 
     # ------------------------------------------------------------------
     # Process each line of text
     # ------------------------------------------------------------------
-    for i, line in enumerate(text_with_rubrics):
+    # So we have two variables: "line" which is a original text and "line_nlp" which is the index of the line processed by spaCy to work with NER (LineEntities)
+    # The data of each line is extracted in two steps (see extract_line()): extract_line_partial() in this process or in extract_processes worker processes (see extract_lines_partial()), then resolve_line() in order of lines
+    # With a segment_extractor, the NER and extract_line_partial() are done for whole segments of the document by its worker processes (see SegmentExtractor in main_corpus.py), nlp_model is not used
+    if segment_extractor:
+        lines_partial = segment_extractor.extract(text_with_rubrics, state["line_number"] + 1, line_time_budget, strict_roman)
+    else:
+        lines_partial = extract_lines_partial(zip(text_with_rubrics, lines_nlp), state["line_number"] + 1, line_time_budget, stop_lines, extract_processes, strict_roman=strict_roman)
+    try:
+        for line_partial in lines_partial:
+
+            line_record = resolve_line(line_partial, state)
+
+            if pipeline:
+                if not pipeline.put(line_record, state):
+                    break # the writer stopped on an error (raised below)
+            else:
+                line_writer.write(line_record)
+
+    finally:
+        lines_partial.close() # stop the worker processes (if any)
+        if stop_lines:
+            signal.signal(signal.SIGALRM, previous_handler)
+        if pipeline:
+            pipeline.close() # wait for the writer to insert all lines of the queue
+
+    if pipeline:
+        if pipeline.error:
+            raise pipeline.error
+        print_pipeline_statistics(pipeline.statistics())
+
+
+    # ------------------------------------------------------------------
+    # Commit the transaction
+    # -----------------------
+    line_writer.finish()
+    cursor.close()
+
+    # return the number of processed lines
+    return line_writer.state["line_number"]
+
+
+
+# ============================================
+# Insert the records of lines
+# ============================================
 
-        # Process spaCy on the text. So we have two variables: "para" which is a original text and "doc" which is a text processed by spaCy to work with NER
-        line_nlp = nlp_model(line)
+"""
+LineWriter inserts the records of lines into the database, one by one or by batches of write_batch_size lines, and commits every commit_every lines with the checkpoint of the document.
+The checkpoint "completed" is saved at the end of the document with commit_every or resume (the document will not be processed again with resume=True).
+The state of the writer is the state of the processing (or a copy of it in a pipeline, see LinePipeline): the checkpoint must correspond to the lines inserted into the database.
+"""
 
-        # ------------------------------------------------------------------
-        # Line number
-        # ------------------------------------------------------------------
-        line_number = i + 1
+class LineWriter:
+    def __init__(self, connection, cursor, document_id, class_id, state, commit_every=None, write_batch_size=None, lookup_cache=None, date_ids=None, resume=False):
+        self.connection = connection
+        self.cursor = cursor
+        self.document_id = document_id
+        self.class_id = class_id
+        self.state = state
+        self.commit_every = commit_every
+        self.write_batch_size = write_batch_size
+        self.lookup_cache = lookup_cache
+        self.date_ids = date_ids
+        self.resume = resume
+        self.line_records = []
+
+        if write_batch_size:
+            check_consecutive_ids(cursor)
+
+    # Insert one line (or keep it for the next batch)
+    # ------------------------------------------
+    def write(self, line_record):
+        if self.write_batch_size:
+            self.line_records.append(line_record)
+            if len(self.line_records) == self.write_batch_size:
+                self.flush()
+        else:
+            write_line(self.cursor, line_record, self.document_id, self.class_id, self.state, self.lookup_cache, self.date_ids)
+
+        # Commit every "commit_every" lines (with the checkpoint)
+        if self.commit_every and self.state["line_number"] % self.commit_every == 0:
+            # insert the lines still kept before the checkpoint (the checkpoint must correspond to the lines in the database)
+            self.flush()
+            save_checkpoint(self.cursor, self.document_id, self.state, completed=False)
+            self.connection.commit()
+
+    # Insert the lines kept for the batch
+    # ------------------------------------------
+    def flush(self):
+        if self.line_records:
+            write_lines(self.cursor, self.line_records, self.document_id, self.class_id, self.state, self.lookup_cache, self.date_ids)
+            self.line_records = []
+
+    # Insert the last lines and commit the document
+    # ------------------------------------------
+    def finish(self):
+        self.flush()
+        if self.commit_every or self.resume:
+            save_checkpoint(self.cursor, self.document_id, self.state, completed=True)
+        self.connection.commit()
 
-        # ------------------------------------------------------------------
-        # Type of line
-        # ------------------------------------------------------------------
-        line_type = assign_line_type(line, line_nlp)
 
-        # ------------------------------------------------------------------
-        # Folio
-        # ------------------------------------------------------------------
-        """
-        Extract the current folio number from the text. If no folio is found, retain the previous value. If the previous value contains two folio numbers separated by a comma (e.g., f.34, f34v), take only the second one. This adjustment is made because a line might reference multiple folios (f.34, f.34v), but logically, the following line should belong only to the last mentioned folio (f.34v).
-        Python doesn't support indexing the last element directly with [last], but we can use [-1] to access
-        the last element of a list.
-        """
-        folio_current = folio_extraction(line) or (folio_previous.split(', ')[-1] if ',' in folio_previous else folio_previous)
 
+# ============================================
+# Pipeline: processing and insertion at the same time
+# ============================================
 
-        # ------------------------------------------------------------------
-        # 1. Rubrics names
-        # ------------------------------------------------------------------
-        if line_type == "3": # = "RubricName"
+"""
+Without pipeline, each line is processed (NER and extract_line()) and then inserted: the processor waits while MySQL answers, and MySQL waits while the next line is processed.
+With a pipeline (pipeline_queue_size), the records of lines are put into a queue and a writer thread inserts them in the same order (LineWriter, which is the only one to use the cursor and the connection until the end of the document):
+- the queue keeps at most pipeline_queue_size lines: if the writer is slower, the processing waits (so the memory stays limited);
+- the values carried from one line to the next (line number, folio, date, participant) are put into the queue with each record, so the checkpoints of the writer correspond to the inserted lines;
+- if the writer stops on an error, the processing stops too and the error is raised by process_line() (the lines not committed are cancelled as without pipeline).
+The time spent waiting by each side is measured (see statistics()): if the processing waits for the writer, the database is the slowest part, otherwise NER and extraction are the slowest part.
+"""
 
-            # Extract & Standardize rubric name from text
-            rubric_name_extracted, rubric_name_standardized = process_rubric_subrubric_from_text(line, 'rubric')
-            rubric_extracted_id = process_rubric_subrubric_into_database(cursor, rubric_name_extracted, rubric_name_standardized, 'rubric')
+carried_keys = ("line_number", "folio_previous", "previous_date_standardized", "participant_previous") # values updated by extract_line()
+
+class LinePipeline:
+    def __init__(self, line_writer, queue_size=256):
+        self.line_writer = line_writer
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+
+        # Statistics
+        self.lines = 0
+        self.processor_wait_seconds = 0.0 # the queue is full (waiting for the writer)
+        self.writer_wait_seconds = 0.0 # the queue is empty (waiting for the processing)
+        self.writer_seconds = 0.0
+
+        self.thread = threading.Thread(target=self.run_writer, name="line-writer", daemon=True)
+        self.thread.start()
+
+    # Processing side: put the record of a line into the queue (return False if the writer stopped on an error)
+    # ------------------------------------------
+    def put(self, line_record, state):
+        if self.error:
+            return False
+
+        start_time = time.perf_counter()
+        self.put_item((line_record, {key: state[key] for key in carried_keys}))
+        self.processor_wait_seconds += time.perf_counter() - start_time
+        self.lines += 1
+        return True
+
+    def put_item(self, item):
+        while self.thread.is_alive():
+            try:
+                self.queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    # End of the lines: wait for the writer to insert the lines of the queue
+    def close(self):
+        self.put_item(None)
+        self.thread.join()
+
+    # Writer side (thread): insert the lines in the order of the queue
+    # ------------------------------------------
+    def run_writer(self):
+        while True:
+            start_time = time.perf_counter()
+            item = self.queue.get()
+            self.writer_wait_seconds += time.perf_counter() - start_time
+
+            if item is None:
+                return
+            if self.error:
+                continue # the lines after an error are not inserted (the queue is emptied until the end)
+
+            line_record, carried_values = item
+            start_time = time.perf_counter()
+            try:
+                self.line_writer.state.update(carried_values)
+                self.line_writer.write(line_record)
+            except Exception as error:
+                self.error = error
+            self.writer_seconds += time.perf_counter() - start_time
+
+    # Statistics
+    # ------------------------------------------
+    def statistics(self):
+        return {
+            "lines": self.lines,
+            "queue_size": self.queue.maxsize,
+            "processor_wait_seconds": round(self.processor_wait_seconds, 3),
+            "writer_wait_seconds": round(self.writer_wait_seconds, 3),
+            "writer_seconds": round(self.writer_seconds, 3)
+        }
+
+
+def print_pipeline_statistics(statistics):
+    print(f"Pipeline: {statistics['lines']} lines, NER and extraction waited {statistics['processor_wait_seconds']} s for the writer (queue full), the writer waited {statistics['writer_wait_seconds']} s for lines (queue empty) and inserted for {statistics['writer_seconds']} s")
 
-        # ------------------------------------------------------------------
-        # 2. Subrubrics names
-        # ------------------------------------------------------------------
-        if line_type == "4": # = "SubrubricName"
 
-            # Extract & Standardize surubric name from text
-            subrubric_name_extracted, subrubric_name_standardized = process_rubric_subrubric_from_text(line, 'subrubric')
-            subrubric_extracted_id = process_rubric_subrubric_into_database(cursor, subrubric_name_extracted, subrubric_name_standardized, 'subrubric')
 
+# ============================================
+# Extract all data of one line
+# ============================================
 
-        # ------------------------------------------------------------------
-        # Line text
-        # ------------------------------------------------------------------
-        # to obtain the original text of line we need to remove the rubric and subrubric identification tags
-        line_text = line.replace("SUBRUBRIC_NAME ", '').replace("RUBRIC_NAME ", '').strip() 
+"""
+Return the record of the line (dictionary):
+- line_number, line_type, folio, text: values of the table "line"
+- rubric, subrubric: (name_extracted, name_standardized) if the line is the name of a rubric or subrubric, otherwise None
+- date: record of dates (see extract_date() in main_handler_date.py)
+- products, participants: lists of records (see extract_products() and extract_participants() in main_handler_utils.py)
+- amount: record of amounts or None (see lex_amount() in main_handler_amount_lexer.py, the same record as extract_amount() in main_handler_amount.py)
+The values carried to the next line are updated in the state.
+
+The line is extracted in two steps (extract_line() = resolve_line(extract_line_partial())):
+1. extract_line_partial(): all data which depends only on the text of the line and on its entities (type of line, folio written in the line, names of rubrics, products, amounts, what is written in the dates and the participants). This step doesn't use the state, so the lines can be processed at the same time, in any order (see extract_processes in process_line());
+2. resolve_line(): the values which depend on the previous lines, in order of lines (folio not written in the line, dates completed with the previous date, "eadem die", participants "eidem"). This step is cheap.
+"""
 
-        # ------------------------------------------------------------------
-        # Date
-        # ------------------------------------------------------------------
-        date_id, previous_date_standardized = process_date_into_database(cursor, line, line_type, line_nlp, previous_date_standardized)
+def extract_line(line, line_nlp, state, strict_roman=False):
+    return resolve_line(extract_line_partial(line, line_nlp, strict_roman), state)
 
 
-        # ------------------------------------------------------------------
-        # Construct final full data for table "line"
-        # ------------------------------------------------------------------
-        # Append (line_number, line_text) tuple to data_line list
-        # data_line.append((document_id, class_id, line_number, line_type, folio_current, rubric_extracted_id, subrubric_extracted_id, line_text, date_id))
+# 1. Data of the line without the previous lines
+# ------------------------------------------
+def extract_line_partial(line, line_nlp, strict_roman=False):
 
-        # Insert line data into database
-        cursor.execute("INSERT INTO line (document_id, class_id, rubric_extracted_id, subrubric_extracted_id, line_type_id, date_id, line_number, folio, text) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)", (document_id, class_id, rubric_extracted_id, subrubric_extracted_id, line_type, date_id, line_number, folio_current, line_text,))
-        line_id = cursor.lastrowid  # Retrieve auto-incremented ID
+    # ------------------------------------------------------------------
+    # Type of line
+    # ------------------------------------------------------------------
+    line_type = assign_line_type(line, line_nlp)
 
+    # ------------------------------------------------------------------
+    # Folio (None if the line has no folio, see resolve_line())
+    # ------------------------------------------------------------------
+    folio = folio_extraction(line)
 
-        # ------------------------------------------------------------------
-        # Process connected tables
-        # ------------------------------------------------------------------
+    # ------------------------------------------------------------------
+    # 1. Rubrics names
+    # ------------------------------------------------------------------
+    rubric = None
+    if line_type == "3": # = "RubricName"
 
-        # Process "product" table
-        process_product(cursor, line_id, line_nlp)
+        # Extract & Standardize rubric name from text
+        rubric = process_rubric_subrubric_from_text(line, 'rubric')
 
-        # Process amounts
-        if line_type in ["2", "6", "8", "7", "5"]:
-            # = "Transaction", "SumPage", "SumPeriod", "SumRubric", "SumUndefined"
+    # ------------------------------------------------------------------
+    # 2. Subrubrics names
+    # ------------------------------------------------------------------
+    subrubric = None
+    if line_type == "4": # = "SubrubricName"
 
-            process_amount(cursor, line, line_id)
+        # Extract & Standardize surubric name from text
+        subrubric = process_rubric_subrubric_from_text(line, 'subrubric')
 
-        # Process participants
-        participant_previous = process_participant(cursor, line_id, line_nlp, participant_previous)
+    # ------------------------------------------------------------------
+    # Line text
+    # ------------------------------------------------------------------
+    # to obtain the original text of line we need to remove the rubric and subrubric identification tags
+    line_text = line.replace("SUBRUBRIC_NAME ", '').replace("RUBRIC_NAME ", '').strip() 
 
-        # ------------------------------------------------------------------
-        # Update variables
-        # -----------------------------------
-        folio_previous = folio_current
-        
+    # ------------------------------------------------------------------
+    # Date (what is written in the dates, see find_dates() in main_handler_date.py)
+    # ------------------------------------------------------------------
+    dates = find_dates(line_nlp.by_label.get("DATE", ()))
 
     # ------------------------------------------------------------------
-    # Commit the transaction
-    # -----------------------
-    connection.commit()
-    cursor.close()
+    # Connected tables
+    # ------------------------------------------------------------------
+
+    # Products
+    products = extract_products(line_nlp)
+
+    # Amounts
+    amount = None
+    if line_type in ["2", "6", "8", "7", "5"]:
+        # = "Transaction", "SumPage", "SumPeriod", "SumRubric", "SumUndefined"
+
+        amount = lex_amount(line, strict_roman)
+
+    # Participants (see find_participants() in main_handler_utils.py)
+    participants = find_participants(line_nlp)
+
+    return {
+        "line": line,
+        "line_type": line_type,
+        "folio": folio,
+        "text": line_text,
+        "rubric": rubric,
+        "subrubric": subrubric,
+        "dates": dates,
+        "products": products,
+        "amount": amount,
+        "participants": participants
+    }
+
+
+# 2. Values which depend on the previous lines (in order of lines)
+# ------------------------------------------
+def resolve_line(line_partial, state):
 
-    # return data_line
+    # ------------------------------------------------------------------
+    # Line number
+    # ------------------------------------------------------------------
+    line_number = state["line_number"] + 1
+
+    # ------------------------------------------------------------------
+    # Folio
+    # ------------------------------------------------------------------
+    """
+    Extract the current folio number from the text. If no folio is found, retain the previous value. If the previous value contains two folio numbers separated by a comma (e.g., f.34, f34v), take only the second one. This adjustment is made because a line might reference multiple folios (f.34, f.34v), but logically, the following line should belong only to the last mentioned folio (f.34v).
+    Python doesn't support indexing the last element directly with [last], but we can use [-1] to access
+    the last element of a list.
+    """
+    folio_previous = state["folio_previous"]
+    folio_current = line_partial["folio"] or (folio_previous.split(', ')[-1] if ',' in folio_previous else folio_previous)
+
+    # ------------------------------------------------------------------
+    # Date
+    # ------------------------------------------------------------------
+    date_record, previous_date_standardized = resolve_date(line_partial["line"], line_partial["line_type"], line_partial["dates"], state["previous_date_standardized"])
+
+    # ------------------------------------------------------------------
+    # Participants
+    # ------------------------------------------------------------------
+    participants, participant_previous = resolve_participants(line_partial["participants"], state["participant_previous"])
+
+    # ------------------------------------------------------------------
+    # Update variables
+    # -----------------------------------
+    state["line_number"] = line_number
+    state["folio_previous"] = folio_current
+    state["previous_date_standardized"] = previous_date_standardized
+    state["participant_previous"] = participant_previous
+
+    return {
+        "line_number": line_number,
+        "line_type": line_partial["line_type"],
+        "folio": folio_current,
+        "text": line_partial["text"],
+        "rubric": line_partial["rubric"],
+        "subrubric": line_partial["subrubric"],
+        "date": date_record,
+        "products": line_partial["products"],
+        "amount": line_partial["amount"],
+        "participants": participants
+    }
+
+
+
+
+# ============================================
+# Time budget of one line
+# ============================================
+
+"""
+extract_line_partial_in_time() extracts the data of the line with extract_line_partial() and checks its time:
+- if stop_lines is True, a timer (signal SIGALRM) stops the extraction at the end of line_time_budget seconds. Then the line is inserted with its text only (type "Description", previous folio and date, no amount, product or participant, see stopped_line_partial()), and a message gives its number to check it manually;
+- otherwise (Windows, or processing in a thread, where the line can't be stopped), a message gives the number of the line if it took more than line_time_budget seconds.
+The values carried to the next line are the same as before the stopped line.
+"""
+
+class LineTimeoutError(Exception):
+    pass
+
+
+def raise_line_timeout(signum, frame):
+    raise LineTimeoutError()
+
+
+def extract_line_partial_in_time(line, line_nlp, line_number, line_time_budget=None, stop_lines=False, strict_roman=False):
+    if not line_time_budget:
+        return extract_line_partial(line, line_nlp, strict_roman)
+
+    start_time = time.perf_counter()
+
+    try:
+        if stop_lines:
+            signal.setitimer(signal.ITIMER_REAL, line_time_budget)
+        line_partial = extract_line_partial(line, line_nlp, strict_roman)
+
+    except LineTimeoutError:
+        print(f"Line {line_number} stopped after {line_time_budget} s, inserted with its text only (check it manually): {line[:100]}")
+        return stopped_line_partial(line)
+
+    finally:
+        if stop_lines:
+            signal.setitimer(signal.ITIMER_REAL, 0) # the timer is always stopped (also if extract_line_partial() raised another error)
+
+    elapsed_seconds = time.perf_counter() - start_time
+    if elapsed_seconds > line_time_budget:
+        print(f"Line {line_number} took {elapsed_seconds:.1f} s (time budget: {line_time_budget} s): {line[:100]}")
+
+    return line_partial
+
+
+# Data of a stopped line (only its text)
+# ------------------------------------------
+def stopped_line_partial(line):
+    return {
+        "line": line,
+        "line_type": "1", # = "Description"
+        "folio": None, # the previous folio
+        "text": line.replace("SUBRUBRIC_NAME ", '').replace("RUBRIC_NAME ", '').strip(),
+        "rubric": None,
+        "subrubric": None,
+        "dates": [], # the previous date
+        "products": [],
+        "amount": None,
+        "participants": []
+    }
+
+
+
+# ============================================
+# First step of extraction for all lines
+# ============================================
+
+"""
+extract_lines_partial() returns the data of each line found by extract_line_partial() (in order of lines):
+- without extract_processes, the lines are processed one by one in this process, when the loop of process_line() asks for them;
+- with extract_processes, the lines are processed at the same time by extract_processes worker processes, by chunks of chunk_size lines: while the workers process one chunk, spaCy processes the lines of the next chunk in this process, and the loop of process_line() resolves the lines of the previous chunk (resolve_line()) and inserts them.
+In the worker processes, the time budget of lines works as in this process (each worker runs in its own main thread).
+"""
+
+def extract_lines_partial(lines_with_nlp, first_line_number, line_time_budget=None, stop_lines=False, extract_processes=None, chunk_size=1024, strict_roman=False):
+    numbered_lines = ((line, line_nlp, line_number) for line_number, (line, line_nlp) in enumerate(lines_with_nlp, first_line_number))
+
+    if not extract_processes:
+        for line, line_nlp, line_number in numbered_lines:
+            yield extract_line_partial_in_time(line, line_nlp, line_number, line_time_budget, stop_lines, strict_roman)
+        return
+
+    with multiprocessing.Pool(extract_processes, initializer=initialize_extract_worker, initargs=(line_time_budget, strict_roman)) as pool:
+        pending_chunk = None
+        while True:
+            chunk = list(islice(numbered_lines, chunk_size))
+            next_chunk = pool.map_async(extract_line_partial_in_worker, chunk, chunksize=max(1, len(chunk) // (extract_processes * 4))) if chunk else None
+            if pending_chunk:
+                yield from pending_chunk.get()
+            if not next_chunk:
+                break
+            pending_chunk = next_chunk
+
+
+# Worker process
+# ------------------------------------------
+worker_line_time_budget = None
+worker_stop_lines = False
+worker_strict_roman = False
+
+def initialize_extract_worker(line_time_budget, strict_roman=False):
+    global worker_line_time_budget, worker_stop_lines, worker_strict_roman
+    worker_line_time_budget = line_time_budget
+    worker_strict_roman = strict_roman
+    worker_stop_lines = bool(line_time_budget) and hasattr(signal, "setitimer")
+    if worker_stop_lines:
+        signal.signal(signal.SIGALRM, raise_line_timeout)
+
+
+def extract_line_partial_in_worker(numbered_line):
+    line, line_nlp, line_number = numbered_line
+    return extract_line_partial_in_time(line, line_nlp, line_number, worker_line_time_budget, worker_stop_lines, worker_strict_roman)
+
+
+
+# ============================================
+# Checkpoint of the document
+# (table: ingestion_checkpoint)
+# ============================================
+
+"""
+Save the checkpoint of the document: the number of the last processed line and the values carried to the next line.
+The checkpoint is saved in the same transaction as the lines, so it always corresponds to the lines committed in the database.
+"""
+
+def save_checkpoint(cursor, document_id, state, completed):
+    cursor.execute("REPLACE INTO ingestion_checkpoint (document_id, line_number, folio_previous, previous_date_standardized, participant_previous, rubric_extracted_id, subrubric_extracted_id, completed) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)", (document_id, state["line_number"], state["folio_previous"], state["previous_date_standardized"], state["participant_previous"], state["rubric_extracted_id"], state["subrubric_extracted_id"], 1 if completed else 0,))
+
+
+"""
+Check if the document already has lines in the database (processed before without checkpoint, see process_line()).
+"""
+
+def document_has_lines(cursor, document_id):
+    cursor.execute("SELECT 1 FROM line WHERE document_id = %s LIMIT 1", (document_id,))
+    return cursor.fetchone() is not None
+
+
+"""
+Load the checkpoint of the document (None if the document has no checkpoint).
+"""
 
+def load_checkpoint(cursor, document_id):
+    cursor.execute("SELECT line_number, folio_previous, previous_date_standardized, participant_previous, rubric_extracted_id, subrubric_extracted_id, completed FROM ingestion_checkpoint WHERE document_id = %s", (document_id,))
+    checkpoint = cursor.fetchone()
+
+    if not checkpoint:
+        return None
+
+    return {
+        "line_number": checkpoint[0],
+        "folio_previous": checkpoint[1],
+        "previous_date_standardized": str(checkpoint[2]), # the date can be returned as a date object
+        "participant_previous": checkpoint[3],
+        "rubric_extracted_id": checkpoint[4],
+        "subrubric_extracted_id": checkpoint[5],
+        "completed": bool(checkpoint[6])
+    }
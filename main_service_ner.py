@@ -0,0 +1,226 @@
+"""
+Module: main_service_ner.py
+
+Description:
+Local NER service to avoid loading the spaCy model at each run of main.py.
+Loading the model takes many seconds, so instead the model is loaded once by this service which stays running. Then main.py (and any other client) sends the lines to the service and gets back the entities of each line.
+The service works on localhost with HTTP and JSON (only with standard Python libraries).
+
+To start the service:
+    >>> python main_service_ner.py --model training/training-itself/full/models/model-best --port 8765
+Then in main.py set the model to the address of the service:
+    >>> model_path = "http://127.0.0.1:8765"
+
+The requests of several clients (for example, several documents processed in parallel) are put together in one batch before to be sent to the model (see EntityBatcher), so the model is used with large batches even if each client sends a few lines.
+
+Functions and classes:
+
+EntityBatcher:
+    Collect the lines sent by all clients, process them with nlp.pipe in batches and give back to each client the entities of its lines.
+
+run_service():
+    Start the service (load the model and wait for the requests).
+
+NerServiceClient:
+    Client of the service. It can be used in place of the spaCy model in process_line() (it has the same functions: nlp_model(line) and nlp_model.pipe(lines)), it returns the entities of each line as LineEntities (see main_handler_ner.py).
+
+load_model():
+    Return the client of the service if the model is an address (http://...), otherwise load the spaCy model.
+
+"""
+
+# Import libraries
+# ------------------------------------------
+import argparse # to read the arguments of the command line
+import json # to exchange data with the clients
+import queue # to collect the requests of clients
+import threading # to process the requests of many clients at the same time
+import time # to wait for other requests before processing a batch
+import urllib.request # to send requests to the service
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer # to run the service
+import spacy # to text NLP processing
+
+# Import custom functions
+# ------------------------------------------
+from main_handler_ner import doc_to_spans, spans_to_line_entities
+
+
+# ==============================
+# Batch the requests of all clients
+# ==============================
+
+"""
+Each request (lines of one client) is put in a queue. Only one thread (the batcher) uses the model:
+it takes the first waiting request, then waits a little (max_wait seconds) to collect other requests until it has max_batch_lines lines,
+processes all these lines together with nlp.pipe and gives back to each request its own entities (in the order of its lines).
+"""
+
+class EntityBatcher:
+    def __init__(self, nlp_model, max_batch_lines=1024, max_wait=0.01):
+        self.nlp_model = nlp_model
+        self.max_batch_lines = max_batch_lines
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    # Called by each client: wait until the lines are processed
+    def process(self, lines):
+        request = {"lines": lines, "spans": None, "error": None, "done": threading.Event()}
+        self.requests.put(request)
+        request["done"].wait()
+        if request["error"]:
+            raise request["error"]
+        return request["spans"]
+
+    # Batcher thread
+    def run(self):
+        while True:
+            # Collect the requests for one batch
+            batch = [self.requests.get()]
+            count_lines = len(batch[0]["lines"])
+            deadline = time.monotonic() + self.max_wait
+            while count_lines < self.max_batch_lines:
+                try:
+                    request = self.requests.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                batch.append(request)
+                count_lines += len(request["lines"])
+
+            # Process all lines of the batch together
+            try:
+                lines = [line for request in batch for line in request["lines"]]
+                spans = [doc_to_spans(doc) for doc in self.nlp_model.pipe(lines, batch_size=self.max_batch_lines)]
+            except Exception as error:
+                for request in batch:
+                    request["error"] = error
+                    request["done"].set()
+                continue
+
+            # Give back to each request the entities of its lines
+            position = 0
+            for request in batch:
+                request["spans"] = spans[position:position + len(request["lines"])]
+                position += len(request["lines"])
+                request["done"].set()
+
+
+
+# ==============================
+# Service
+# ==============================
+
+"""
+The service answers two requests:
+- GET /meta: information about the loaded model (nlp.meta), used to know which model gives the entities
+- POST /ner with the lines to process: {"lines": ["line 1", "line 2", ...]}
+  answer: {"entities": [[[start_char, end_char, label], ...], ...]} (the list of entities for each line, in the order of lines)
+"""
+
+def run_service(model_path, host='127.0.0.1', port=8765, max_batch_lines=1024, max_wait=0.01):
+
+    nlp_model = spacy.load(model_path)
+    batcher = EntityBatcher(nlp_model, max_batch_lines, max_wait)
+
+    class NerRequestHandler(BaseHTTPRequestHandler):
+
+        def send_json(self, data, status=200):
+            body = json.dumps(data).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/meta':
+                self.send_json(nlp_model.meta)
+            else:
+                self.send_json({"error": "unknown request"}, 404)
+
+        def do_POST(self):
+            if self.path != '/ner':
+                self.send_json({"error": "unknown request"}, 404)
+                return
+            try:
+                lines = json.loads(self.rfile.read(int(self.headers['Content-Length'])))["lines"]
+                self.send_json({"entities": batcher.process(lines)})
+            except Exception as error:
+                self.send_json({"error": f"{type(error).__name__}: {error}"}, 500)
+
+        def log_message(self, format, *args):
+            pass # do not print each request
+
+    server = ThreadingHTTPServer((host, port), NerRequestHandler)
+    print(f"NER service with the model {model_path} is running on http://{host}:{port}")
+    server.serve_forever()
+
+
+
+# ==============================
+# Client
+# ==============================
+
+class NerServiceClient:
+    def __init__(self, url, timeout=600):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self._meta = None
+
+    # Send the lines to the service and get back their entities
+    def request_spans(self, lines):
+        request = urllib.request.Request(f"{self.url}/ner", data=json.dumps({"lines": lines}).encode('utf-8'), headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())["entities"]
+
+    # Process one line (as nlp_model(line))
+    def __call__(self, line):
+        return spans_to_line_entities(line, self.request_spans([line])[0])
+
+    # Process many lines in batches (as nlp_model.pipe(lines)), n_process is not used: the service processes the lines
+    def pipe(self, lines, batch_size=256, n_process=1):
+        batch = []
+        for line in lines:
+            batch.append(line)
+            if len(batch) == batch_size:
+                yield from self.process_batch(batch)
+                batch = []
+        if batch:
+            yield from self.process_batch(batch)
+
+    def process_batch(self, lines):
+        for line, spans in zip(lines, self.request_spans(lines)):
+            yield spans_to_line_entities(line, spans)
+
+    # Information about the model of the service
+    @property
+    def meta(self):
+        if self._meta is None:
+            with urllib.request.urlopen(f"{self.url}/meta", timeout=self.timeout) as response:
+                self._meta = json.loads(response.read())
+        return self._meta
+
+
+# Load the spaCy model or connect to the service
+# ------------------------------------------
+def load_model(model_path):
+    if model_path.startswith(('http://', 'https://')):
+        return NerServiceClient(model_path)
+    return spacy.load(model_path)
+
+
+
+# ==============================
+# Processing
+# ==============================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local NER service: keep the spaCy model loaded and process the lines sent by the clients.")
+    parser.add_argument("--model", default="training/training-itself/full/models/model-best", help="path of the spaCy model")
+    parser.add_argument("--host", default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-batch-lines", type=int, default=1024, help="maximum number of lines processed together")
+    parser.add_argument("--max-wait", type=float, default=0.01, help="time (in seconds) to wait for the requests of other clients before processing a batch")
+    arguments = parser.parse_args()
+
+    run_service(arguments.model, arguments.host, arguments.port, arguments.max_batch_lines, arguments.max_wait)
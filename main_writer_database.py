@@ -0,0 +1,688 @@
+"""
+Module: main_writer_database.py
+
+Description:
+This module contains all functions which insert the extracted data into the database during the processing of lines.
+The extraction of data from text (functions extract_... in main_handler_amount.py, main_handler_date.py, main_handler_utils.py and extract_line() in main_processor_line.py) doesn't use the database: it returns records (dictionaries).
+Then the records are inserted into the database by the functions of this module. So the extraction can be run, checked and measured without database, and the way of inserting the data can be changed without touching the extraction.
+
+Functions:
+
+write_line():
+    Insert the record of one line (see extract_line() in main_processor_line.py) and all its connected data: rubric and subrubric names, date, line, products, amounts and participants.
+
+insert_rubric_subrubric(), write_rubric_subrubric():
+    Find or insert the rubric or subrubric name (extracted and standardized) and return the id of the extracted name.
+
+insert_date():
+    Insert the record of dates of the line (see extract_date() in main_handler_date.py).
+
+insert_date_interned(), insert_date_row():
+    Find or insert the row of dates with the same values (one row shared by all lines with the same dates), see the note before this function.
+
+insert_line():
+    Insert the line itself (table "line").
+
+insert_products(), insert_participants():
+    Insert the products and the participants of the line (see extract_products() and extract_participants() in main_handler_utils.py).
+
+insert_amount(), insert_amount_simple(), insert_subpart():
+    Insert the amounts of the line (see extract_amount(), extract_amount_simple() and extract_subpart() in main_handler_amount.py).
+
+find_currency_standardized_id():
+    Find the standardized currency for the name of currency to search.
+
+write_lines():
+    Insert the records of many lines together (batched writer): each table is filled with INSERTs of many rows, see the note before this function.
+
+insert_rows():
+    Insert many rows into a table with one INSERT (by parts of rows_per_insert rows) and return the ids of the inserted rows.
+
+get_or_create(), check_unique_keys(), find_missing_unique_keys():
+    Find or insert one row of a shared table (name of rubric, person, etc.) safely when many processes insert the same name at the same time (with a unique key on the name, see the note before this function; the keys are added with migrate_unique_keys.py).
+
+run_shared():
+    Write the rows of shared tables in their own short transaction on a second connection when documents are processed in parallel, done again after a deadlock (see the note before this function).
+
+check_consecutive_ids():
+    Check that the database gives consecutive ids to the rows of one INSERT (needed by write_lines()).
+
+LookupCache:
+    Ids of the names of rubrics and subrubrics and of the shared rows of dates, kept in memory for the whole run (see the note before this class).
+
+CurrencyResolver:
+    The tables currency_standardized and currency_variant kept in memory to find the currencies without query (see the note before this class).
+
+"""
+
+# Import libraries
+# ------------------------------------------
+import hashlib # to calculate the hash of the values of dates
+import json # to write the values of dates before calculating the hash
+import unicodedata # to compare the names of currencies without accents (as MySQL does)
+
+
+# =====================================================
+# Insert one line with all connected data
+# =====================================================
+
+"""
+The order of insertions is the same for each line: rubric or subrubric name, date, line, products, amounts, participants.
+The id of the current rubric and subrubric are carried from one line to the next in the state of the processing (see process_line() in main_processor_line.py), so they are updated here.
+If date_ids is given (dictionary, see insert_date_interned()), the lines with the same dates share one row of the table "date".
+"""
+
+def write_line(cursor, line_record, document_id, class_id, state, lookup_cache=None, date_ids=None):
+
+    # Rubric and subrubric names
+    # ------------------------------------------
+    if line_record["rubric"]:
+        state["rubric_extracted_id"] = insert_rubric_subrubric(cursor, *line_record["rubric"], 'rubric', lookup_cache)
+
+    if line_record["subrubric"]:
+        state["subrubric_extracted_id"] = insert_rubric_subrubric(cursor, *line_record["subrubric"], 'subrubric', lookup_cache)
+
+    # Date
+    # ------------------------------------------
+    if date_ids is None:
+        date_id = insert_date(cursor, line_record["date"])
+    else:
+        date_id = insert_date_interned(cursor, line_record["date"], date_ids, lookup_cache)
+
+    # Line
+    # ------------------------------------------
+    line_id = insert_line(cursor, document_id, class_id, state["rubric_extracted_id"], state["subrubric_extracted_id"], date_id, line_record)
+
+    # Connected tables
+    # ------------------------------------------
+    insert_products(cursor, line_id, line_record["products"])
+
+    if line_record["amount"]:
+        insert_amount(cursor, line_id, line_record["amount"], lookup_cache)
+
+    insert_participants(cursor, line_id, line_record["participants"])
+
+    return line_id
+
+
+
+# =====================================================
+# Rubric and subrubric
+# =====================================================
+
+"""
+First, check if the name already exists in the database; if yes, use it, if not insert the new one (get_or_create(), safe when many processes insert the same name at the same time).
+With the lookup_cache (see LookupCache), the names and the links already known are taken from memory without query.
+With the shared_connection of the lookup_cache (documents processed in parallel), the names are written in their own short transaction (see run_shared()), and kept in memory only after its commit.
+"""
+
+def insert_rubric_subrubric(cursor, name_extracted, name_standardized, category, lookup_cache=None):
+
+    # The names and their link are already known: nothing to write
+    if lookup_cache:
+        known_extracted_id = lookup_cache.ids[category, 'extracted'].get(name_extracted)
+        known_standardized_id = lookup_cache.ids[category, 'standardized'].get(name_standardized)
+        if known_extracted_id is not None and known_standardized_id is not None and lookup_cache.standardized_ids[category].get(known_extracted_id) == known_standardized_id:
+            return known_extracted_id
+
+    current_extracted_id, current_standardized_id = run_shared(cursor, lookup_cache, write_rubric_subrubric, name_extracted, name_standardized, category, lookup_cache)
+
+    if lookup_cache:
+        lookup_cache.ids[category, 'extracted'][name_extracted] = current_extracted_id
+        lookup_cache.ids[category, 'standardized'][name_standardized] = current_standardized_id
+        lookup_cache.standardized_ids[category][current_extracted_id] = current_standardized_id
+
+    return current_extracted_id
+
+
+def write_rubric_subrubric(cursor, name_extracted, name_standardized, category, lookup_cache=None):
+
+    def check_and_insert_new_data(cursor, name, category, data_type):
+
+        # Check if the name is already known
+        if lookup_cache and name in lookup_cache.ids[category, data_type]:
+            return lookup_cache.ids[category, data_type][name]
+
+        # Find the name in the table, or insert it if it doesn't exist already
+        return get_or_create(cursor, f"{category}_{data_type}", f"{category}_{data_type}_id", {f"{category}_name_{data_type}": name})
+
+    current_extracted_id = check_and_insert_new_data(cursor, name_extracted, category, 'extracted')
+    current_standardized_id = check_and_insert_new_data(cursor, name_standardized, category, 'standardized')
+
+    # Update the (sub)rubric_extracted row with the (sub)rubric_standardized_id
+    # (only if the link is not already correct: an UPDATE locks the row until the commit, so the documents processed in parallel would wait for each other, see main_corpus.py)
+    if lookup_cache and current_extracted_id in lookup_cache.standardized_ids[category]:
+        linked_standardized_id = lookup_cache.standardized_ids[category][current_extracted_id]
+    else:
+        # The row can be missing from this SELECT: if another process has inserted the name after the first read of this transaction, get_or_create() returns its id (ON DUPLICATE KEY),
+        # but the SELECT still reads the data as it was at the first read (REPEATABLE READ). The UPDATE below reads the last version of the row, so the link is written anyway.
+        cursor.execute(f"SELECT {category}_standardized_id FROM {category}_extracted WHERE {category}_extracted_id = %s", (current_extracted_id,))
+        link = cursor.fetchone()
+        linked_standardized_id = link[0] if link else None
+
+    if linked_standardized_id != current_standardized_id:
+        cursor.execute(f"UPDATE {category}_extracted SET {category}_standardized_id = %s WHERE {category}_extracted_id = %s", (current_standardized_id, current_extracted_id))
+
+    return current_extracted_id, current_standardized_id
+
+
+
+# =====================================================
+# Date and line
+# =====================================================
+
+def insert_date(cursor, date_record):
+    cursor.execute("INSERT INTO date (start_date_extracted, start_date_standardized, start_date_uncertainty, end_date_extracted, end_date_standardized, end_date_uncertainty, duration_extracted, duration_standardized_in_days, duration_uncertainty) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)", (date_record["start_date_extracted"], date_record["start_date_standardized"], date_record["start_date_uncertainty"], date_record["end_date_extracted"], date_record["end_date_standardized"], date_record["end_date_uncertainty"], date_record["duration_extracted"], date_record["duration_standardized_in_days"], date_record["duration_uncertainty"],))
+    return cursor.lastrowid  # Retrieve auto-incremented ID
+
+
+# One row of dates for all lines with the same dates
+# ------------------------------------------
+"""
+Most lines have the same dates as other lines (all lines of the same day, the lines without date which take the previous date, etc.), so the table "date" can be much smaller if these lines share the same row.
+The row is identified by the hash of all its values (column date_hash with a unique key, see README.md):
+- date_ids (dictionary) keeps the id of each hash already known during the processing, so a known row is found without query;
+- an unknown row is inserted, or if a row with the same hash already exists (inserted by a previous processing or by another process), its id is taken (INSERT ... ON DUPLICATE KEY UPDATE date_id = LAST_INSERT_ID(date_id), the id of the existing row is returned as the id of the inserted row).
+With the shared_connection of the lookup_cache (documents processed in parallel), the new rows are written in their own short transaction (see run_shared()): the same dates come back in all documents,
+so a row kept locked until the end of a document would make the other workers wait for each other (or stop with a deadlock).
+Be careful: a shared row must not be corrected for only one line (it would change the dates of all lines which share it, see README.md).
+"""
+
+def insert_date_interned(cursor, date_record, date_ids, lookup_cache=None):
+    date_hash = hash_date(date_record)
+
+    if date_hash not in date_ids:
+        date_ids[date_hash] = run_shared(cursor, lookup_cache, insert_date_row, date_record, date_hash)
+
+    return date_ids[date_hash]
+
+
+def insert_date_row(cursor, date_record, date_hash):
+    cursor.execute(f"INSERT INTO date ({', '.join(date_columns)}, date_hash) VALUES ({', '.join(['%s'] * (len(date_columns) + 1))}) ON DUPLICATE KEY UPDATE date_id = LAST_INSERT_ID(date_id)", (*(date_record[column] for column in date_columns), date_hash,))
+    return cursor.lastrowid
+
+
+def hash_date(date_record):
+    date_values = json.dumps([date_record[column] for column in date_columns], ensure_ascii=False)
+    return hashlib.sha1(date_values.encode('utf-8')).hexdigest()
+
+
+def insert_line(cursor, document_id, class_id, rubric_extracted_id, subrubric_extracted_id, date_id, line_record):
+    cursor.execute("INSERT INTO line (document_id, class_id, rubric_extracted_id, subrubric_extracted_id, line_type_id, date_id, line_number, folio, text) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)", (document_id, class_id, rubric_extracted_id, subrubric_extracted_id, line_record["line_type"], date_id, line_record["line_number"], line_record["folio"], line_record["text"],))
+    return cursor.lastrowid  # Retrieve auto-incremented ID
+
+
+
+# =====================================================
+# Product and participant
+# =====================================================
+
+def insert_products(cursor, line_id, product_records):
+    for product_record in product_records:
+        cursor.execute("INSERT INTO product (line_id, product_extracted, product_uncertainty) VALUES (%s, %s, %s)", (line_id, product_record["product_extracted"], product_record["product_uncertainty"],))
+
+
+def insert_participants(cursor, line_id, participant_records):
+    for participant_record in participant_records:
+        cursor.execute("INSERT INTO participant (line_id, participant_extracted, participant_name_extracted, participant_role_extracted, additional_participant, person_function_id, participant_uncertainty) VALUES (%s, %s, %s, %s, %s, %s, %s)", (line_id, participant_record["participant_extracted"], participant_record["participant_name_extracted"], participant_record["participant_role_extracted"], participant_record["additional_participant"], participant_record["person_function_id"], participant_record["participant_uncertainty"],))
+
+
+
+# =====================================================
+# Amount
+# =====================================================
+
+def insert_amount(cursor, line_id, amount_record, lookup_cache=None):
+
+    # Amount composite
+    # ------------------------------------------
+    if amount_record["amount_composite"]:
+
+        # Insert into amount_composite table
+        cursor.execute("INSERT INTO amount_composite (line_id, amount_composite_extracted, amount_composite_uncertainty) VALUES (%s, %s, %s)", (line_id, amount_record["amount_composite"]["amount_composite_extracted"], amount_record["amount_composite"]["amount_composite_uncertainty"],))
+        amount_composite_id = cursor.lastrowid  # Retrieve auto-incremented ID
+
+        if amount_record["exchange_rate_extracted"]:
+            # The line has just been inserted, so it has no row in the exchange_rate_internal_reference table yet
+            cursor.execute("INSERT INTO exchange_rate_internal_reference (exchange_rate_extracted, line_id) VALUES (%s, %s)", (amount_record["exchange_rate_extracted"], line_id,))
+
+        # The parts of amount composite are linked to the amount composite (not to the line)
+        for amount_simple_record in amount_record["amounts_simple"]:
+            insert_amount_simple(cursor, None, amount_composite_id, amount_simple_record, lookup_cache)
+
+    # Amount simple (linked directly to the line)
+    # ------------------------------------------
+    else:
+        for amount_simple_record in amount_record["amounts_simple"]:
+            insert_amount_simple(cursor, line_id, None, amount_simple_record, lookup_cache)
+
+
+def insert_amount_simple(cursor, line_id, amount_composite_id, amount_simple_record, lookup_cache=None):
+
+    currency_standardized_id = None
+    if amount_simple_record["currency_to_search"]:
+        currency_standardized_id = find_currency_standardized_id(cursor, amount_simple_record["currency_to_search"], lookup_cache.currency_resolver if lookup_cache else None)
+
+    # Insert into amount_simple table
+    cursor.execute("INSERT INTO amount_simple (line_id, amount_composite_id, amount_simple_extracted, currency_extracted, currency_standardized_id, arithmetic_operator, amount_simple_uncertainty) VALUES (%s, %s, %s, %s, %s, %s, %s)", (line_id, amount_composite_id, amount_simple_record["amount_simple_extracted"], amount_simple_record["currency_extracted"], currency_standardized_id, amount_simple_record["arithmetic_operator"], amount_simple_record["amount_simple_uncertainty"],))
+    amount_simple_id = cursor.lastrowid
+
+    # Insert sub-parts (need to be done in the end, case need amount_simple_id)
+    for subpart_record in amount_simple_record["subparts"]:
+        insert_subpart(cursor, amount_simple_id, subpart_record)
+
+    return amount_simple_id
+
+
+def insert_subpart(cursor, amount_simple_id, subpart_record):
+    cursor.execute("INSERT INTO amount_simple_subpart (amount_simple_id, subpart_extracted, roman_numeral, arabic_numeral, amount_simple_subpart_uncertainty, unit_of_count_id) VALUES (%s, %s, %s, %s, %s, %s)", (amount_simple_id, subpart_record["subpart_extracted"], subpart_record["roman_numeral"], subpart_record["arabic_numeral"], subpart_record["amount_simple_subpart_uncertainty"], subpart_record["unit_of_count_id"],))
+
+
+
+# =====================================================
+# Currency
+# =====================================================
+
+"""
+Search for currency_to_search at the beginning of currency_name in the "currency_standardized" table, if not found, at the beginning of currency_variant_name in the "currency_variant" table.
+The currency chosen is the same as in the first version of the processing (process_amount_simple() before main_writer_database.py), so the ids are the same as in the data already in the database:
+- in currency_standardized, the first currency found if only one is found, but the second one (in the order of ids) if many currencies start with currency_to_search
+  (the first version read a second row with cursor.fetchone() after the search in currency_standardized, and this row replaced the first one);
+- in currency_variant, the first currency found.
+With the currency_resolver (see CurrencyResolver), the search is done in memory without query.
+"""
+
+def find_currency_standardized_id(cursor, currency_to_search, currency_resolver=None):
+    if currency_resolver:
+        return currency_resolver.resolve(currency_to_search)
+
+    currency_standardized_id = None
+
+    # Search for currency_to_search in currency_name from the "currency_standardized" table
+    cursor.execute("SELECT currency_standardized_id FROM currency_standardized WHERE currency_name LIKE %s ORDER BY currency_standardized_id LIMIT 2", (f"{currency_to_search}%",))
+    result_from_currency_standardized = cursor.fetchall()
+
+    if result_from_currency_standardized:
+        currency_standardized_id = result_from_currency_standardized[-1][0]  # the second currency if many are found (see above)
+
+    # If not found, search in currency_variant_name from the "currency_variant" table
+    else:
+        cursor.execute("SELECT currency_standardized_id FROM currency_variant WHERE currency_variant_name LIKE %s ORDER BY currency_variant_id", (f"{currency_to_search}%",))
+        result_from_currency_variant = cursor.fetchone()
+        if result_from_currency_variant:
+            currency_standardized_id = result_from_currency_variant[0]
+
+    return currency_standardized_id
+
+
+
+# =====================================================
+# Insert many lines together (batched writer)
+# =====================================================
+
+"""
+write_line() sends about ten INSERTs per line (date, line, each product, each amount, each sub-part, each participant) and each of them is a round trip to the database.
+write_lines() inserts the records of many lines together: each table is filled with INSERTs of many rows (INSERT INTO ... VALUES (...), (...), ...), so there are only a few round trips for the whole batch of lines.
+
+The ids of the parent rows (date, line, amount_composite, amount_simple) are needed to insert their children rows. They are not read row by row:
+for an INSERT of many rows, MySQL returns the id of the first row (lastrowid) and the other rows get the next ids (first id + 1, first id + 2, ...).
+This is true when auto_increment_increment = 1 (the default value), which is checked by check_consecutive_ids() before using write_lines().
+
+The rows are inserted in the same order as with write_line() for each line, so the result in the database is exactly the same (the same rows with the same ids).
+The names of rubrics and subrubrics are still found or inserted one by one (they are rare and they must be known before inserting the lines).
+"""
+
+date_columns = ["start_date_extracted", "start_date_standardized", "start_date_uncertainty", "end_date_extracted", "end_date_standardized", "end_date_uncertainty", "duration_extracted", "duration_standardized_in_days", "duration_uncertainty"]
+participant_columns = ["participant_extracted", "participant_name_extracted", "participant_role_extracted", "additional_participant", "person_function_id", "participant_uncertainty"]
+subpart_columns = ["subpart_extracted", "roman_numeral", "arabic_numeral", "amount_simple_subpart_uncertainty", "unit_of_count_id"]
+
+def write_lines(cursor, line_records, document_id, class_id, state, lookup_cache=None, date_ids=None):
+
+    # Rubric and subrubric names (in the order of lines)
+    # ------------------------------------------
+    rubric_subrubric_ids = []
+    for line_record in line_records:
+        if line_record["rubric"]:
+            state["rubric_extracted_id"] = insert_rubric_subrubric(cursor, *line_record["rubric"], 'rubric', lookup_cache)
+        if line_record["subrubric"]:
+            state["subrubric_extracted_id"] = insert_rubric_subrubric(cursor, *line_record["subrubric"], 'subrubric', lookup_cache)
+        rubric_subrubric_ids.append((state["rubric_extracted_id"], state["subrubric_extracted_id"]))
+
+    # Dates (or the shared rows of dates, see insert_date_interned())
+    # ------------------------------------------
+    if date_ids is None:
+        line_date_ids = insert_rows(cursor, "date", date_columns, [tuple(line_record["date"][column] for column in date_columns) for line_record in line_records])
+    else:
+        line_date_ids = [insert_date_interned(cursor, line_record["date"], date_ids, lookup_cache) for line_record in line_records]
+
+    # Lines
+    # ------------------------------------------
+    line_ids = insert_rows(cursor, "line", ["document_id", "class_id", "rubric_extracted_id", "subrubric_extracted_id", "line_type_id", "date_id", "line_number", "folio", "text"], [(document_id, class_id, rubric_extracted_id, subrubric_extracted_id, line_record["line_type"], date_id, line_record["line_number"], line_record["folio"], line_record["text"]) for line_record, (rubric_extracted_id, subrubric_extracted_id), date_id in zip(line_records, rubric_subrubric_ids, line_date_ids)])
+
+    # Products
+    # ------------------------------------------
+    insert_rows(cursor, "product", ["line_id", "product_extracted", "product_uncertainty"], [(line_id, product_record["product_extracted"], product_record["product_uncertainty"]) for line_id, line_record in zip(line_ids, line_records) for product_record in line_record["products"]])
+
+    # Amounts composite
+    # ------------------------------------------
+    amounts = [(line_id, line_record["amount"]) for line_id, line_record in zip(line_ids, line_records) if line_record["amount"]]
+    amounts_composite = [(line_id, amount_record) for line_id, amount_record in amounts if amount_record["amount_composite"]]
+    amount_composite_ids = insert_rows(cursor, "amount_composite", ["line_id", "amount_composite_extracted", "amount_composite_uncertainty"], [(line_id, amount_record["amount_composite"]["amount_composite_extracted"], amount_record["amount_composite"]["amount_composite_uncertainty"]) for line_id, amount_record in amounts_composite])
+
+    # Exchange rates (the lines have just been inserted, so they have no exchange rate yet)
+    exchange_rates = [(amount_record["exchange_rate_extracted"], line_id) for line_id, amount_record in amounts_composite if amount_record["exchange_rate_extracted"]]
+    insert_rows(cursor, "exchange_rate_internal_reference", ["exchange_rate_extracted", "line_id"], exchange_rates)
+
+    # Amounts simple (linked to the amount composite or directly to the line)
+    # ------------------------------------------
+    amount_composite_ids = iter(amount_composite_ids)
+    currency_standardized_ids = {} # each currency is searched only once per batch
+    amounts_simple = []
+    amount_simple_rows = []
+    for line_id, amount_record in amounts:
+        if amount_record["amount_composite"]:
+            line_id, amount_composite_id = None, next(amount_composite_ids)
+        else:
+            amount_composite_id = None
+
+        for amount_simple_record in amount_record["amounts_simple"]:
+            currency_to_search = amount_simple_record["currency_to_search"]
+            if currency_to_search and currency_to_search not in currency_standardized_ids:
+                currency_standardized_ids[currency_to_search] = find_currency_standardized_id(cursor, currency_to_search, lookup_cache.currency_resolver if lookup_cache else None)
+
+            amounts_simple.append(amount_simple_record)
+            amount_simple_rows.append((line_id, amount_composite_id, amount_simple_record["amount_simple_extracted"], amount_simple_record["currency_extracted"], currency_standardized_ids.get(currency_to_search), amount_simple_record["arithmetic_operator"], amount_simple_record["amount_simple_uncertainty"]))
+
+    amount_simple_ids = insert_rows(cursor, "amount_simple", ["line_id", "amount_composite_id", "amount_simple_extracted", "currency_extracted", "currency_standardized_id", "arithmetic_operator", "amount_simple_uncertainty"], amount_simple_rows)
+
+    # Sub-parts
+    insert_rows(cursor, "amount_simple_subpart", ["amount_simple_id"] + subpart_columns, [(amount_simple_id, *(subpart_record[column] for column in subpart_columns)) for amount_simple_id, amount_simple_record in zip(amount_simple_ids, amounts_simple) for subpart_record in amount_simple_record["subparts"]])
+
+    # Participants
+    # ------------------------------------------
+    insert_rows(cursor, "participant", ["line_id"] + participant_columns, [(line_id, *(participant_record[column] for column in participant_columns)) for line_id, line_record in zip(line_ids, line_records) for participant_record in line_record["participants"]])
+
+    return line_ids
+
+
+# Insert many rows into one table
+# ------------------------------------------
+"""
+The rows are inserted by parts of rows_per_insert rows (one INSERT per part), because the size of one query is limited (max_allowed_packet).
+Return the ids of the inserted rows (in the order of rows).
+"""
+def insert_rows(cursor, table, columns, rows, rows_per_insert=1000):
+    ids = []
+
+    for start in range(0, len(rows), rows_per_insert):
+        part = rows[start:start + rows_per_insert]
+        row_placeholders = f"({', '.join(['%s'] * len(columns))})"
+        cursor.execute(f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join([row_placeholders] * len(part))}", tuple(value for row in part for value in row))
+        first_id = cursor.lastrowid # id of the first row, the next rows have the next ids
+        ids.extend(range(first_id, first_id + len(part)))
+
+    return ids
+
+
+# Check that the ids of the rows of one INSERT are consecutive
+# ------------------------------------------
+def check_consecutive_ids(cursor):
+    cursor.execute("SELECT @@auto_increment_increment")
+    auto_increment_increment = cursor.fetchone()[0]
+    if int(auto_increment_increment) != 1:
+        raise ValueError(f"write_batch_size can't be used with auto_increment_increment = {auto_increment_increment} (the ids of the inserted rows must be consecutive)")
+
+
+
+# =====================================================
+# Get or create the rows of shared tables
+# =====================================================
+
+"""
+The names of rubrics and subrubrics (and during the post-processing, the names of persons and roles) are shared by all documents: "check if the name exists, if not insert it".
+With a SELECT then an INSERT, two processes which insert the same new name at the same time both find nothing and both insert it (the name is then twice in the table).
+get_or_create() does it safely, with a unique key on the column of the name (unique_keys, the keys must be added once with migrate_unique_keys.py, see README.md):
+- the name is searched first with a SELECT (which doesn't lock anything, so the processes never wait for each other for a name which already exists);
+- if not found, it is inserted with INSERT ... ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id): if another process has inserted the same name in the meantime, nothing is inserted and the id of the existing row is returned (as in insert_date_interned()).
+If the other process has not committed yet, MySQL waits for its commit (or its rollback) before answering, so the id returned is always the id of a row which exists.
+The names are compared as in the SELECT (with the collation of the column, e.g. without case): the unique key and the search find the same row.
+If the key of a table is missing (tables_without_unique_key, see check_unique_keys()), the name is inserted with a simple INSERT as before: this is safe only if one process writes at a time.
+"""
+
+unique_keys = {
+    "rubric_extracted": "rubric_name_extracted",
+    "rubric_standardized": "rubric_name_standardized",
+    "subrubric_extracted": "subrubric_name_extracted",
+    "subrubric_standardized": "subrubric_name_standardized",
+    "person": "person_name_standardized",
+    "person_role": "person_role_name_standardized",
+    "date": "date_hash" # only with intern_dates (see insert_date_interned())
+}
+
+# Tables filled by the processing of the texts (see process_corpus() in main_corpus.py)
+ingestion_tables = ["rubric_extracted", "rubric_standardized", "subrubric_extracted", "subrubric_standardized"]
+
+# Tables found without their unique key by check_unique_keys(required=False)
+tables_without_unique_key = set()
+
+
+# Find or insert one row (values: dictionary of columns, with the column of the unique key of the table)
+# ------------------------------------------
+"""
+    >>> get_or_create(cursor, "person_role", "person_role_id", {"person_role_name_standardized": "magister"}) = 12
+"""
+def get_or_create(cursor, table, id_column, values):
+    key_column = unique_keys[table]
+    cursor.execute(f"SELECT {id_column} FROM {table} WHERE {key_column} = %s", (values[key_column],))
+    existing_id = cursor.fetchone()
+    if existing_id:
+        return existing_id[0]
+
+    on_duplicate = "" if table in tables_without_unique_key else f" ON DUPLICATE KEY UPDATE {id_column} = LAST_INSERT_ID({id_column})"
+    cursor.execute(f"INSERT INTO {table} ({', '.join(values)}) VALUES ({', '.join(['%s'] * len(values))}){on_duplicate}", tuple(values.values()))
+    return cursor.lastrowid # id of the inserted row or of the existing row
+
+
+# Check that the tables have their unique keys
+# ------------------------------------------
+"""
+Without the unique key, two processes writing at the same time could insert the same name twice:
+- required=True (many processes write at the same time): the processing doesn't start if a key is missing;
+- required=False (only one process writes): a warning is displayed and get_or_create() uses a simple INSERT for the tables without key (as before the unique keys).
+The key must be on the column alone and on the whole value (a key on the beginning of the name only would take different names for the same name).
+Return the tables without unique key.
+"""
+def check_unique_keys(cursor, tables, required=True):
+    missing_tables = find_missing_unique_keys(cursor, tables)
+    missing_keys = " ".join(f"ALTER TABLE {table} ADD UNIQUE KEY {unique_keys[table]} ({unique_keys[table]});" for table in missing_tables)
+
+    if missing_tables and required:
+        raise ValueError(f"missing unique keys (run python migrate_unique_keys.py, see README.md): {missing_keys}")
+
+    tables_without_unique_key.difference_update(tables)
+    tables_without_unique_key.update(missing_tables)
+    if missing_tables:
+        print(f"Warning: missing unique keys, the same name could be inserted twice if another process writes at the same time (run python migrate_unique_keys.py, see README.md): {missing_keys}")
+
+    return missing_tables
+
+
+def find_missing_unique_keys(cursor, tables):
+    missing_tables = []
+
+    for table in tables:
+        cursor.execute(f"SHOW INDEX FROM {table}")
+        key_columns = {}
+        for index_row in cursor.fetchall():
+            non_unique, key_name, column_name, sub_part = index_row[1], index_row[2], index_row[4], index_row[7]
+            if not int(non_unique):
+                key_columns.setdefault(key_name, []).append((column_name, sub_part))
+
+        if [(unique_keys[table], None)] not in key_columns.values():
+            missing_tables.append(table)
+
+    return missing_tables
+
+
+
+# =====================================================
+# Short transactions for the shared rows
+# =====================================================
+
+"""
+When documents are processed in parallel (process_corpus_parallel() in main_corpus.py), each worker writes a document (or commit_every lines) in one long transaction.
+A shared row inserted in this transaction (a name of rubric or subrubric, a row of dates with intern_dates) stays locked until the commit: another worker which inserts the same name waits for the end of the document,
+and two workers which insert two new names in opposite orders wait for each other (deadlock or lock wait timeout, MySQL errors 1213 and 1205), then the document is cancelled.
+So with a shared_connection (second connection of the worker, see LookupCache), these rows are written by run_shared() in their own short transaction, committed at once:
+- the rows are locked only for a few queries, so the workers don't wait for each other for a whole document;
+- if the short transaction is cancelled by a deadlock anyway, it is done again (at most deadlock_retries times).
+The shared rows stay in the database if the document is cancelled (a name or a row of dates not used by any line is simply used again by the next documents).
+Without shared_connection (one process writes), the rows are written with the cursor of the document, in its transaction.
+"""
+
+deadlock_errors = (1213, 1205) # deadlock, lock wait timeout
+deadlock_retries = 5
+
+
+# Run write(cursor, *arguments) in a short transaction of the shared_connection and return its result
+# ------------------------------------------
+def run_shared(cursor, lookup_cache, write, *arguments):
+    shared_connection = lookup_cache.shared_connection if lookup_cache else None
+    if not shared_connection:
+        return write(cursor, *arguments)
+
+    for attempt in range(deadlock_retries + 1):
+        shared_cursor = shared_connection.cursor(buffered=True)
+        try:
+            result = write(shared_cursor, *arguments)
+            shared_connection.commit()
+            return result
+        except Exception as error:
+            shared_connection.rollback()
+            if getattr(error, "errno", None) not in deadlock_errors or attempt == deadlock_retries:
+                raise
+        finally:
+            shared_cursor.close()
+
+
+
+# =====================================================
+# Identity map of the shared tables
+# =====================================================
+
+"""
+The same names of rubrics and subrubrics come back hundreds of times in a corpus, and for each of them insert_rubric_subrubric() would send two SELECTs (and one more SELECT for the link between the extracted and the standardized name).
+LookupCache keeps in memory for the whole run:
+- ids: the id of each known name (tables rubric_extracted, rubric_standardized, subrubric_extracted, subrubric_standardized), by (category, data_type), e.g. ids['rubric', 'extracted']['name'];
+- standardized_ids: the (sub)rubric_standardized_id linked to each (sub)rubric_extracted_id, by category;
+- date_ids: the id of each shared row of dates by its hash (only with intern_dates, see insert_date_interned()), filled during the processing (not loaded, the table "date" is big);
+- shared_connection (optional): a second connection to write the names in short transactions when documents are processed in parallel (see run_shared()).
+It is loaded once (one SELECT per table) and updated at each insertion (write-through), so a name is searched in the database only if it is not in memory yet.
+A name not found in memory is still searched with a SELECT before being inserted (see get_or_create()): the comparison of names in MySQL doesn't take the case into account, so a name written differently can exist in the table.
+
+If the transaction is cancelled (rollback), the inserted rows are not in the database anymore, so the cache must be cleared (clear()). After clear(), the names are searched again in the database (and kept in memory again).
+"""
+
+class LookupCache:
+    def __init__(self, connection, shared_connection=None):
+        self.shared_connection = shared_connection
+        self.load(connection)
+        self.currency_resolver = CurrencyResolver(connection) # the currencies are not changed by the processing, so clear() doesn't concern them
+
+    def load(self, connection):
+        cursor = connection.cursor(buffered=True)
+        self.clear()
+
+        for category in ['rubric', 'subrubric']:
+            for data_type in ['extracted', 'standardized']:
+                cursor.execute(f"SELECT {category}_{data_type}_id, {category}_name_{data_type} FROM {category}_{data_type} ORDER BY {category}_{data_type}_id")
+                for current_id, name in cursor.fetchall():
+                    self.ids[category, data_type].setdefault(name, current_id)
+
+            cursor.execute(f"SELECT {category}_extracted_id, {category}_standardized_id FROM {category}_extracted")
+            self.standardized_ids[category] = dict(cursor.fetchall())
+
+        cursor.close()
+
+    def clear(self):
+        self.ids = {(category, data_type): {} for category in ['rubric', 'subrubric'] for data_type in ['extracted', 'standardized']}
+        self.standardized_ids = {'rubric': {}, 'subrubric': {}}
+        self.date_ids = {}
+
+
+
+# =====================================================
+# Currencies in memory
+# =====================================================
+
+"""
+For each simple amount, find_currency_standardized_id() sends one or two queries "... LIKE 'xx%'" (which can't use an index well) and the same few beginnings of names ("fl", "tu", "vi", etc.) come back all the time.
+CurrencyResolver loads the tables currency_standardized and currency_variant once and keeps, for each beginning of name (prefix), the first two currencies whose name starts with it:
+    >>> Example: {'f': [1, 4], 'fl': [1], 'flo': [1], ..., 'tu': [2, 3], 'tur': [2, 3], ...}
+So the search is a simple look up in a dictionary, with the same result as the queries (see find_currency_standardized_id()):
+- first in currency_standardized, then (if not found) in currency_variant;
+- in currency_standardized, the second currency if many start with the prefix, otherwise the only one; in currency_variant, the first one (in the order of ids);
+- the names are compared without case and accents, as in MySQL.
+The special cases ("parv" = turonensis parvorum, "tur. gros." = grossus) are defined before the search, in extract_amount_simple() (see main_handler_amount.py), so they don't change.
+
+The currencies are loaded at the first search. If the tables of currencies are changed during the run, call invalidate(): they will be loaded again at the next search.
+"""
+
+class CurrencyResolver:
+    def __init__(self, connection):
+        self.connection = connection
+        self.standardized_prefixes = None
+        self.variant_prefixes = None
+
+    def load(self):
+        cursor = self.connection.cursor(buffered=True)
+
+        cursor.execute("SELECT currency_standardized_id, currency_name FROM currency_standardized ORDER BY currency_standardized_id")
+        standardized_rows = cursor.fetchall()
+        cursor.execute("SELECT currency_standardized_id, currency_variant_name FROM currency_variant ORDER BY currency_variant_id")
+        variant_rows = cursor.fetchall()
+        cursor.close()
+
+        self.load_rows(standardized_rows, variant_rows)
+
+    # Index the rows of the tables (currency_standardized_id, name), in the order of ids
+    def load_rows(self, standardized_rows, variant_rows):
+        self.standardized_prefixes = index_prefixes(standardized_rows, 2)
+        self.variant_prefixes = index_prefixes(variant_rows, 1)
+
+    def invalidate(self):
+        self.standardized_prefixes = None
+        self.variant_prefixes = None
+
+    def resolve(self, currency_to_search):
+        if self.standardized_prefixes is None:
+            self.load()
+
+        prefix = normalize_currency_name(currency_to_search)
+        if prefix in self.standardized_prefixes:
+            return self.standardized_prefixes[prefix][-1] # the second currency if many are found
+        if prefix in self.variant_prefixes:
+            return self.variant_prefixes[prefix][0]
+        return None
+
+
+# Index of all beginnings of names (the first currencies are kept for each beginning, at most currencies_kept)
+# ------------------------------------------
+def index_prefixes(rows, currencies_kept=1):
+    prefixes = {}
+    for currency_standardized_id, name in rows:
+        if name is None:
+            continue
+        name = normalize_currency_name(name)
+        for end in range(len(name) + 1):
+            currency_ids = prefixes.setdefault(name[:end], [])
+            if len(currency_ids) < currencies_kept:
+                currency_ids.append(currency_standardized_id)
+    return prefixes
+
+
+# Name without case and accents
+# ------------------------------------------
+def normalize_currency_name(name):
+    name = unicodedata.normalize('NFKD', name)
+    return ''.join(character for character in name if not unicodedata.combining(character)).casefold()
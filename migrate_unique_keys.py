@@ -0,0 +1,128 @@
+"""
+Module: migrate_unique_keys.py
+
+Description:
+Add the unique keys needed by get_or_create() (main_writer_database.py) to the shared tables of names: rubric_extracted, rubric_standardized, subrubric_extracted, subrubric_standardized, person, person_role (and date, on the column date_hash, if it exists, see intern_dates in README.md).
+The keys are required to process documents in parallel (process_corpus_parallel() in main_corpus.py); without them, the other processings only display a warning.
+
+For each table, the script:
+1. skips the table if it already has the key, or if the column doesn't exist (date_hash is only added for intern_dates);
+2. checks the type of the column: the key must be on the whole name, so a TEXT column is changed to VARCHAR (at least 255 characters, or the length of the longest name) in the same ALTER TABLE;
+3. looks for the names which are already in the table more than once: the key can't be added until they are merged (by moving the ids on the rows which use them, see README.md), so the table is skipped and its duplicates are displayed.
+By default, the ALTER TABLE statements are only displayed (dry run). With --apply, they are run.
+The script returns an error code if a key is still missing at the end.
+
+    >>> python migrate_unique_keys.py
+    >>> python migrate_unique_keys.py --apply
+
+"""
+
+# Import libraries
+# ------------------------------------------
+import argparse # to read the arguments of the command line
+import sys # to return the error code
+
+# Import custom functions
+# ------------------------------------------
+from database_config import connect_to_database
+from main_writer_database import unique_keys, find_missing_unique_keys
+
+
+# ==============================
+# Statements
+# ==============================
+
+# Make the ALTER TABLE statement of one table (None if the key can't be added)
+# ------------------------------------------
+def make_statement(cursor, table, duplicates_to_display=10):
+    key_column = unique_keys[table]
+
+    # 1. The column
+    # -------------------------
+    column = find_column(cursor, table, key_column)
+    column_type, column_null = column[1], column[2]
+    if isinstance(column_type, bytes):
+        column_type = column_type.decode()
+
+    # 2. The names inserted more than once
+    # -------------------------
+    cursor.execute(f"SELECT {key_column}, COUNT(*) FROM {table} WHERE {key_column} IS NOT NULL GROUP BY {key_column} HAVING COUNT(*) > 1 ORDER BY COUNT(*) DESC")
+    duplicates = cursor.fetchall()
+    if duplicates:
+        print(f"{table}: {len(duplicates)} names are in the table more than once, merge them before adding the key (see README.md):")
+        for name, count in duplicates[:duplicates_to_display]:
+            print(f"    {name!r}: {count} rows")
+        if len(duplicates) > duplicates_to_display:
+            print(f"    ... and {len(duplicates) - duplicates_to_display} more")
+        return None
+
+    # 3. The statement (a TEXT column becomes VARCHAR: a key on the beginning of the name only would take different names for the same name)
+    # -------------------------
+    changes = []
+    if "text" in column_type.lower() or "blob" in column_type.lower():
+        cursor.execute(f"SELECT COALESCE(MAX(CHAR_LENGTH({key_column})), 0) FROM {table}")
+        length = max(255, int(cursor.fetchone()[0]))
+        changes.append(f"MODIFY {key_column} VARCHAR({length}) {'NULL' if column_null == 'YES' else 'NOT NULL'}")
+        print(f"{table}: the column {key_column} ({column_type}) is changed to VARCHAR({length})")
+    changes.append(f"ADD UNIQUE KEY {key_column} ({key_column})")
+
+    return f"ALTER TABLE {table} {', '.join(changes)};"
+
+
+def find_column(cursor, table, column_name):
+    cursor.execute(f"SHOW COLUMNS FROM {table} LIKE %s", (column_name,))
+    return cursor.fetchone()
+
+
+
+# ==============================
+# Migration
+# ==============================
+
+def migrate(apply=False):
+    connection = connect_to_database()
+    cursor = connection.cursor(buffered=True)
+    still_missing = []
+
+    try:
+        for table in find_missing_unique_keys(cursor, list(unique_keys)):
+            if not find_column(cursor, table, unique_keys[table]):
+                print(f"{table}: no column {unique_keys[table]}, skipped")
+                continue
+
+            statement = make_statement(cursor, table)
+            if statement is None:
+                still_missing.append(table)
+                continue
+
+            print(statement)
+            if apply:
+                cursor.execute(statement)
+                print(f"{table}: unique key added")
+            else:
+                still_missing.append(table)
+
+        if still_missing:
+            print(f"Tables without unique key: {', '.join(still_missing)}{'' if apply else ' (dry run, use --apply to run the statements)'}")
+        else:
+            print("All the shared tables have their unique keys")
+
+    finally:
+        cursor.close()
+        connection.close()
+
+    return not still_missing
+
+
+
+# ==============================
+# Processing
+# ==============================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add the unique keys of the shared tables of names (needed to process documents in parallel).")
+    parser.add_argument("--apply", action="store_true", help="run the ALTER TABLE statements (by default, they are only displayed)")
+    arguments = parser.parse_args()
+
+    success = migrate(arguments.apply)
+    sys.exit(0 if success else 1)
@@ -4,11 +4,14 @@ Module: postprocessing_2_person_name_and_role.py
 Description:
 Process persons names and roles before to create the standardized persons names and roles. 
 After this, these standardized persons names and roles must me verified and modified if needed.
+The names and roles are inserted with get_or_create() (see main_writer_database.py): with the unique keys on person_name_standardized and person_role_name_standardized (see migrate_unique_keys.py), a name is never inserted twice, even if this script is run at the same time as another one.
+Without these keys, a warning is displayed and the names are inserted as before (do not run this script twice at the same time).
 """
 
 # Import custom functions
 # ------------------------------------------
 from database_config import connect_to_database
+from main_writer_database import get_or_create, check_unique_keys
 
 
 # =========================================================================
@@ -33,17 +36,9 @@ def process_person_name_and_role(cursor):
         participant_name = participant_name_tuple[0] # type: ignore  # Extracting the value from the tuple
 
         if participant_name: # to exclude null values
-            # Check if the participant name doesn't already exist in the "person" table
-            cursor.execute("SELECT person_id FROM person WHERE person_name_standardized = %s", (participant_name,)) # type: ignore
-            existing_person = cursor.fetchone()
-
-            if not existing_person:
-                # Insert the participant name into the "person" table
-                cursor.execute("INSERT INTO person (person_name_standardized, person_type_id) VALUES (%s, %s)", (participant_name, 1)) # type: ignore
-                #  person_type_id = 1 (natural person)
-                person_id = cursor.lastrowid  # Retrieve auto-incremented ID
-            else:
-                person_id = existing_person[0]  # Get the existing person ID # type: ignore
+            # Find the participant name in the "person" table, or insert it if it doesn't already exist
+            person_id = get_or_create(cursor, "person", "person_id", {"person_name_standardized": participant_name, "person_type_id": 1})
+            #  person_type_id = 1 (natural person)
 
             # Update the "person_id" column in the "participant" table
             cursor.execute("UPDATE participant SET person_id = %s WHERE participant_name_extracted = %s", (person_id, participant_name)) # type: ignore
@@ -65,17 +60,8 @@ def process_person_name_and_role(cursor):
             for role_tuple in participant_roles:
                 role = role_tuple[0] # type: ignore
                 if role:
-                    # Check if the role doesn't already exist in the "person_role" table
-                    cursor.execute("SELECT person_role_id FROM person_role WHERE person_role_name_standardized = %s", (role,)) # type: ignore
-                    existing_role = cursor.fetchone()
-
-                    if not existing_role:
-                        # Insert the role into the "person_role" table
-                        cursor.execute("INSERT INTO person_role (person_role_name_standardized) VALUES (%s)", (role,)) # type: ignore
-                        #  Retrieve auto-incremented ID for the newly inserted role
-                        role_id = cursor.lastrowid
-                    else:
-                        role_id = existing_role[0]  # Get the existing role ID # type: ignore
+                    # Find the role in the "person_role" table, or insert it if it doesn't already exist
+                    role_id = get_or_create(cursor, "person_role", "person_role_id", {"person_role_name_standardized": role})
 
                     # Insert the participant role into the "person_occupation" table
                     cursor.execute("INSERT INTO person_occupation (person_id, person_role_id) VALUES (%s, %s)", (person_id, role_id)) # type: ignore
@@ -97,6 +83,9 @@ connection = connect_to_database()
 # create a cursor object
 cursor = connection.cursor(buffered=True)
 
+# check the unique keys of the names (see README.md)
+check_unique_keys(cursor, ["person", "person_role"], required=False)
+
 # execute function
 process_person_name_and_role(cursor)
 
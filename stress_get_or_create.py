@@ -0,0 +1,290 @@
+"""
+Module: stress_get_or_create.py
+
+Description:
+Check that get_or_create() (main_writer_database.py) never inserts the same name twice when many processes insert the same names at the same time.
+
+The script creates a temporary table with a unique key on the name (and, to compare, a table without key filled with the old "SELECT, then INSERT if not found"), then starts --processes writer processes.
+In each round, all the writers take the same --names new names in a random order and find or insert each one, with a commit after each name (as many processes processing documents with the same new rubrics).
+At the end:
+- each name must be only once in the table with the unique key;
+- all the writers must have received the same id for the same name, and this id must be the id of the name in the table.
+The number of names inserted twice in the table without key is only displayed (it shows the problem solved by the unique key).
+
+Then the same is done with insert_rubric_subrubric() on temporary tables of rubrics (extracted and standardized names, with the link between them), in long transactions as during the processing of a document:
+each writer first reads the table (the data of its transaction is then read as it was at this moment, REPEATABLE READ), waits for the other writers, then inserts the same new rubrics. So a writer often gets the id of a rubric inserted by another writer after its first read.
+Each writer must finish without error, each name must be only once in the tables, and each extracted name must be linked to its standardized name.
+The temporary tables are dropped at the end. The script returns an error code if one check fails.
+Use a test database (see database_config.py), not the database of the project.
+
+    >>> python stress_get_or_create.py
+    >>> python stress_get_or_create.py --processes 16 --names 500 --rounds 10
+
+"""
+
+# Import libraries
+# ------------------------------------------
+import argparse # to read the arguments of the command line
+import multiprocessing # to start the writer processes
+import random # to shuffle the names
+import sys # to return the error code
+import time # to measure the processing time
+
+# Import custom functions
+# ------------------------------------------
+from database_config import connect_to_database
+from main_writer_database import get_or_create, check_unique_keys, unique_keys, insert_rubric_subrubric
+
+
+# ==============================
+# Temporary tables
+# ==============================
+
+unique_table = "stress_name_unique"
+plain_table = "stress_name_plain" # without unique key (old way)
+name_column = "name_standardized"
+rubric_category = "stress_rubric" # tables stress_rubric_extracted and stress_rubric_standardized (as rubric_extracted and rubric_standardized)
+
+
+def create_tables(connection):
+    cursor = connection.cursor(buffered=True)
+    drop_tables(connection)
+    cursor.execute(f"CREATE TABLE {unique_table} (name_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY, {name_column} VARCHAR(255) NOT NULL, UNIQUE KEY {name_column} ({name_column}))")
+    cursor.execute(f"CREATE TABLE {plain_table} (name_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY, {name_column} VARCHAR(255) NOT NULL)")
+    cursor.execute(f"CREATE TABLE {rubric_category}_standardized ({rubric_category}_standardized_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY, {rubric_category}_name_standardized VARCHAR(255) NOT NULL, UNIQUE KEY {rubric_category}_name_standardized ({rubric_category}_name_standardized))")
+    cursor.execute(f"CREATE TABLE {rubric_category}_extracted ({rubric_category}_extracted_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY, {rubric_category}_name_extracted VARCHAR(255) NOT NULL, {rubric_category}_standardized_id INT NULL, UNIQUE KEY {rubric_category}_name_extracted ({rubric_category}_name_extracted))")
+    connection.commit()
+    cursor.close()
+
+
+def drop_tables(connection):
+    cursor = connection.cursor(buffered=True)
+    cursor.execute(f"DROP TABLE IF EXISTS {unique_table}")
+    cursor.execute(f"DROP TABLE IF EXISTS {plain_table}")
+    cursor.execute(f"DROP TABLE IF EXISTS {rubric_category}_extracted")
+    cursor.execute(f"DROP TABLE IF EXISTS {rubric_category}_standardized")
+    connection.commit()
+    cursor.close()
+
+
+
+# ==============================
+# Writer processes
+# ==============================
+
+# Find or insert the names (with a commit after each name) and return the id received for each name
+# ------------------------------------------
+"""
+A deadlock (MySQL error 1213) cancels the transaction: the name is then found or inserted again (counted in "retries").
+"""
+def run_writer(task):
+    names, seed = task
+    add_unique_keys()
+
+    connection = connect_to_database()
+    cursor = connection.cursor(buffered=True)
+    randomizer = random.Random(seed)
+    received_ids = {}
+    retries = 0
+
+    # 1. With get_or_create() and the unique key
+    # -------------------------
+    for name in randomizer.sample(names, len(names)):
+        while True:
+            try:
+                received_ids[name] = get_or_create(cursor, unique_table, "name_id", {name_column: name})
+                connection.commit()
+                break
+            except Exception as error:
+                if getattr(error, "errno", None) != 1213:
+                    raise
+                connection.rollback()
+                retries += 1
+
+    # 2. Old way: SELECT, then INSERT if not found (without unique key)
+    # -------------------------
+    for name in randomizer.sample(names, len(names)):
+        cursor.execute(f"SELECT name_id FROM {plain_table} WHERE {name_column} = %s", (name,))
+        if not cursor.fetchone():
+            cursor.execute(f"INSERT INTO {plain_table} ({name_column}) VALUES (%s)", (name,))
+        connection.commit()
+
+    cursor.close()
+    connection.close()
+    return received_ids, retries
+
+
+# Insert the same new rubrics in long transactions, after a first read (see the description at the beginning of this file)
+# ------------------------------------------
+"""
+The errors are put in the queue results with the number of retries after a deadlock (the deadlock cancels the transaction, which is then done again).
+"""
+def run_rubric_writer(rubrics_by_round, seed, barrier, results):
+    add_unique_keys()
+    connection = connect_to_database()
+    cursor = connection.cursor(buffered=True)
+    randomizer = random.Random(seed)
+    errors = []
+    retries = 0
+
+    for round_number, rubrics in enumerate(rubrics_by_round):
+        rubrics = randomizer.sample(rubrics, len(rubrics))
+        first_try = True
+        while True:
+            try:
+                # first read of the transaction
+                cursor.execute(f"SELECT COUNT(*) FROM {rubric_category}_extracted")
+                cursor.fetchall()
+                if first_try:
+                    barrier.wait(60) # all the writers have read the table before the new rubrics are inserted
+                    first_try = False
+
+                for name_extracted, name_standardized in rubrics:
+                    insert_rubric_subrubric(cursor, name_extracted, name_standardized, rubric_category)
+                connection.commit()
+                break
+            except Exception as error:
+                connection.rollback()
+                if getattr(error, "errno", None) != 1213:
+                    errors.append(f"round {round_number}: {type(error).__name__}: {error}")
+                    break
+                retries += 1
+
+    cursor.close()
+    connection.close()
+    results.put((errors, retries))
+
+
+def add_unique_keys():
+    unique_keys[unique_table] = name_column
+    unique_keys[f"{rubric_category}_extracted"] = f"{rubric_category}_name_extracted"
+    unique_keys[f"{rubric_category}_standardized"] = f"{rubric_category}_name_standardized"
+
+
+
+# ==============================
+# Checks
+# ==============================
+
+def run_stress(processes=8, count_names=200, rounds=5, seed=0):
+    failures = []
+    connection = connect_to_database()
+    create_tables(connection)
+    cursor = connection.cursor(buffered=True)
+
+    try:
+        add_unique_keys()
+        check_unique_keys(cursor, [unique_table, f"{rubric_category}_extracted", f"{rubric_category}_standardized"])
+
+        start_time = time.perf_counter()
+        total_retries = 0
+        with multiprocessing.Pool(processes) as pool:
+            for round_number in range(rounds):
+                # new names in each round, so that all the writers insert them at the same time
+                names = [f"Nomen {round_number} {name_number}" for name_number in range(count_names)]
+                tasks = [(names, seed * 1000003 + round_number * processes + writer) for writer in range(processes)]
+                writer_results = pool.map(run_writer, tasks)
+
+                cursor.execute(f"SELECT {name_column}, name_id FROM {unique_table} WHERE {name_column} LIKE %s", (f"Nomen {round_number} %",))
+                table_ids = {}
+                for name, name_id in cursor.fetchall():
+                    if name in table_ids:
+                        failures.append(f"round {round_number}: '{name}' inserted twice (ids {table_ids[name]} and {name_id})")
+                    table_ids[name] = name_id
+                connection.commit() # new snapshot for the next round
+
+                if len(table_ids) != count_names:
+                    failures.append(f"round {round_number}: {len(table_ids)} names in the table instead of {count_names}")
+                for writer, (received_ids, retries) in enumerate(writer_results):
+                    total_retries += retries
+                    wrong_names = [name for name in names if received_ids.get(name) != table_ids.get(name)]
+                    if wrong_names:
+                        failures.append(f"round {round_number}, writer {writer}: wrong id for {len(wrong_names)} names (e.g. '{wrong_names[0]}')")
+
+        elapsed_seconds = time.perf_counter() - start_time
+
+        cursor.execute(f"SELECT COUNT(*) FROM (SELECT {name_column} FROM {plain_table} GROUP BY {name_column} HAVING COUNT(*) > 1) AS duplicates")
+        plain_duplicates = cursor.fetchone()[0]
+
+        print(f"{processes} writers, {rounds} rounds of {count_names} new names: {elapsed_seconds:.2f} s, {total_retries} retries after a deadlock")
+        print(f"    with get_or_create() and the unique key: {'FAILED' if failures else 'each name inserted once, same id for all writers'}")
+        print(f"    old way (SELECT, then INSERT) without unique key: {plain_duplicates} names inserted more than once")
+
+        failures.extend(run_rubric_stress(connection, processes, count_names, rounds, seed))
+
+    finally:
+        cursor.close()
+        drop_tables(connection)
+        connection.close()
+
+    if failures:
+        print(f"{len(failures)} checks failed:")
+        for failure in failures[:20]:
+            print(f"    {failure}")
+
+    return not failures
+
+
+# Insert the same new rubrics with insert_rubric_subrubric() in many writers (see the description at the beginning of this file)
+# ------------------------------------------
+def run_rubric_stress(connection, processes, count_names, rounds, seed):
+    failures = []
+    cursor = connection.cursor(buffered=True)
+
+    # the same new rubrics in each round for all writers, with a few standardized names for many extracted names
+    rubrics_by_round = [[(f"Rubrica {round_number} {name_number}", f"Rubrica standardized {round_number} {name_number % 10}") for name_number in range(count_names)] for round_number in range(rounds)]
+
+    start_time = time.perf_counter()
+    barrier = multiprocessing.Barrier(processes)
+    results = multiprocessing.Queue()
+    writers = [multiprocessing.Process(target=run_rubric_writer, args=(rubrics_by_round, seed * 1000003 + writer, barrier, results)) for writer in range(processes)]
+    for writer in writers:
+        writer.start()
+    writer_results = [results.get() for _ in writers]
+    for writer in writers:
+        writer.join()
+    elapsed_seconds = time.perf_counter() - start_time
+
+    total_retries = 0
+    for writer, (errors, retries) in enumerate(writer_results):
+        total_retries += retries
+        failures.extend(f"rubrics, writer {writer}, {error}" for error in errors)
+
+    connection.commit() # new snapshot to read the result
+    cursor.execute(f"SELECT {rubric_category}_name_standardized, {rubric_category}_standardized_id FROM {rubric_category}_standardized")
+    standardized_ids = dict(cursor.fetchall())
+    cursor.execute(f"SELECT {rubric_category}_name_extracted, COUNT(*), MAX({rubric_category}_standardized_id) FROM {rubric_category}_extracted GROUP BY {rubric_category}_name_extracted")
+    extracted_rows = {name: (count, standardized_id) for name, count, standardized_id in cursor.fetchall()}
+    cursor.close()
+
+    for rubrics in rubrics_by_round:
+        for name_extracted, name_standardized in rubrics:
+            count, standardized_id = extracted_rows.get(name_extracted, (0, None))
+            if count != 1:
+                failures.append(f"rubrics: '{name_extracted}' is {count} times in the table")
+            elif standardized_id != standardized_ids.get(name_standardized):
+                failures.append(f"rubrics: '{name_extracted}' is not linked to '{name_standardized}'")
+    if len(standardized_ids) != rounds * min(count_names, 10):
+        failures.append(f"rubrics: {len(standardized_ids)} standardized names in the table instead of {rounds * min(count_names, 10)}")
+
+    print(f"{processes} writers, {rounds} rounds of {count_names} new rubrics with insert_rubric_subrubric() in long transactions: {elapsed_seconds:.2f} s, {total_retries} retries after a deadlock")
+    print(f"    {'FAILED' if failures else 'each rubric inserted once and linked to its standardized name, no error'}")
+
+    return failures
+
+
+
+# ==============================
+# Processing
+# ==============================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that get_or_create() inserts each name only once with many writer processes at the same time.")
+    parser.add_argument("--processes", type=int, default=8, help="number of writer processes")
+    parser.add_argument("--names", type=int, default=200, help="number of new names in each round")
+    parser.add_argument("--rounds", type=int, default=5, help="number of rounds")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the order of the names")
+    arguments = parser.parse_args()
+
+    success = run_stress(arguments.processes, arguments.names, arguments.rounds, arguments.seed)
+    sys.exit(0 if success else 1)